@@ -1,40 +1,29 @@
-from typing import TypedDict, List
+import os
 from langchain_core.messages import HumanMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langgraph.graph import StateGraph, START,END
+from agent_graphs import build_simple_bot
+from models import get_chat_model, get_embeddings
+from response_cache import ResponseCache
+from tracing import instrument, tracer_from_env
+from token_stream import print_stream, stream_tokens
 from dotenv import load_dotenv
 load_dotenv()
 
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
+# repeated (and with RESPONSE_CACHE_SIMILARITY=0.95, near identical) prompts are answered from disk without calling the model
+similarity = os.getenv("RESPONSE_CACHE_SIMILARITY")
+cache = ResponseCache(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "response_cache.sqlite3"),
+    ttl=7 * 24 * 3600,
+    max_entries=10_000,
+    embeddings=get_embeddings() if similarity else None,
+    similarity_threshold=float(similarity) if similarity else None
+)
+llm = get_chat_model("gemini-2.5-flash", cassette="simple_llm_bot", cache=cache)
 
-class AgentState(TypedDict):
-    messsages: List[HumanMessage]
-
-def process(state:AgentState)->AgentState:
-    response = llm.invoke(input=state['messsages'])
-    print(f"AI: {response.content}")
-    return state
-
-graph = StateGraph(AgentState)
-graph.add_node("process",process)
-graph.add_edge(START,'process')
-graph.add_edge('process', END)
-agent = graph.compile()
+# the graph (one node calling the model) is in agent_graphs, shared with the benchmarks
+agent = instrument(build_simple_bot(llm), tracer_from_env()) # AGENT_TRACE=jsonl:traces.jsonl to record spans
 
 user_input = input("say something: ")
 while user_input != "exit":
-    res = agent.invoke(
-        {
-            'messsages':[HumanMessage(content=user_input)]
-        }
-    )
-    # print(res)
+    print_stream(stream_tokens(agent, {'messsages':[HumanMessage(content=user_input)]}))
     user_input = input("say something: ")
-        
-'''
-output:
-
-say something: hello
-AI: Hello! How can I help you today?
-{'messsages': [HumanMessage(content='hello', additional_kwargs={}, response_metadata={})]}
-'''
\ No newline at end of file
+print(f"response cache: {cache.stats()}")
@@ -1,37 +1,36 @@
+import os
+import sys
 from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage, AIMessage
-from langgraph.graph import StateGraph, START, END
-from langchain_google_genai import ChatGoogleGenerativeAI
-from typing import TypedDict, List, Union
+from langchain_core.messages import HumanMessage
+from agent_graphs import build_memory_agent
+from history_window import HistoryWindow
+from models import get_chat_model
+from sqlite_checkpointer import SQLiteSaver
+from tracing import instrument, tracer_from_env
+from token_stream import print_stream, stream_tokens
 load_dotenv()
 
-class AgentState(TypedDict):
-    messages:List[Union[HumanMessage, AIMessage]]
+llm = get_chat_model("gemini-2.5-flash", cassette="agent_with_memory")
+# newest turns go verbatim, older ones get folded into a rolling summary so the prompt stays bounded
+history_window = HistoryWindow(llm, max_tokens=2000)
 
-llm = ChatGoogleGenerativeAI(model = "gemini-2.5-flash")
+# sessions are persisted in sqlite, keyed by thread id, so they survive restarts
+checkpointer = SQLiteSaver(os.path.join(os.path.dirname(__file__), "memory_sessions.sqlite3"))
 
-def process(state:AgentState)->AgentState:
-    res = llm.invoke(state['messages'])
-    state['messages'].append(AIMessage(content=res.content))
-    print(f'AI: {res.content}')
-    return state
+# the tokens reach the terminal through stream_tokens while they are generated, the graph is in agent_graphs
+agent = instrument(build_memory_agent(llm, history_window, checkpointer, verbose=True), tracer_from_env()) # AGENT_TRACE=jsonl:traces.jsonl to record spans
 
-graph = StateGraph(AgentState)
-graph.add_node("process", process)
-graph.set_entry_point('process')
-graph.set_finish_point('process')
-agent = graph.compile()
-
-conversation_history=[]
+# python 2-agent_with_memory.py <session id>, same id = same conversation
+session_id = sys.argv[1] if len(sys.argv) > 1 else "default"
+config = {"configurable": {"thread_id": session_id}}
+previous = checkpointer.get_messages(session_id, limit=2)
+if previous:
+    print(f"resuming session '{session_id}', last message: {previous[-1].content}")
 
 user_input = input("you: ")
 while user_input != "exit":
-    conversation_history.append(HumanMessage(content=user_input))
-    result = agent.invoke({
-        'messages':conversation_history
-    })
-    print(result['messages'])
-    conversation_history = result['messages']
+    # only the new message is sent, the rest of the conversation comes from the checkpointer
+    print_stream(stream_tokens(agent, {'messages':[HumanMessage(content=user_input)]}, config))
     user_input = input("you: ")
 
 '''
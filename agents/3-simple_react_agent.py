@@ -1,84 +1,24 @@
-from typing import TypedDict, List, Sequence, Annotated
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langgraph.graph import StateGraph, START, END
-from langchain_core.messages import HumanMessage, ToolMessage, AIMessage, SystemMessage, BaseMessage
-from langchain_core.tools import tool
-from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode
+from langchain_core.messages import HumanMessage
+from agent_graphs import MATH_TOOLS, MessagesState, build_react_agent
+from tool_plan import make_plan_tool
+from models import get_chat_model
+from tracing import instrument, tracer_from_env
+from token_stream import print_stream, stream_tokens
 from dotenv import load_dotenv
 load_dotenv()
 
-class AgentState(TypedDict):
-    messages: Annotated[Sequence[BaseMessage], add_messages]
+# add, subtract and multiply; run_plan lets the model send a whole chain of dependent calls at once,
+# executed locally in one tools step
+current_tools = MATH_TOOLS + [make_plan_tool(MATH_TOOLS)]
+model = get_chat_model("gemini-2.5-flash", cassette="react_agent")
 
-@tool
-def add(a: int, b: int) -> int:
-    """
-    Adds two integers.
-    """
-    return a + b
+# model <-> tools loop from agent_graphs, independent calls in one turn run concurrently
+app = instrument(build_react_agent(model, current_tools), tracer_from_env()) # AGENT_TRACE=jsonl:traces.jsonl to record spans
 
-@tool
-def subtract(a: int, b: int) -> int:
-    """
-    Subtracts two integers (a - b).
-    """
-    return a - b
 
-@tool
-def multiply(a: int, b: int) -> int:
-    """
-    Multiplies two integers.
-    """
-    return a * b
-
-current_tools=[add, subtract, multiply]
-model = ChatGoogleGenerativeAI(model="gemini-2.5-flash").bind_tools(current_tools)
-
-def model_call(state:AgentState)->AgentState:
-    system_prompt = SystemMessage(
-        content="You are my AI assistant, please answer my query to the best of your ability."
-    )
-    result = model.invoke([system_prompt] + state['messages']) # type: ignore
-    return {"messages":[result]} # since we;re using the reducer function in annotated type, this is enough for automatic appending and updation
-
-
-def should_continue(state:AgentState)->str:
-    messages = state['messages']
-    last_message = messages[-1]
-    if not last_message.tool_calls: # type: ignore
-        return "end"
-    return "continue"
-
-graph=StateGraph(AgentState)
-graph.add_node("model",model_call)
-graph.set_entry_point("model")
-
-tool_node = ToolNode(tools=current_tools)
-graph.add_node("tools",tool_node)
-
-graph.add_conditional_edges(
-    "model",
-    should_continue,
-    {
-        "end":END,
-        "continue":"tools"
-    }
-)
-graph.add_edge("tools","model")
-app = graph.compile()
-
-
-def stream_message(stream):
-    for s in stream:
-        message = s["messages"][-1]
-        if isinstance(message,tuple):
-            print(message)
-        else:
-            message.pretty_print()
-
-input = AgentState(messages=[HumanMessage("add 3 and 4. multiply their result by 6. subtract 5 from the final result. then say a maths joke")])
-stream_message(app.stream(input, stream_mode="values"))
+input = MessagesState(messages=[HumanMessage("add 3 and 4. multiply their result by 6. subtract 5 from the final result. then say a maths joke")])
+# tokens as they are generated, with a line per tool start/end
+print_stream(stream_tokens(app, input))
 
 '''
 OUTPUT:
@@ -1,93 +1,22 @@
-from typing import Annotated, Sequence, TypedDict
-from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, ToolMessage
-from langgraph.graph import StateGraph, START, END
-from langgraph.prebuilt import ToolNode
-from langgraph.graph.message import add_messages
-from langchain.tools import tool
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.messages import ToolMessage
+from agent_graphs import build_drafter_agent
+from document_store import VersionedDocument
+from models import get_chat_model
+from tracing import instrument, tracer_from_env
 from dotenv import load_dotenv
 load_dotenv()
 
-document_content=""
-
-class AgentState(TypedDict):
-    messages: Annotated[Sequence[BaseMessage],add_messages]
-
-@tool
-def update(content:str)->str:
-    """
-    Updates the document with the provided content
-    """
-    global document_content
-    document_content = content
-    return f"Document content successfully updated. The current document is : {document_content}"
-
-@tool
-def save(filename:str):
-    """
-    Saves the current document with the given filename and ends the process.
-    Args:
-        filename:str => Name for the text file
-    """
-    if not filename.endswith(".txt"):
-        filename+=".txt"
-    try:
-        global document_content
-        with open(filename, "w", encoding="utf-8") as file:
-            file.write(document_content)
-        print(f"Document saved with the filename: {filename}")
-        return f"Document saved with the filename: {filename}"
-    except Exception as e:
-        return f"Error: {str(e)}"
-
-drafting_tools = [update, save]
-model = ChatGoogleGenerativeAI(model="gemini-2.5-flash").bind_tools(drafting_tools)
-
-def our_agent(state: AgentState) -> AgentState:
-    system_prompt = SystemMessage(
-        content=f"""
-                You are Drafter, a helpful writing assistant. You are going to help the user update and modify documents.
-                
-                - If the user wants to update or modify content, use the 'update' tool with the complete updated content.
-                - If the user wants to save and finish, you need to use the 'save' tool.
-                - Make sure to always show the current document state after modifications.
-                
-                The current document content is:{document_content}
-                """
-    )
-    if not state["messages"]:
-        user_input = "Im ready to help you update my document. What would you like to create?"
-        user_message = HumanMessage(content=user_input)
-    else:
-        user_input = input("\nWhat would you like to do with the document?")
-        print(f"user: {user_input}")
-        user_message = HumanMessage(user_input)
-    all_messages = [system_prompt] + list(state['messages']) + [user_message]
-    response = model.invoke(all_messages)
-
-    print(f"\n🤖 AI: {response.content}")
-    if hasattr(response, "tool_calls") and response.tool_calls:
-        print(f"🔧 USING TOOLS: {[tc['name'] for tc in response.tool_calls]}")
-
-    return {"messages": list(state["messages"]) + [user_message, response]}
-
-def should_continue(state:AgentState)->str:
-    """Determine if we should continue or end the conversation."""
-
-    messages = state["messages"]
-    
-    if not messages:
-        return "continue"
-    
-    # This looks for the most recent tool message....
-    for message in reversed(messages):
-        # ... and checks if this is a ToolMessage resulting from save
-        if (isinstance(message, ToolMessage) and 
-            "saved" in message.content.lower() and # type: ignore
-            "document" in message.content.lower()): # type: ignore
-            return "end" # goes to the end edge which leads to the endpoint
-        
-    return "continue"
+# versioned document, edits are small line patches instead of the whole text
+document = VersionedDocument()
+
+def ask()->str:
+    user_input = input("\nWhat would you like to do with the document?")
+    print(f"user: {user_input}")
+    return user_input
+
+# tools, prompt and graph are in agent_graphs, shared with the benchmarks
+model = get_chat_model("gemini-2.5-flash", cassette="drafter_agent")
+app = instrument(build_drafter_agent(model, document, ask, verbose=True), tracer_from_env()) # AGENT_TRACE=jsonl:traces.jsonl to record spans
 
 
 def print_messages(messages):
@@ -100,28 +29,6 @@ def print_messages(messages):
             print(f"\n TOOL RESULT: {message.content}")
 
 
-graph = StateGraph(AgentState)
-
-graph.add_node("agent", our_agent)
-graph.add_node("tools", ToolNode(drafting_tools))
-
-graph.set_entry_point("agent")
-
-graph.add_edge("agent", "tools")
-
-
-graph.add_conditional_edges(
-    "tools",
-    should_continue,
-    {
-        "continue": "agent",
-        "end": END,
-    },
-)
-
-app = graph.compile()
-
-
 def run_document_agent():
     print("\n ===== DRAFTER =====")
     
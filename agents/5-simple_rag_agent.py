@@ -1,145 +1,22 @@
 import os
-from typing import TypedDict, Annotated, Sequence, Union
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langgraph.graph.message import add_messages
-from langgraph.graph import START, END, StateGraph
-from langchain_core.messages import BaseMessage, AIMessage, ToolMessage, SystemMessage, HumanMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_google_genai.embeddings import GoogleGenerativeAIEmbeddings
-from langgraph.prebuilt import ToolNode
+import time
+_started = time.perf_counter()
+from langchain_core.messages import HumanMessage
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_chroma import Chroma
-from langchain.tools import tool
+from rag_resources import RagResources
+from token_stream import print_stream, stream_tokens
 load_dotenv()
 
-#setup
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.1)
-embeddings = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
-
-#load the pdf
-# pdf_path = os.path.dirname(__file__).join("stock_data.pdf")
-pdf_path = "./stock_data.pdf"
-print(pdf_path)
-if not os.path.exists(pdf_path):
-    raise FileNotFoundError(f"PDF file not found: {pdf_path}")
-pdf_loader = PyPDFLoader(pdf_path)
-
-try:
-    pages = pdf_loader.load()
-    print(f"PDF has been loaded and has {len(pages)} pages")
-except Exception as e:
-    print(f"Error loading PDF: {e}")
-    raise
-
-#chunking
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size = 1000,
-    chunk_overlap = 200
-)
-pages_split = text_splitter.split_documents(pages)
-
-#chroma
-persist_directory = os.path.dirname(__file__)
-collection_name = "stock_data"
-if not os.path.exists(persist_directory):
-    os.makedirs(persist_directory)
-
-try:
-    vector_store = Chroma.from_documents(
-        documents=pages_split,
-        embedding=embeddings,
-        persist_directory=persist_directory,
-        collection_name=collection_name
-    )
-    print(f"Created ChromaDB vector store!")
-except Exception as e:
-    print(f"Error setting up ChromaDB: {str(e)}")
-    raise
-
-# retriever
-retriever = vector_store.as_retriever(
-    search_type="similarity",
-    search_kwargs={"k":5}
-)
-
-#tool definition
-@tool
-def retriever_tool(query:str)->str:
-    """
-    This tool searches and returns the information from the Stock Market Performance 2024 document.
-    """
-    docs = retriever.invoke(query)
-    if not docs:
-        return "I found no relevant information in the Stock Market Performance 2024 document."
-    results = []
-    for i , doc in enumerate(docs):
-        results.append(f"Document {i+1}:\n{doc.page_content}")
-    return "\n\n".join(results)
-
-tools = [retriever_tool]
-tools_dict = {our_tool.name: our_tool for our_tool in tools}
-llm = llm.bind_tools(tools)
-
-# graph state and router function
-class AgentState(TypedDict):
-    messages:Annotated[Sequence[BaseMessage],add_messages]
-
-def should_continue(state:AgentState)->bool:
-    result = state['messages'][-1]
-    return hasattr(result, "tool_calls") and len(result.tool_calls) > 0 #type:ignore
-
-
-# llm calling node definition
-system_prompt = """
-You are an intelligent AI assistant who answers questions about Stock Market Performance in 2024 based on the PDF document loaded into your knowledge base.
-Use the retriever tool available to answer questions about the stock market performance data. You can make multiple calls if needed.
-If you need to look up some information before asking a follow up question, you are allowed to do that!
-Please always cite the specific parts of the documents you use in your answers.
-"""
-def call_llm(state:AgentState)->AgentState:
-    """Function to call the LLM with the current state."""
-    messages = list(state["messages"])
-    messages = [SystemMessage(content=system_prompt)] + messages
-    result = llm.invoke(messages)
-    return {"messages":[result]}
-
-def take_action(state:AgentState)->AgentState:
-    """Execute tool calls from the LLM's response."""
-    tool_calls = state["messages"][-1].tool_calls #type:ignore
-    results = []
-    for t in tool_calls:
-        print(f"Calling Tool: {t['name']} with query: {t['args'].get('query', 'No query provided')}")
-        if not t['name'] in tools_dict: # Checks if a valid tool is present
-            print(f"\nTool: {t['name']} does not exist.")
-            result = "Incorrect Tool Name, Please Retry and Select tool from List of Available tools."
-        else:
-            result = tools_dict[t['name']].invoke(t['args'].get('query', ''))
-            print(f"Result length: {len(str(result))}")
-        results.append(ToolMessage(tool_call_id=t['id'], name=t['name'], content=str(result)))
-    print("Tools Execution Complete. Back to the model!")
-    return {'messages': results}
-
-#making the actual graph finally
-
-graph = StateGraph(AgentState)
-graph.add_node("call_llm",call_llm)
-graph.add_node("retriever_node", take_action)
-graph.set_entry_point("call_llm")
-graph.add_conditional_edges(
-    "call_llm",
-    should_continue,
-    {
-        True:"retriever_node",
-        False:END
-    }
-)
-graph.add_edge("retriever_node","call_llm")
-rag_agent = graph.compile()
+# models, chroma, the ingest check and the graph are built on first use (or by warm_up), not at import,
+# so starting the process is cheap and an unchanged PDF is never re-read
+# RAG_CORPUS_DIR=./reports serves a whole directory of reports from a sharded corpus instead of the one PDF
+resources = RagResources(pdf_path="./stock_data.pdf", collection_name="stock_data", verbose=True, corpus_dir=os.getenv("RAG_CORPUS_DIR"))
 
 # runner function
 def running_agent():
-    print("\n=== RAG AGENT===")
+    if os.getenv("RAG_WARMUP") == "1":
+        resources.warm_up()
+    print(f"\n=== RAG AGENT=== (started in {time.perf_counter() - _started:.2f}s)")
     
     while True:
         user_input = input("\nWhat is your question: ")
@@ -148,10 +25,11 @@ def running_agent():
             
         messages = [HumanMessage(content=user_input)] # converts back to a HumanMessage type
 
-        result = rag_agent.invoke({"messages": messages})
-        
         print("\n=== ANSWER ===")
-        print(result['messages'][-1].content)
+        print_stream(stream_tokens(resources.agent, {"messages": messages}), prefix="")
+
+    print(f"Retrieval cache: {resources.retrieval_cache.stats()}")
+    print(f"Startup timings (s): {resources.timings}")
 
 
 if __name__ == "__main__":
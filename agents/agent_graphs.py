@@ -0,0 +1,260 @@
+"""
+Graphs of the numbered agents 1 to 4, compiled around any chat model so the scripts, the
+benchmarks and stand-in models all run the same code (the RAG agent's graph is in rag_graph.py).
+The scripts only add the model, the checkpointer, tracing and the terminal loop.
+"""
+import os
+from typing import Annotated, Callable, List, Sequence, TypedDict
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.tools import tool
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode
+
+from document_store import VersionedDocument
+from history_window import HistoryWindow
+from parallel_tools import ParallelToolNode
+from tool_plan import PLAN_PROMPT
+
+
+class MessagesState(TypedDict):
+    messages:Annotated[Sequence[BaseMessage], add_messages]
+
+
+# 1-simple_llm_bot
+class SimpleBotState(TypedDict):
+    messsages:List[HumanMessage]
+
+
+def build_simple_bot(llm):
+    def process(state:SimpleBotState)->SimpleBotState:
+        llm.invoke(input=state['messsages']) # the tokens reach the terminal through stream_tokens
+        return state
+
+    graph = StateGraph(SimpleBotState)
+    graph.add_node("process", process)
+    graph.add_edge(START, 'process')
+    graph.add_edge('process', END)
+    return graph.compile()
+
+
+# 2-agent_with_memory
+class MemoryState(TypedDict):
+    messages:Annotated[Sequence[BaseMessage], add_messages] # the checkpointer only stores the new messages of each step
+    summary:str
+    summarized_upto:int
+
+
+def build_memory_agent(llm, history_window:HistoryWindow, checkpointer=None, verbose:bool=False):
+    """one node: the history window builds the prompt (recent turns + rolling summary), the model answers"""
+
+    def process(state:MemoryState)->MemoryState:
+        prompt, summary, summarized_upto, stats = history_window.build(
+            state['messages'], state.get('summary', ""), state.get('summarized_upto', 0)
+        )
+        res = llm.invoke(prompt)
+        if verbose:
+            print(f"\n(prompt tokens: {stats['prompt_tokens']}, tokens saved: {stats['tokens_saved']})")
+        # the streamed message itself, a copy with a new id would be sent to the token stream a second time
+        return {"messages":[res], "summary":summary, "summarized_upto":summarized_upto}
+
+    graph = StateGraph(MemoryState)
+    graph.add_node("process", process)
+    graph.set_entry_point('process')
+    graph.set_finish_point('process')
+    return graph.compile(checkpointer=checkpointer)
+
+
+# 3-simple_react_agent
+@tool
+def add(a: int, b: int) -> int:
+    """
+    Adds two integers.
+    """
+    return a + b
+
+@tool
+def subtract(a: int, b: int) -> int:
+    """
+    Subtracts two integers (a - b).
+    """
+    return a - b
+
+@tool
+def multiply(a: int, b: int) -> int:
+    """
+    Multiplies two integers.
+    """
+    return a * b
+
+MATH_TOOLS = [add, subtract, multiply]
+
+REACT_PROMPT = "You are my AI assistant, please answer my query to the best of your ability. " + PLAN_PROMPT
+
+
+def build_react_agent(llm, tools, system_prompt:str=REACT_PROMPT):
+    """model <-> tools loop, independent calls of one turn run concurrently"""
+    model = llm.bind_tools(tools)
+
+    def model_call(state:MessagesState)->MessagesState:
+        result = model.invoke([SystemMessage(content=system_prompt)] + list(state['messages']))
+        return {"messages":[result]} # the reducer appends it
+
+    def should_continue(state:MessagesState)->str:
+        last_message = state['messages'][-1]
+        if not last_message.tool_calls: # type: ignore
+            return "end"
+        return "continue"
+
+    graph = StateGraph(MessagesState)
+    graph.add_node("model", model_call)
+    graph.add_node("tools", ParallelToolNode(tools=tools).as_node())
+    graph.set_entry_point("model")
+    graph.add_conditional_edges("model", should_continue, {"end":END, "continue":"tools"})
+    graph.add_edge("tools", "model")
+    return graph.compile()
+
+
+# 4-drafter_agent
+PROMPT_DOCUMENT_CHARS = 1500 # bigger documents are not pasted into the system prompt, the model uses view_document
+
+DRAFTER_PROMPT = """
+                You are Drafter, a helpful writing assistant. You are going to help the user update and modify documents.
+
+                - To create the first draft use the 'write' tool with the complete content.
+                - For changes use 'replace_lines', 'insert_lines' or 'delete_lines' with only the lines that change. Never resend the whole document for a small edit.
+                - Use 'view_document' to read line ranges you can't see, and 'undo' to revert the last change.
+                - If the user wants to save and finish, you need to use the 'save' tool.
+                - After modifications, show the user only the lines that changed.
+
+                The current document (with line numbers) is: {document}
+                """
+
+
+def make_drafting_tools(document:VersionedDocument, directory:str=".", verbose:bool=False)->list:
+    """the drafter's tools, editing `document` in place; save writes into `directory`"""
+
+    def _edit(fn, *args)->str:
+        try:
+            return fn(*args)
+        except ValueError as e:
+            return f"Error: {e}"
+
+    @tool
+    def write(content:str)->str:
+        """
+        Writes the whole document. Only use this to create the first draft or for a complete rewrite,
+        use the line based tools for changes.
+        """
+        return document.set_text(content)
+
+    @tool
+    def view_document(start_line:int=1, end_line:int=0)->str:
+        """
+        Returns the given line range of the document with line numbers. end_line=0 means until the end.
+        """
+        return document.numbered(start_line, end_line or None) or "The document is empty."
+
+    @tool
+    def replace_lines(start_line:int, end_line:int, content:str)->str:
+        """
+        Replaces lines start_line..end_line (inclusive, 1-based) with the given content.
+        """
+        return _edit(document.replace, start_line, end_line, content)
+
+    @tool
+    def insert_lines(after_line:int, content:str)->str:
+        """
+        Inserts content after the given line. after_line=0 inserts at the top.
+        """
+        return _edit(document.insert, after_line, content)
+
+    @tool
+    def delete_lines(start_line:int, end_line:int)->str:
+        """
+        Deletes lines start_line..end_line (inclusive, 1-based).
+        """
+        return _edit(document.delete, start_line, end_line)
+
+    @tool
+    def undo()->str:
+        """
+        Reverts the last change to the document.
+        """
+        return document.undo()
+
+    @tool
+    def save(filename:str):
+        """
+        Saves the current document with the given filename and ends the process.
+        Args:
+            filename:str => Name for the text file
+        """
+        if not filename.endswith(".txt"):
+            filename+=".txt"
+        try:
+            with open(os.path.join(directory, filename), "w", encoding="utf-8") as file:
+                file.write(document.text())
+            if verbose:
+                print(f"Document saved with the filename: {filename}")
+            return f"Document saved with the filename: {filename}"
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    return [write, view_document, replace_lines, insert_lines, delete_lines, undo, save]
+
+
+def document_for_prompt(document:VersionedDocument)->str:
+    if document.line_count() == 0:
+        return "(empty)"
+    text = document.numbered()
+    if len(text) <= PROMPT_DOCUMENT_CHARS:
+        return "\n" + text
+    return f"{document.line_count()} lines (revision {document.version}), too long to show here. First lines:\n{document.numbered(1, 5)}"
+
+
+def build_drafter_agent(llm, document:VersionedDocument, ask:Callable[[], str], directory:str=".", verbose:bool=False):
+    """
+    agent -> tools until a tool message says the document was saved. `ask()` returns the
+    user's next instruction (input() in the script), the first turn needs none.
+    """
+    drafting_tools = make_drafting_tools(document, directory, verbose)
+    model = llm.bind_tools(drafting_tools)
+
+    def our_agent(state:MessagesState)->MessagesState:
+        system_prompt = SystemMessage(content=DRAFTER_PROMPT.format(document=document_for_prompt(document)))
+        if not state["messages"]:
+            user_message = HumanMessage(content="Im ready to help you update my document. What would you like to create?")
+        else:
+            user_message = HumanMessage(ask())
+        all_messages = [system_prompt] + list(state['messages']) + [user_message]
+        response = model.invoke(all_messages)
+
+        if verbose:
+            print(f"\n🤖 AI: {response.content}")
+            if hasattr(response, "tool_calls") and response.tool_calls:
+                print(f"🔧 USING TOOLS: {[tc['name'] for tc in response.tool_calls]}")
+
+        return {"messages": list(state["messages"]) + [user_message, response]}
+
+    def should_continue(state:MessagesState)->str:
+        """Determine if we should continue or end the conversation."""
+        messages = state["messages"]
+        if not messages:
+            return "continue"
+        # the most recent tool message that says the document was saved ends the run
+        for message in reversed(messages):
+            if (isinstance(message, ToolMessage) and
+                "saved" in message.content.lower() and # type: ignore
+                "document" in message.content.lower()): # type: ignore
+                return "end"
+        return "continue"
+
+    graph = StateGraph(MessagesState)
+    graph.add_node("agent", our_agent)
+    graph.add_node("tools", ToolNode(drafting_tools))
+    graph.set_entry_point("agent")
+    graph.add_edge("agent", "tools")
+    graph.add_conditional_edges("tools", should_continue, {"continue": "agent", "end": END})
+    return graph.compile()
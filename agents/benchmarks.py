@@ -0,0 +1,403 @@
+"""
+Offline benchmarks for the agents and the notebook graphs.
+
+Every scenario builds the real graph of one agent (agent_graphs, rag_graph) or runs the
+notebook's own cells up to `app = graph.compile()`, with a scripted stand-in model, so no
+api key or network is needed and the numbers only measure our own code and langgraph.
+For each input size it reports:
+
+    us_per_step   wall time of one run divided by its super-steps (framework + node overhead)
+    p50/p90/p99   end-to-end latency of sequential runs, in ms
+    throughput    runs per second with `concurrency` runs in flight (ainvoke)
+    peak_kb       peak python memory of one run (tracemalloc)
+
+    python benchmarks.py --output bench.json
+    python benchmarks.py --quick --baseline bench.json   # exits 1 on regressions
+    python benchmarks.py --scenarios hello_world_graph --startup   # + process start-up time
+"""
+import argparse
+import asyncio
+import json
+import operator
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from agent_graphs import MATH_TOOLS, build_drafter_agent, build_memory_agent, build_react_agent, build_simple_bot
+from bm25 import BM25Index, HybridRetriever
+from document_store import VersionedDocument
+from history_window import HistoryWindow
+from models import HashEmbeddings
+from rag_graph import build_rag_agent, make_retriever_batch, make_retriever_tool
+from sqlite_checkpointer import SQLiteSaver
+from tool_plan import make_plan_tool
+
+GRAPHS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "graphs")
+
+
+class ScriptedChatModel(BaseChatModel):
+    """stand-in model: `respond(messages)` decides the answer, `latency` fakes the api round trip"""
+
+    respond:Any
+    latency:float = 0.0
+
+    @property
+    def _llm_type(self)->str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs)->ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self.respond(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs)->ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self.respond(messages))])
+
+
+def tool_calls(*calls)->AIMessage:
+    return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{i}"} for i, (name, args) in enumerate(calls)])
+
+
+def notebook_graph(name:str, **overrides)->dict:
+    """
+    runs the code cells of graphs/<name>.ipynb until one defines `app` (the compiled graph) and
+    returns the notebook's namespace; `overrides` replace its globals, prints go nowhere
+    """
+    with open(os.path.join(GRAPHS_DIR, f"{name}.ipynb"), "r", encoding="utf-8") as f:
+        cells = [c for c in json.load(f)["cells"] if c["cell_type"] == "code"]
+    namespace:Dict[str, Any] = {"__name__": f"notebook_{name}", "print": lambda *args, **kwargs: None}
+    for cell in cells:
+        exec(compile("".join(cell["source"]), f"{name}.ipynb", "exec"), namespace)
+        if "app" in namespace:
+            break
+    namespace.update(overrides)
+    return namespace
+
+
+# a scenario builds (graph, make_run) for one input size; make_run(i) -> (input, config) is not timed
+
+def simple_llm_bot(size:int, latency:float):
+    """1-simple_llm_bot: one node, size = messages in the input"""
+    llm = ScriptedChatModel(respond=lambda messages: AIMessage(content="hello!"), latency=latency)
+    app = build_simple_bot(llm)
+    history = [HumanMessage(content=f"message {i} " * 20) for i in range(size)]
+    return app, lambda i: ({"messsages": history}, None)
+
+
+def agent_with_memory(size:int, latency:float):
+    """2-agent_with_memory: history window + sqlite checkpointer, size = messages already in the session"""
+    llm = ScriptedChatModel(respond=lambda messages: AIMessage(content="noted, " + "answer " * 40), latency=latency)
+    checkpointer = SQLiteSaver(os.path.join(tempfile.mkdtemp(prefix="bench_memory_"), "sessions.sqlite3"))
+    app = build_memory_agent(llm, HistoryWindow(llm, max_tokens=2000), checkpointer)
+    history = []
+    for i in range(size // 2):
+        history += [HumanMessage(content=f"question {i} " * 15), AIMessage(content=f"answer {i} " * 30)]
+
+    def make_run(i):
+        config = {"configurable": {"thread_id": f"session-{i}"}}
+        if history:
+            app.update_state(config, {"messages": history}) # seed the session in one checkpoint
+        return {"messages": [HumanMessage(content="and what about today?")]}, config
+
+    return app, make_run
+
+
+def react_agent(size:int, latency:float, plan:bool=False):
+    """3-simple_react_agent: tool loop, size = tool calls the model makes in one turn"""
+
+    def respond(messages):
+        if isinstance(messages[-1], HumanMessage):
+            return tool_calls(*[("add", {"a": n, "b": 1}) for n in range(size)])
+        return AIMessage(content="done")
+
+    if plan:
+        def respond(messages):
+            # a chain where every step needs the previous result: one run_plan call instead of one turn per step
+            if isinstance(messages[-1], HumanMessage):
+                steps = [{"id": f"s{n}", "tool": "add", "args": json.dumps({"a": f"$s{n - 1}" if n else 0, "b": 1})} for n in range(size)]
+                return tool_calls(("run_plan", {"steps": steps}))
+            return AIMessage(content="done")
+
+    model = ScriptedChatModel(respond=respond, latency=latency)
+    app = build_react_agent(model, MATH_TOOLS + [make_plan_tool(MATH_TOOLS)]) # the tools of the script
+    return app, lambda i: ({"messages": [HumanMessage(content="add some numbers")]}, None)
+
+
+def react_plan_agent(size:int, latency:float):
+    """3-simple_react_agent with run_plan: size = dependent steps, done in two model calls"""
+    return react_agent(size, latency, plan=True)
+
+
+def drafter_agent(size:int, latency:float):
+    """4-drafter_agent: patch edit, next instruction, save, size = lines in the document"""
+    document = VersionedDocument("\n".join(f"line {n} of the draft, some words to make it look like prose." for n in range(size)))
+
+    def respond(messages):
+        if not any(isinstance(m, ToolMessage) for m in messages):
+            return tool_calls(("replace_lines", {"start_line": 1, "end_line": 1, "content": "a new first line"}))
+        return tool_calls(("save", {"filename": "draft.txt"}))
+
+    model = ScriptedChatModel(respond=respond, latency=latency)
+    # every run edits line 1 of the same document and saves it, the history only grows by a shared revision per run
+    app = build_drafter_agent(model, document, ask=lambda: "now save it", directory=tempfile.mkdtemp(prefix="bench_drafter_"))
+    return app, lambda i: ({"messages": []}, None)
+
+
+def rag_agent(size:int, latency:float):
+    """5-simple_rag_agent: hybrid retrieval loop, size = chunks in the corpus"""
+    rng = random.Random(size)
+    words = ["revenue", "growth", "shares", "market", "earnings", "dividend", "volatility", "index", "sector", "guidance"]
+    chunks = [
+        Document(page_content=f"company_{n} " + " ".join(rng.choice(words) for _ in range(150)), metadata={"source": "bench", "page": n // 4})
+        for n in range(size)
+    ]
+    ids = [f"bench:{n}" for n in range(size)]
+    vector_store = InMemoryVectorStore(HashEmbeddings())
+    vector_store.add_documents(chunks, ids=ids)
+    bm25 = BM25Index()
+    bm25.add_documents(chunks, ids=ids)
+    retriever = HybridRetriever(bm25=bm25, vector_retriever=vector_store.as_retriever(search_kwargs={"k": 5}), mode="hybrid", k=5)
+
+    def respond(messages):
+        if isinstance(messages[-1], HumanMessage):
+            # the model fans out: three searches in one turn, two of them the same query
+            return tool_calls(
+                ("retriever_tool", {"query": "company_3 revenue growth and guidance"}),
+                ("retriever_tool", {"query": "company_3 dividend and earnings outlook"}),
+                ("retriever_tool", {"query": "Company_3 revenue growth and guidance?"}),
+            )
+        return AIMessage(content="company_3 grew revenue (Document 1).")
+
+    llm = ScriptedChatModel(respond=respond, latency=latency)
+    app = build_rag_agent(llm, [make_retriever_tool(retriever)], batched={"retriever_tool": make_retriever_batch(retriever)})
+    return app, lambda i: ({"messages": [HumanMessage(content="how did company_3 do?")]}, None)
+
+
+def hello_world_graph(size:int, latency:float):
+    """graphs/1-hello_world_graph: single node baseline"""
+    app = notebook_graph("1-hello_world_graph")["app"]
+    return app, lambda i: ({"message": "Bob"}, None)
+
+
+def conditional_graph(size:int, latency:float):
+    """graphs/7-conditional_edges: router + conditional edge"""
+    app = notebook_graph("7-conditional_edges")["app"]
+    return app, lambda i: ({"x": i, "y": 2, "operation": "+-"[i % 2]}, None)
+
+
+def looping_graph(size:int, latency:float):
+    """graphs/8-looping_graphs: greeting then a self loop with an append reducer, size = loop iterations"""
+    app = notebook_graph("8-looping_graphs", LOOPS=size)["app"]
+    return app, lambda i: ({"name": "bench", "numbers": [], "counter": -1}, {"recursion_limit": size + 10})
+
+
+def guessing_game(size:int, latency:float):
+    """graphs/9-exercise: bisection guessing loop, size = upper bound of the range (guesses grow with log2 of it)"""
+    app = notebook_graph("9-exercise", VERBOSE=False)["app"]
+    targets = random.Random(size) # same targets every run, so runs are comparable
+    return app, lambda i: (
+        {'lower_bound': 1, 'upper_bound': size, 'target_number': targets.randint(1, size)},
+        {"recursion_limit": 2 * size.bit_length() + 10},
+    )
+
+
+SCENARIOS:Dict[str, tuple] = {
+    # name: (builder, sizes, quick sizes)
+    "simple_llm_bot": (simple_llm_bot, [1, 100, 1000], [1, 100]),
+    "agent_with_memory": (agent_with_memory, [0, 50, 500], [0, 50]),
+    "react_agent": (react_agent, [1, 8, 32], [1, 8]),
+    "react_plan_agent": (react_plan_agent, [1, 8, 32], [1, 8]),
+    "drafter_agent": (drafter_agent, [100, 10_000, 100_000], [100, 10_000]),
+    "rag_agent": (rag_agent, [100, 1000, 10_000], [100, 1000]),
+    "hello_world_graph": (hello_world_graph, [1], [1]),
+    "conditional_graph": (conditional_graph, [1], [1]),
+    "looping_graph": (looping_graph, [5, 100, 1000], [5, 100]),
+    "guessing_game": (guessing_game, [20, 10**6, 10**9], [20, 10**6]),
+}
+
+
+def _merge_config(config:Optional[dict], recursion_limit:int=1000)->dict:
+    config = dict(config or {})
+    config.setdefault("recursion_limit", recursion_limit)
+    return config
+
+
+def _percentile(values:List[float], q:float)->float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def measure(app, make_run:Callable, iterations:int, concurrency:int)->dict:
+    inputs, config = make_run(-1)
+    steps = sum(1 for _ in app.stream(inputs, _merge_config(config), stream_mode="updates")) # also warms up
+
+    latencies = []
+    for i in range(iterations):
+        inputs, config = make_run(i)
+        started = time.perf_counter()
+        app.invoke(inputs, _merge_config(config))
+        latencies.append(time.perf_counter() - started)
+
+    async def throughput()->float:
+        semaphore = asyncio.Semaphore(concurrency)
+        inputs, config = make_run(-2)
+        await app.ainvoke(inputs, _merge_config(config)) # first async run starts the executor threads
+        runs = [make_run(iterations + i) for i in range(iterations)]
+
+        async def one(inputs, config):
+            async with semaphore:
+                await app.ainvoke(inputs, _merge_config(config))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(inputs, config) for inputs, config in runs))
+        return iterations / (time.perf_counter() - started)
+
+    runs_per_second = asyncio.run(throughput())
+
+    inputs, config = make_run(2 * iterations)
+    tracemalloc.start()
+    app.invoke(inputs, _merge_config(config))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50 = statistics.median(latencies)
+    return {
+        "steps": steps,
+        "us_per_step": round(p50 / max(steps, 1) * 1e6, 1),
+        "p50_ms": round(p50 * 1000, 3),
+        "p90_ms": round(_percentile(latencies, 0.9) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+        "throughput_rps": round(runs_per_second, 1),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def measure_startup(runs:int)->dict:
+    """
+    Cold start of a worker: a fresh interpreter loading 5-simple_rag_agent.py up to the point
+    where the REPL (or a service loop) could start, next to a bare interpreter for reference.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    load = "import runpy; runpy.run_path('5-simple_rag_agent.py')" # run_name isn't __main__, so no REPL
+
+    def timed(code:str)->List[float]:
+        times = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=here, check=True, stdout=subprocess.DEVNULL)
+            times.append(time.perf_counter() - started)
+        return times
+
+    bare = timed("pass")
+    agent = timed(load)
+    return {
+        "steps": 0,
+        "p50_ms": round(statistics.median(agent) * 1000, 1),
+        "p90_ms": round(_percentile(agent, 0.9) * 1000, 1),
+        "interpreter_ms": round(statistics.median(bare) * 1000, 1),
+    }
+
+
+def _commit()->Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# higher is worse for everything but throughput
+METRICS = {"us_per_step": 1, "p50_ms": 1, "p99_ms": 1, "peak_kb": 1, "throughput_rps": -1}
+
+
+def compare(results:List[dict], baseline:List[dict], tolerance:float)->List[str]:
+    """regressions worse than `tolerance` (0.25 = 25%) against a previous run"""
+    before = {(r["scenario"], r["size"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        old = before.get((r["scenario"], r["size"]))
+        if old is None:
+            continue
+        for metric, direction in METRICS.items():
+            if not old.get(metric):
+                continue
+            change = (r[metric] - old[metric]) / old[metric] * direction
+            if change > tolerance:
+                regressions.append(f"{r['scenario']}[{r['size']}] {metric}: {old[metric]} -> {r[metric]} ({change:+.0%} worse)")
+    return regressions
+
+
+def run(names:Sequence[str], iterations:int, concurrency:int, latency:float, quick:bool)->List[dict]:
+    results = []
+    for name in names:
+        builder, sizes, quick_sizes = SCENARIOS[name]
+        for size in quick_sizes if quick else sizes:
+            app, make_run = builder(size, latency)
+            result = {"scenario": name, "size": size, **measure(app, make_run, iterations, concurrency)}
+            print(f"{name:<18} size={size:<7} steps={result['steps']:<5} {result['us_per_step']:>9} us/step  "
+                  f"p50={result['p50_ms']}ms p99={result['p99_ms']}ms  {result['throughput_rps']} runs/s  peak={result['peak_kb']}KB")
+            results.append(result)
+    return results
+
+
+def main(argv:Optional[list]=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the agents and notebook graphs")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated, default: all")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--model-latency", type=float, default=0.0, help="seconds per fake model call")
+    parser.add_argument("--quick", action="store_true", help="only the small sizes")
+    parser.add_argument("--output", help="write the results as json")
+    parser.add_argument("--baseline", help="json from an earlier run, exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--startup", action="store_true", help="also measure the RAG agent's process start-up time")
+    args = parser.parse_args(argv)
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios {unknown}, choose from {list(SCENARIOS)}")
+
+    results = run(names, args.iterations, args.concurrency, args.model_latency, args.quick)
+    if args.startup:
+        result = {"scenario": "cold_start", "size": 0, **measure_startup(min(args.iterations, 10))}
+        print(f"{'cold_start':<18} p50={result['p50_ms']}ms p90={result['p90_ms']}ms (bare interpreter {result['interpreter_ms']}ms)")
+        results.append(result)
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "settings": {"iterations": args.iterations, "concurrency": args.concurrency, "model_latency": args.model_latency},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("no regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for", "from", "how", "in", "is",
+    "it", "of", "on", "or", "that", "the", "this", "to", "was", "were", "what", "when", "which", "with",
+}
+TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9&$%.]*[a-z0-9%]|[a-z0-9]")
+
+
+def tokenize(text:str)->List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Small in-process inverted index with Okapi BM25 scoring.
+    It has the same add_documents(ids=...) / delete(ids=...) methods as a vector store,
+    so the ingest code can keep it in sync with the Chroma collection.
+    """
+
+    def __init__(self, k1:float=1.5, b:float=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs:Dict[str, Tuple[str, dict]] = {}
+        self.postings:Dict[str, Dict[str, int]] = {}
+        self.doc_len:Dict[str, int] = {}
+        self._total_len = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add_documents(self, documents:Sequence[Document], ids:Sequence[str]):
+        for cid, doc in zip(ids, documents):
+            if cid in self.docs:
+                self._remove(cid)
+            self._index(cid, doc.page_content, dict(doc.metadata))
+
+    def delete(self, ids:Sequence[str]):
+        for cid in ids:
+            if cid in self.docs:
+                self._remove(cid)
+
+    def _index(self, cid:str, text:str, metadata:dict):
+        tokens = tokenize(text)
+        self.docs[cid] = (text, metadata)
+        self.doc_len[cid] = len(tokens)
+        self._total_len += len(tokens)
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, {})[cid] = tf
+
+    def _remove(self, cid:str):
+        text, _ = self.docs.pop(cid)
+        self._total_len -= self.doc_len.pop(cid)
+        for term in set(tokenize(text)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(cid, None)
+                if not posting:
+                    del self.postings[term]
+
+    def covers(self, query:str)->bool:
+        """True if every query term appears somewhere in the index"""
+        terms = tokenize(query)
+        return bool(terms) and all(t in self.postings for t in terms)
+
+    def search(self, query:str, k:int=5)->List[Tuple[Document, float]]:
+        if not self.docs:
+            return []
+        n = len(self.docs)
+        avgdl = self._total_len / n
+        scores:Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for cid, tf in posting.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[cid] / avgdl)
+                scores[cid] = scores.get(cid, 0.0) + idf * tf * (self.k1 + 1) / norm
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [
+            (Document(id=cid, page_content=self.docs[cid][0], metadata=self.docs[cid][1]), score)
+            for cid, score in best
+        ]
+
+    def save(self, path:str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "docs": self.docs}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path:str)->"BM25Index":
+        """only the chunks are stored, postings are rebuilt on load (fast for tens of thousands of chunks)"""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        for cid, (text, metadata) in data["docs"].items():
+            index._index(cid, text, metadata)
+        return index
+
+
+def looks_like_keyword_query(query:str)->bool:
+    """short queries, quoted phrases and tickers / numbers are better served by exact term matching"""
+    if '"' in query:
+        return True
+    words = query.split()
+    if len(words) <= 2:
+        return True
+    return any(w.isupper() and len(w) <= 5 for w in words) and len(words) <= 4
+
+
+def reciprocal_rank_fusion(result_lists:List[List[Document]], k:int, rrf_k:int=60)->List[Document]:
+    scores:Dict[str, float] = {}
+    docs:Dict[str, Document] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in ranked]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever with three modes: "lexical" (BM25 only, no embedding call at all),
+    "vector" (the wrapped vector retriever) and "hybrid" (both, merged with reciprocal rank fusion).
+    In "auto" mode keyword-like queries whose terms are all in the index go lexical,
+    everything else goes hybrid.
+    """
+
+    bm25:BM25Index
+    vector_retriever:BaseRetriever
+    mode:str = "auto"
+    k:int = 5
+
+    def route(self, query:str)->str:
+        if self.mode != "auto":
+            return self.mode
+        if looks_like_keyword_query(query) and self.bm25.covers(query):
+            return "lexical"
+        return "hybrid"
+
+    def _get_relevant_documents(self, query:str, *, run_manager:Optional[CallbackManagerForRetrieverRun]=None)->List[Document]:
+        mode = self.route(query)
+        if mode == "lexical":
+            return [doc for doc, _ in self.bm25.search(query, self.k)]
+        vector_docs = self.vector_retriever.invoke(query)
+        if mode == "vector":
+            return vector_docs
+        lexical_docs = [doc for doc, _ in self.bm25.search(query, self.k)]
+        return reciprocal_rank_fusion([vector_docs, lexical_docs], self.k)
+
+    def query_vectors(self, queries:List[str])->List[List[float]]:
+        """embeds all the queries in one batch request (see embedding_cache.embed_queries)"""
+        from embedding_cache import embed_queries
+        return embed_queries(self.vector_retriever.vectorstore.embeddings, queries)
+
+    def retrieve_batch(self, queries:List[str])->List[List[Document]]:
+        """
+        Same results as invoke() per query, but the queries needing a vector search share one
+        embedding request and, if the store has similarity_search_by_vector_batch, one search.
+        Falls back to invoke() per query when the vector retriever isn't backed by a vector store.
+        """
+        store = getattr(self.vector_retriever, "vectorstore", None)
+        if store is None:
+            return [self.invoke(q) for q in queries]
+        modes = [self.route(q) for q in queries]
+        vector_queries = [q for q, mode in zip(queries, modes) if mode != "lexical"]
+        vector_docs:Dict[str, List[Document]] = {}
+        if vector_queries:
+            vectors = self.query_vectors(vector_queries)
+            k = self.vector_retriever.search_kwargs.get("k", 4)
+            if hasattr(store, "similarity_search_by_vector_batch"):
+                found = [[doc for doc, _ in hits] for hits in store.similarity_search_by_vector_batch(vectors, k)]
+            else:
+                found = [store.similarity_search_by_vector(vector, k) for vector in vectors] # local search, no round trip
+            vector_docs = dict(zip(vector_queries, found))
+        results = []
+        for query, mode in zip(queries, modes):
+            if mode == "vector":
+                results.append(vector_docs[query])
+                continue
+            lexical_docs = [doc for doc, _ in self.bm25.search(query, self.k)]
+            results.append(lexical_docs if mode == "lexical" else reciprocal_rank_fusion([vector_docs[query], lexical_docs], self.k))
+        return results
@@ -0,0 +1,157 @@
+"""
+Post-retrieval compaction of the chunks handed to the model.
+
+The splitter overlaps neighbouring chunks by 200 characters, so the top-k of a query often
+repeats the same sentences several times. compact_documents() stitches chunks of the same
+page back into spans (by their `start_index` metadata, or by matching the overlapping text
+for chunks ingested without it), drops spans that are contained in another one, and keeps
+the best ranked spans that fit the token budget, in document order.
+"""
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from history_window import estimate_tokens
+
+MIN_TEXT_OVERLAP = 20 # shorter suffix/prefix matches are more likely coincidence than splitter overlap
+
+
+@dataclass
+class Span:
+    source:str
+    page:Optional[int]
+    start:Optional[int] # character offset in the page, None if unknown
+    text:str
+    rank:int # best retrieval rank of the chunks merged into it
+    chunks:int = 1
+    truncated:bool = field(default=False)
+
+    @property
+    def end(self)->Optional[int]:
+        return None if self.start is None else self.start + len(self.text)
+
+
+def _text_overlap(left:str, right:str)->int:
+    """length of the longest suffix of `left` that is a prefix of `right`"""
+    longest = min(len(left), len(right))
+    for size in range(longest, MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _merge_positioned(spans:List[Span])->List[Span]:
+    merged:List[Span] = []
+    for span in sorted(spans, key=lambda s: s.start):
+        last = merged[-1] if merged else None
+        if last is not None and span.start <= last.end:
+            if span.end > last.end:
+                last.text += span.text[last.end - span.start:]
+            last.rank = min(last.rank, span.rank)
+            last.chunks += span.chunks
+        else:
+            merged.append(span)
+    return merged
+
+
+def _merge_by_text(spans:List[Span])->List[Span]:
+    """same idea for chunks without offsets: contained chunks are dropped, overlapping ones chained"""
+    spans = sorted(spans, key=lambda s: -len(s.text))
+    kept:List[Span] = []
+    for span in spans:
+        container = next((k for k in kept if span.text in k.text), None)
+        if container is not None:
+            container.rank = min(container.rank, span.rank)
+            container.chunks += span.chunks
+        else:
+            kept.append(span)
+    changed = True
+    while changed:
+        changed = False
+        for left in kept:
+            for right in kept:
+                if left is right:
+                    continue
+                size = _text_overlap(left.text, right.text)
+                if size:
+                    left.text += right.text[size:]
+                    left.rank = min(left.rank, right.rank)
+                    left.chunks += right.chunks
+                    kept.remove(right)
+                    changed = True
+                    break
+            if changed:
+                break
+    return kept
+
+
+def merge_chunks(docs:Sequence[Document])->List[Span]:
+    """chunks -> non-overlapping spans, per page, in source order"""
+    groups:Dict[Tuple[str, Optional[int]], List[Span]] = {}
+    for rank, doc in enumerate(docs):
+        meta = doc.metadata or {}
+        key = (str(meta.get("source", "")), meta.get("page"))
+        groups.setdefault(key, []).append(Span(key[0], key[1], meta.get("start_index"), doc.page_content, rank))
+    spans:List[Span] = []
+    for group in groups.values():
+        positioned = [s for s in group if s.start is not None]
+        spans += _merge_positioned(positioned) if len(positioned) == len(group) else _merge_by_text(group)
+    # the same text on two pages (headers, repeated tables) is only worth sending once
+    spans.sort(key=lambda s: -len(s.text))
+    unique:List[Span] = []
+    for span in spans:
+        if not any(span.text.strip() in u.text for u in unique):
+            unique.append(span)
+    return sorted(unique, key=lambda s: (s.source, s.page if s.page is not None else -1, s.start or 0))
+
+
+def _truncate(text:str, max_tokens:int)->str:
+    cut = text[:max_tokens * 4]
+    boundary = max(cut.rfind(". "), cut.rfind("\n"))
+    if boundary > len(cut) // 2:
+        cut = cut[:boundary + 1]
+    else:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip() + " ..."
+
+
+def compact_documents(docs:Sequence[Document], max_tokens:Optional[int]=None, min_span_tokens:int=40)->List[Span]:
+    """
+    Merged spans of the retrieved chunks that fit in `max_tokens` (None = no limit).
+    Spans are admitted by retrieval rank, so the budget removes the weakest context first,
+    and the last admitted span is cut at a sentence boundary rather than dropped if at least
+    `min_span_tokens` of budget are left for it.
+    """
+    spans = merge_chunks(docs)
+    if max_tokens is None:
+        return spans
+    budget = max_tokens
+    kept = []
+    for span in sorted(spans, key=lambda s: s.rank):
+        cost = estimate_tokens(span.text) + 8 # + citation marker
+        if cost <= budget:
+            kept.append(span)
+            budget -= cost
+        elif budget >= min_span_tokens or not kept:
+            span.text = _truncate(span.text, max(budget - 8, min_span_tokens))
+            span.truncated = True
+            kept.append(span)
+            break
+        else:
+            break
+    kept_ids = {id(s) for s in kept}
+    return [s for s in spans if id(s) in kept_ids]
+
+
+def citation(span:Span, n:int, with_source:bool=False)->str:
+    where = f"page {span.page + 1}" if isinstance(span.page, int) else span.source or "unknown source"
+    if with_source and isinstance(span.page, int):
+        where = f"{os.path.basename(span.source)}, {where}" # several reports in one answer, say which
+    return f"Document {n} ({where}):"
+
+
+def format_spans(spans:Sequence[Span])->str:
+    with_source = len({span.source for span in spans}) > 1
+    return "\n\n".join(f"{citation(span, i + 1, with_source)}\n{span.text}" for i, span in enumerate(spans))
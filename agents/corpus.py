@@ -0,0 +1,390 @@
+"""
+Sharded multi-document corpus for the RAG agent.
+
+A directory of reports (.pdf, .txt, .md) is ingested into shards, one per document or one per
+year / month of the document's date. Every shard has its own vector store, BM25 index and
+ingest manifest, so adding or changing a document only re-embeds that document and only
+rewrites its shard. A small json index keeps per document metadata (title, date, tickers),
+which routes a query to the shards worth searching before any shard is opened.
+
+    python corpus.py ingest ./reports --shard-by year
+    python corpus.py search ./reports "AAPL revenue guidance 2024"
+
+Search embeds the query once, searches the routed shards in parallel and merges their hits
+into one global top-k (cosine scores are comparable across shards, BM25 scores are normalized
+per shard first), so query latency follows the number of routed shards, not the corpus size.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+
+DOCUMENT_TYPES = (".pdf", ".txt", ".md")
+# digit lookarounds instead of \b, file names like report_2024-03.pdf glue dates to underscores
+YEAR_RE = re.compile(r"(?<!\d)(19[5-9]\d|20\d\d)(?!\d)")
+DATE_RE = re.compile(r"(?<!\d)(19[5-9]\d|20\d\d)[-_./](0[1-9]|1[0-2])(?:[-_./](0[1-9]|[12]\d|3[01]))?(?!\d)")
+QUARTER_RE = re.compile(r"(?<![A-Za-z])Q([1-4])[\s_-]*(19[5-9]\d|20\d\d)(?!\d)", re.IGNORECASE)
+TICKER_RES = [
+    re.compile(r"\$([A-Z]{1,5})\b"),
+    re.compile(r"\((?:NYSE|NASDAQ|Nasdaq|AMEX|LSE|TSX)\s*:\s*([A-Z][A-Z.]{0,5})\)"),
+    re.compile(r"\b(?:ticker|symbol)s?\s*:?\s*([A-Z]{1,5})\b", re.IGNORECASE),
+]
+# capitalized words that look like tickers in running text but almost never are
+NOT_TICKERS = {
+    "A", "I", "AI", "CEO", "CFO", "COO", "CTO", "USA", "US", "UK", "EU", "GDP", "CPI", "IPO", "ETF", "EPS", "YOY",
+    "QOQ", "USD", "EUR", "THE", "AND", "FOR", "Q1", "Q2", "Q3", "Q4", "FY", "PDF", "NYSE", "NASDAQ", "SEC", "FED",
+    "ESG", "M", "B", "K", "S", "P", "OK", "II", "III", "IV", "VS", "NA", "TBD",
+}
+BARE_TICKER_RE = re.compile(r"\b[A-Z]{2,5}\b")
+
+
+class TickerCounter:
+    """extract_tickers over a document fed page by page, so the pages never have to be in memory together"""
+
+    def __init__(self):
+        self.explicit:set = set()
+        self.bare:Counter = Counter()
+
+    def add(self, text:str)->"TickerCounter":
+        self.explicit.update(m for pattern in TICKER_RES for m in pattern.findall(text))
+        self.bare.update(BARE_TICKER_RE.findall(text))
+        return self
+
+    def tickers(self, min_bare_count:int=3)->List[str]:
+        found = self.explicit | {word for word, n in self.bare.items() if n >= min_bare_count}
+        return sorted({t.upper() for t in found} - NOT_TICKERS)
+
+
+def extract_tickers(text:str, min_bare_count:int=3)->List[str]:
+    """explicit tickers ($AAPL, (NASDAQ: AAPL), ticker: AAPL) plus bare capitals repeated often enough"""
+    return TickerCounter().add(text).tickers(min_bare_count)
+
+
+def extract_date(*texts:str)->Optional[str]:
+    """the first date-like thing in the file name or text: 'YYYY-MM', 'YYYY' (quarters map to their first month)"""
+    for text in texts:
+        match = DATE_RE.search(text)
+        if match:
+            return f"{match.group(1)}-{match.group(2)}"
+        match = QUARTER_RE.search(text)
+        if match:
+            return f"{match.group(2)}-{(int(match.group(1)) - 1) * 3 + 1:02d}"
+        match = YEAR_RE.search(text)
+        if match:
+            return match.group(1)
+    return None
+
+
+def _slug(text:str)->str:
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")[:60] or "doc"
+
+
+def iter_document_pages(path:str)->Iterator[Document]:
+    if path.lower().endswith(".pdf"):
+        from pdf_stream import iter_pdf_pages
+        yield from iter_pdf_pages(path, workers=int(os.getenv("PDF_WORKERS", "0")))
+        return
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        yield Document(page_content=f.read(), metadata={"source": path, "page": 0, "total_pages": 1})
+
+
+class Shard:
+    """vector store + bm25 index + manifest of one shard, opened on first use"""
+
+    def __init__(self, directory:str, embeddings):
+        from ingest import IngestManifest
+        self.directory = directory
+        self.embeddings = embeddings
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = IngestManifest(os.path.join(directory, "manifest.json"))
+        self._store = None
+        self._bm25:Optional[BM25Index] = None
+        self._lock = threading.Lock()
+
+    @property
+    def store(self):
+        with self._lock:
+            if self._store is None:
+                from numpy_store import NumpyVectorStore
+                # memory-mapped, so opening one of hundreds of shards costs next to nothing
+                self._store = NumpyVectorStore(os.path.join(self.directory, "vectors"), self.embeddings,
+                                               quantize=os.getenv("VECTOR_QUANTIZE") == "int8")
+            return self._store
+
+    @property
+    def bm25(self)->BM25Index:
+        with self._lock:
+            if self._bm25 is None:
+                self._bm25 = BM25Index.load(os.path.join(self.directory, "bm25.json"))
+            return self._bm25
+
+    def save(self):
+        self.bm25.save(os.path.join(self.directory, "bm25.json"))
+
+    def search(self, query:str, vector:List[float], k:int)->Tuple[List[Tuple[Document, float]], List[Tuple[Document, float]]]:
+        """(vector hits with cosine scores, bm25 hits with scores scaled to the shard's best hit)"""
+        vector_hits = self.store.similarity_search_with_score_by_vector(vector, k)
+        lexical_hits = self.bm25.search(query, k)
+        if lexical_hits:
+            top = lexical_hits[0][1] or 1.0
+            lexical_hits = [(doc, score / top) for doc, score in lexical_hits]
+        return vector_hits, lexical_hits
+
+
+class CorpusManager:
+    """
+    Keeps <persist_directory>/corpus.json (documents -> shard, title, date, tickers, fingerprint)
+    and one directory per shard under <persist_directory>/shards.
+    `shard_by` is "document", "year" or "month"; documents without a date go to an "undated" shard.
+    """
+
+    def __init__(self, persist_directory:str, embeddings, shard_by:str="document", max_workers:int=8, max_shards:int=16):
+        if shard_by not in ("document", "year", "month"):
+            raise ValueError(f"shard_by must be document, year or month, not {shard_by!r}")
+        self.persist_directory = persist_directory
+        self.embeddings = embeddings
+        self.shard_by = shard_by
+        self.max_workers = max_workers
+        self.max_shards = max_shards
+        self.index_path = os.path.join(persist_directory, "corpus.json")
+        self.version = 0
+        self.documents:Dict[str, dict] = {} # source path -> metadata
+        self._shards:Dict[str, Shard] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard")
+        os.makedirs(persist_directory, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.version = data.get("version", 0)
+            self.documents = data.get("documents", {})
+            self.shard_by = data.get("shard_by", shard_by) # an existing corpus keeps its layout
+
+    def save(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "shard_by": self.shard_by, "documents": self.documents}, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def shard(self, shard_id:str)->Shard:
+        with self._lock:
+            if shard_id not in self._shards:
+                self._shards[shard_id] = Shard(os.path.join(self.persist_directory, "shards", shard_id), self.embeddings)
+            return self._shards[shard_id]
+
+    def shard_ids(self)->List[str]:
+        return sorted({meta["shard"] for meta in self.documents.values()})
+
+    def _shard_id(self, source:str, date:Optional[str])->str:
+        if self.shard_by == "document":
+            # name for humans, path hash so two report.pdf in different folders don't share a shard
+            return _slug(os.path.splitext(os.path.basename(source))[0]) + "-" + hashlib.sha256(source.encode("utf-8")).hexdigest()[:6]
+        if not date:
+            return "undated"
+        return date[:4] if self.shard_by == "year" else date[:7]
+
+    # ingest
+    def add_document(self, path:str)->dict:
+        """(re)ingests one document into its shard; an unchanged document costs one file hash"""
+        from ingest import file_fingerprint, sync_source
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        from pdf_stream import iter_chunks
+        source = os.path.abspath(path)
+        fingerprint = file_fingerprint(source)
+        known = self.documents.get(source)
+        if known and known["fingerprint"] == fingerprint:
+            return {"source": source, "shard": known["shard"], "added": 0, "deleted": 0, "unchanged": known["chunks"]}
+        # only the first pages are read up front (title, date -> shard); the rest streams into the shard
+        # page by page like the single PDF ingest, collecting the tickers on the way
+        pages = iter_document_pages(source)
+        head_pages = list(islice(pages, 3))
+        head = "\n".join(p.page_content for p in head_pages)
+        title = os.path.splitext(os.path.basename(source))[0].replace("_", " ").replace("-", " ")
+        first_line = next((line.strip() for line in head.splitlines() if len(line.strip()) > 8), "")
+        date = extract_date(os.path.basename(source), head)
+        tickers = TickerCounter()
+        page_count = 0
+
+        def observed(all_pages:Iterator[Document])->Iterator[Document]:
+            nonlocal page_count
+            for page in all_pages:
+                tickers.add(page.page_content)
+                page_count += 1
+                yield page
+
+        shard_id = self._shard_id(source, date)
+        if known and known["shard"] != shard_id:
+            self._drop_from_shard(source, known["shard"]) # the document's date changed, it moves shards
+        shard = self.shard(shard_id)
+        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, add_start_index=True)
+        chunks = (
+            Document(page_content=chunk.page_content, metadata={**chunk.metadata, "source": source, "title": title, "date": date, "shard": shard_id})
+            for chunk in iter_chunks(observed(chain(head_pages, pages)), splitter)
+        )
+        stats = sync_source([shard.store, shard.bm25], shard.manifest, source, fingerprint, chunks, batch_size=64)
+        shard.save()
+        meta = {
+            "title": title,
+            "heading": first_line[:200],
+            "date": date,
+            "tickers": tickers.tickers(),
+            "pages": page_count,
+            "fingerprint": fingerprint,
+        }
+        meta.update(shard=shard_id, chunks=len(shard.manifest.chunk_ids(source)))
+        with self._lock:
+            self.documents[source] = meta
+            self.version += 1
+            self.save()
+        return {"source": source, "shard": shard_id, **stats}
+
+    def _drop_from_shard(self, source:str, shard_id:str):
+        from ingest import prune_sources
+        shard = self.shard(shard_id)
+        prune_sources([shard.store, shard.bm25], shard.manifest, [s for s in shard.manifest.sources if s != source])
+        shard.save()
+        if not shard.manifest.sources:
+            with self._lock:
+                self._shards.pop(shard_id, None)
+            shutil.rmtree(shard.directory, ignore_errors=True)
+
+    def remove_document(self, path:str)->bool:
+        source = os.path.abspath(path)
+        meta = self.documents.get(source)
+        if meta is None:
+            return False
+        self._drop_from_shard(source, meta["shard"])
+        with self._lock:
+            del self.documents[source]
+            self.version += 1
+            self.save()
+        return True
+
+    def sync_directory(self, directory:str, verbose:bool=False)->dict:
+        """ingests new and changed documents of `directory`, drops the ones that are gone; other shards are not touched"""
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(directory) for name in names if name.lower().endswith(DOCUMENT_TYPES)
+        )
+        totals = Counter()
+        for path in paths:
+            stats = self.add_document(path)
+            totals.update(added=stats["added"], deleted=stats["deleted"])
+            if verbose and (stats["added"] or stats["deleted"]):
+                print(f"{os.path.basename(path)} -> shard {stats['shard']}: {stats}")
+        current = {os.path.abspath(p) for p in paths}
+        root = os.path.abspath(directory)
+        for source in [s for s in self.documents if s.startswith(root + os.sep) and s not in current]:
+            self.remove_document(source)
+            totals.update(removed_documents=1)
+        return {"documents": len(paths), "shards": len(self.shard_ids()), **totals}
+
+    # query
+    def route(self, query:str)->List[str]:
+        """
+        Shards worth searching for `query`: documents are scored on tickers (3), dates (2) and title
+        words (1) the query mentions, and the best `max_shards` shards with a positive score are
+        searched. A query with no such signal searches every shard.
+        """
+        words = set(tokenize(query))
+        tickers = set(re.findall(r"\b([A-Z]{1,5})\b", query)) & self._all_tickers()
+        dates = set(YEAR_RE.findall(query))
+        scores:Dict[str, float] = {}
+        for meta in self.documents.values():
+            score = 3 * len(tickers & set(meta["tickers"]))
+            if meta["date"] and any(meta["date"].startswith(d) for d in dates):
+                score += 2
+            score += len(words & set(tokenize(meta["title"] + " " + meta.get("heading", ""))))
+            if score:
+                scores[meta["shard"]] = max(scores.get(meta["shard"], 0), score)
+        if not scores:
+            return self.shard_ids()
+        return sorted(scores, key=lambda s: -scores[s])[:self.max_shards]
+
+    def _all_tickers(self)->set:
+        return {t for meta in self.documents.values() for t in meta["tickers"]}
+
+    def _merge(self, results:Sequence[Tuple[list, list]], k:int)->List[Document]:
+        vector_hits = sorted((hit for vectors, _ in results for hit in vectors), key=lambda h: -h[1])[:k]
+        lexical_hits = sorted((hit for _, lexical in results for hit in lexical), key=lambda h: -h[1])[:k]
+        return reciprocal_rank_fusion([[d for d, _ in vector_hits], [d for d, _ in lexical_hits]], k)
+
+    def search(self, query:str, k:int=5, vector:Optional[List[float]]=None, shards:Optional[List[str]]=None)->List[Document]:
+        shards = self.route(query) if shards is None else shards
+        if not shards:
+            return []
+        vector = vector if vector is not None else self.embeddings.embed_query(query) # once for every shard
+        if len(shards) == 1:
+            results = [self.shard(shards[0]).search(query, vector, k)]
+        else:
+            results = list(self._pool.map(lambda s: self.shard(s).search(query, vector, k), shards))
+        return self._merge(results, k)
+
+    def stats(self)->dict:
+        return {"documents": len(self.documents), "shards": len(self.shard_ids()), "version": self.version}
+
+
+class CorpusRetriever(BaseRetriever):
+    """retriever over a CorpusManager, also batches queries for the rag graph (see make_retriever_batch)"""
+
+    corpus:Any
+    k:int = 5
+
+    def _get_relevant_documents(self, query:str, *, run_manager:Optional[CallbackManagerForRetrieverRun]=None)->List[Document]:
+        return self.corpus.search(query, self.k)
+
+    def query_vectors(self, queries:List[str])->List[List[float]]:
+        from embedding_cache import embed_queries
+        return embed_queries(self.corpus.embeddings, queries)
+
+    def retrieve_batch(self, queries:List[str])->List[List[Document]]:
+        vectors = self.query_vectors(queries)
+        return [self.corpus.search(q, self.k, vector=v) for q, v in zip(queries, vectors)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sharded document corpus for the rag agent")
+    parser.add_argument("command", choices=["ingest", "search", "stats"])
+    parser.add_argument("directory", help="directory of .pdf / .txt / .md documents")
+    parser.add_argument("query", nargs="?", default="")
+    parser.add_argument("--persist-directory", default=None, help="default: <directory>/.corpus")
+    parser.add_argument("--shard-by", choices=["document", "year", "month"], default="document")
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    from embedding_cache import CachedEmbeddings
+    from models import get_embeddings
+    persist_directory = args.persist_directory or os.path.join(args.directory, ".corpus")
+    os.makedirs(persist_directory, exist_ok=True)
+    embeddings = CachedEmbeddings(get_embeddings("models/gemini-embedding-001"), db_path=os.path.join(persist_directory, "embedding_cache.sqlite3"))
+    corpus = CorpusManager(persist_directory, embeddings, shard_by=args.shard_by)
+    if args.command == "ingest":
+        started = time.perf_counter()
+        print(corpus.sync_directory(args.directory, verbose=True), f"{time.perf_counter() - started:.1f}s")
+    elif args.command == "search":
+        started = time.perf_counter()
+        shards = corpus.route(args.query)
+        docs = corpus.search(args.query, args.k, shards=shards)
+        print(f"{len(shards)} shard(s) searched in {(time.perf_counter() - started) * 1000:.1f}ms: {', '.join(shards)}")
+        for doc in docs:
+            print(f"- {doc.metadata.get('title')} p{doc.metadata.get('page')}: {doc.page_content[:120]!r}")
+    else:
+        print(corpus.stats())
+
+
+if __name__ == "__main__":
+    main()
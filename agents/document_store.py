@@ -0,0 +1,117 @@
+import difflib
+from typing import List, Tuple
+
+BLOCK_SIZE = 64 # lines per block, an edit only rebuilds the blocks it touches
+
+Revision = Tuple[Tuple[str, ...], ...] # tuple of blocks, each block a tuple of lines
+
+
+def _to_blocks(lines:List[str])->List[Tuple[str, ...]]:
+    return [tuple(lines[i:i + BLOCK_SIZE]) for i in range(0, len(lines), BLOCK_SIZE)]
+
+
+class VersionedDocument:
+    """
+    A text document kept as a list of immutable revisions.
+    Each revision is a tuple of line blocks; an edit creates a new revision that reuses
+    every block it didn't touch (structural sharing), so keeping the full history costs
+    about the size of the edits, not one copy of the document per revision.
+    Line numbers are 1-based and ranges are inclusive.
+    """
+
+    def __init__(self, text:str=""):
+        # (blocks, description, index of the revision it was derived from)
+        self.revisions:List[Tuple[Revision, str, int]] = [(tuple(_to_blocks(text.splitlines())), "initial", -1)]
+
+    @property
+    def current(self)->Revision:
+        return self.revisions[-1][0]
+
+    @property
+    def version(self)->int:
+        return len(self.revisions) - 1
+
+    def line_count(self)->int:
+        return sum(len(block) for block in self.current)
+
+    def text(self)->str:
+        return "\n".join(line for block in self.current for line in block)
+
+    def lines(self, start:int=1, end:int=None)->List[str]:
+        end = self.line_count() if end is None else end
+        out, offset = [], 0
+        for block in self.current:
+            if offset + len(block) >= start and offset < end:
+                out.extend(block[max(0, start - 1 - offset):end - offset])
+            offset += len(block)
+            if offset >= end:
+                break
+        return out
+
+    def numbered(self, start:int=1, end:int=None)->str:
+        return "\n".join(f"{i:>4}| {line}" for i, line in enumerate(self.lines(start, end), start=start))
+
+    def _check_range(self, start:int, end:int):
+        count = self.line_count()
+        if start < 1 or end < start - 1 or end > count:
+            raise ValueError(f"invalid line range {start}-{end}, the document has {count} lines")
+
+    def _splice(self, start:int, end:int, new_lines:List[str], description:str)->str:
+        """replaces lines start..end (end = start - 1 means a pure insert) with new_lines"""
+        self._check_range(start, end)
+        old_lines = self.lines(start, end) if end >= start else []
+        blocks = self.current
+        if not blocks:
+            return self._commit(tuple(_to_blocks(new_lines)), description, start, old_lines, new_lines)
+        # find the first and last block touched by the edit, everything else is shared as is
+        offset, first, first_offset = 0, len(blocks) - 1, self.line_count() - len(blocks[-1])
+        for i, block in enumerate(blocks):
+            if offset + len(block) >= start:
+                first, first_offset = i, offset
+                break
+            offset += len(block)
+        offset, last = first_offset, first
+        for i in range(first, len(blocks)):
+            offset += len(blocks[i])
+            last = i
+            if offset >= end:
+                break
+        touched = [line for block in blocks[first:last + 1] for line in block]
+        local_start = start - 1 - first_offset
+        local_end = end - first_offset
+        rebuilt = touched[:local_start] + new_lines + touched[local_end:]
+        new_revision = blocks[:first] + tuple(_to_blocks(rebuilt)) + blocks[last + 1:]
+        return self._commit(new_revision, description, start, old_lines, new_lines)
+
+    def _commit(self, revision:Revision, description:str, start:int, old_lines:List[str], new_lines:List[str], max_diff_lines:int=12)->str:
+        self.revisions.append((revision, description, self.version))
+        # hunk headers would carry range-local line numbers, the summary line already says where
+        diff = [d for d in list(difflib.unified_diff(old_lines, new_lines, lineterm="", n=0))[2:] if not d.startswith("@@")]
+        if len(diff) > max_diff_lines:
+            diff = diff[:max_diff_lines] + [f"... ({len(diff) - max_diff_lines} more diff lines)"]
+        return (
+            f"{description} at line {start}: -{len(old_lines)} +{len(new_lines)} lines. "
+            f"Document is now {self.line_count()} lines (revision {self.version}).\n" + "\n".join(diff)
+        )
+
+    def replace(self, start:int, end:int, text:str)->str:
+        return self._splice(start, end, text.splitlines(), f"Replaced lines {start}-{end}")
+
+    def insert(self, after_line:int, text:str)->str:
+        return self._splice(after_line + 1, after_line, text.splitlines(), f"Inserted after line {after_line}")
+
+    def delete(self, start:int, end:int)->str:
+        return self._splice(start, end, [], f"Deleted lines {start}-{end}")
+
+    def set_text(self, text:str)->str:
+        self.revisions.append((tuple(_to_blocks(text.splitlines())), "Rewrote the document", self.version))
+        return f"Rewrote the document: {self.line_count()} lines (revision {self.version})."
+
+    def undo(self)->str:
+        _, description, parent = self.revisions[-1]
+        if parent < 0:
+            return "Nothing to undo."
+        # history is append-only: undo adds a revision that shares the parent's blocks
+        blocks, _, grandparent = self.revisions[parent]
+        self.revisions.append((blocks, f"Undo of: {description}", grandparent))
+        return f"Undid '{description}'. Document is now {self.line_count()} lines (revision {self.version})."
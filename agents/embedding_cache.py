@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import inspect
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+def _f32(vector:List[float])->List[float]:
+    # round trip through float32 so a fresh vector equals the one served from the cache later
+    return array("f", vector).tolist()
+
+
+def _batches(items:list, size:int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def embed_queries(embeddings:Embeddings, texts:List[str])->List[List[float]]:
+    """
+    Query embeddings for several texts in one request where the model allows it:
+    a model with its own embed_queries, or one whose embed_documents takes a task_type
+    (google genai) gets a single batch call, anything else falls back to embed_query per text.
+    """
+    if not texts:
+        return []
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if "task_type" in inspect.signature(embeddings.embed_documents).parameters:
+        return embeddings.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+    return [embeddings.embed_query(t) for t in texts]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps any langchain embeddings model with an on-disk sqlite cache.
+    Entries are keyed by model name + a hash of the text and evicted least-recently-used
+    once the cache grows past max_entries. Misses are embedded in batches of batch_size,
+    with at most max_concurrency batches in flight at once.
+    """
+
+    def __init__(
+        self,
+        underlying:Embeddings,
+        db_path:str,
+        model_name:Optional[str]=None,
+        max_entries:int=200_000,
+        batch_size:int=64,
+        max_concurrency:int=4,
+    ):
+        self.underlying = underlying
+        self.model_name = model_name or getattr(underlying, "model", type(underlying).__name__)
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        # running upper bound of the row count (replaced keys count twice), the table is only counted again once it passes the cap
+        self._rows = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _count(self, hits:int, misses:int):
+        # pool threads and to_thread callers update these concurrently
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def _key(self, kind:str, text:str)->str:
+        # documents and queries can be embedded differently (task types), so they get separate keys
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys:List[str])->Dict[str, List[float]]:
+        found = {}
+        now = time.time()
+        with self._lock:
+            for batch in _batches(keys, 500): # stay under sqlite's bound parameter limit
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})", [now, *batch]
+                    )
+            self._conn.commit()
+        return found
+
+    def _store(self, items:Dict[str, List[float]]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()],
+            )
+            self._rows += len(items)
+            if self._rows > self.max_entries:
+                (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+                if count > self.max_entries:
+                    # evict a bit below the cap, so the next inserts don't have to count and evict again
+                    keep = max(self.max_entries - max(self.max_entries // 16, 1), 0)
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                        (count - keep,),
+                    )
+                    count = keep
+                self._rows = count
+            self._conn.commit()
+
+    def _split(self, texts:List[str], kind:str):
+        """returns (keys, cached vectors, texts still missing) with duplicate texts embedded once"""
+        keys = [self._key(kind, t) for t in texts]
+        cached = self._lookup(list(dict.fromkeys(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        self._count(len(texts) - sum(1 for key in keys if key in missing), len(missing))
+        return keys, cached, missing
+
+    def embed_documents(self, texts:List[str])->List[List[float]]:
+        keys, cached, missing = self._split(texts, "doc")
+        if missing:
+            miss_keys = list(missing)
+            batches = list(_batches(miss_keys, self.batch_size))
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+                results = pool.map(lambda b: self.underlying.embed_documents([missing[k] for k in b]), batches)
+                fresh = {}
+                for batch, vectors in zip(batches, results):
+                    fresh.update(zip(batch, map(_f32, vectors)))
+            self._store(fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+    async def aembed_documents(self, texts:List[str])->List[List[float]]:
+        keys, cached, missing = await asyncio.to_thread(self._split, texts, "doc")
+        if missing:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            miss_keys = list(missing)
+            batches = list(_batches(miss_keys, self.batch_size))
+
+            async def run(batch):
+                async with semaphore:
+                    return await self.underlying.aembed_documents([missing[k] for k in batch])
+
+            results = await asyncio.gather(*(run(b) for b in batches))
+            fresh = {}
+            for batch, vectors in zip(batches, results):
+                fresh.update(zip(batch, map(_f32, vectors)))
+            await asyncio.to_thread(self._store, fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text:str)->List[float]:
+        key = self._key("query", text)
+        cached = self._lookup([key])
+        if key in cached:
+            self._count(1, 0)
+            return cached[key]
+        self._count(0, 1)
+        vector = _f32(self.underlying.embed_query(text))
+        self._store({key: vector})
+        return vector
+
+    def embed_queries(self, texts:List[str])->List[List[float]]:
+        """embed_query for many texts, the misses go to the model in batch_size batches instead of one request each"""
+        keys, cached, missing = self._split(texts, "query")
+        if missing:
+            fresh = {}
+            for batch in _batches(list(missing), self.batch_size):
+                fresh.update(zip(batch, map(_f32, embed_queries(self.underlying, [missing[k] for k in batch]))))
+            self._store(fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+    async def aembed_queries(self, texts:List[str])->List[List[float]]:
+        return await asyncio.to_thread(self.embed_queries, texts)
+
+    async def aembed_query(self, text:str)->List[float]:
+        key = self._key("query", text)
+        cached = await asyncio.to_thread(self._lookup, [key])
+        if key in cached:
+            self._count(1, 0)
+            return cached[key]
+        self._count(0, 1)
+        vector = _f32(await self.underlying.aembed_query(text))
+        await asyncio.to_thread(self._store, {key: vector})
+        return vector
@@ -0,0 +1,89 @@
+from typing import List, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langgraph.constants import TAG_NOSTREAM
+
+SUMMARY_PROMPT = """You keep a running summary of a conversation between a user and an AI assistant.
+Update the summary with the new lines below. Keep names, facts, preferences and open questions,
+drop small talk. Answer with the updated summary only, at most {max_words} words."""
+
+
+def message_text(message:BaseMessage)->str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    # gemini can return a list of content parts
+    return " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+
+def estimate_tokens(text:str)->int:
+    """rough local estimate (~4 characters per token), good enough for budgeting without a tokenizer call"""
+    return len(text) // 4 + 1
+
+
+def estimate_message_tokens(messages:Sequence[BaseMessage])->int:
+    return sum(estimate_tokens(message_text(m)) + 4 for m in messages) # +4 for role / framing
+
+
+class HistoryWindow:
+    """
+    Keeps the prompt of a long conversation under `max_tokens`.
+    The newest turns are sent verbatim, older ones are folded into a rolling summary.
+    The summary is only updated with the turns that just fell out of the window,
+    so it costs one small llm call when that happens instead of re-summarizing everything.
+    The summary itself lives with the caller (e.g. in the graph state), so one window
+    can serve many sessions.
+    """
+
+    def __init__(self, llm, max_tokens:int=2000, summary_max_words:int=200, min_recent_messages:int=2):
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self.summary_max_words = summary_max_words
+        self.min_recent_messages = min_recent_messages
+
+    def _summary_message(self, summary:str)->List[BaseMessage]:
+        if not summary:
+            return []
+        return [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")]
+
+    def _update_summary(self, summary:str, evicted:Sequence[BaseMessage])->str:
+        lines = "\n".join(f"{m.type}: {message_text(m)}" for m in evicted)
+        response = self.llm.invoke([
+            SystemMessage(content=SUMMARY_PROMPT.format(max_words=self.summary_max_words)),
+            HumanMessage(content=f"Current summary:\n{summary or '(empty)'}\n\nNew lines:\n{lines}"),
+        ], config={"tags": [TAG_NOSTREAM]}) # internal call, its tokens must not show up in the user's token stream
+        return message_text(response).strip()
+
+    def build(self, history:Sequence[BaseMessage], summary:str="", summarized_upto:int=0)->Tuple[List[BaseMessage], str, int, dict]:
+        """
+        history[:summarized_upto] is already part of `summary`.
+        Returns the messages to send to the model, the updated summary and summarized_upto,
+        and token stats for this turn.
+        """
+        budget = self.max_tokens - estimate_message_tokens(self._summary_message(summary))
+        start = len(history)
+        used = 0
+        while start > summarized_upto:
+            cost = estimate_message_tokens([history[start - 1]])
+            if used + cost > budget and len(history) - start >= self.min_recent_messages:
+                break
+            used += cost
+            start -= 1
+        # don't open the window in the middle of a turn
+        while start < len(history) - 1 and not isinstance(history[start], HumanMessage):
+            start += 1
+
+        if start > summarized_upto:
+            summary = self._update_summary(summary, history[summarized_upto:start])
+            summarized_upto = start
+
+        prompt = self._summary_message(summary) + list(history[start:])
+        full_tokens = estimate_message_tokens(history)
+        prompt_tokens = estimate_message_tokens(prompt)
+        stats = {
+            "history_tokens": full_tokens,
+            "prompt_tokens": prompt_tokens,
+            "tokens_saved": max(0, full_tokens - prompt_tokens),
+            "summarized_messages": summarized_upto,
+        }
+        return prompt, summary, summarized_upto, stats
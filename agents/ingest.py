@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List
+
+from langchain_core.documents import Document
+
+from pdf_stream import batched
+
+
+def file_fingerprint(path:str)->str:
+    """sha256 of a source file, used to skip re-parsing sources that did not change"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(source:str, page, content:str, start_index=None)->str:
+    """
+    chunk ids are built from the source path, page, offset in the page and a hash of the chunk text;
+    a chunk whose text moved gets a new id, so the stored start_index (used to merge overlapping
+    chunks into spans) is never stale
+    """
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+    if start_index is None:
+        return f"{source}:{page}:{content_hash}"
+    return f"{source}:{page}:{start_index}:{content_hash}"
+
+
+class IngestManifest:
+    """
+    Remembers which chunk ids are in the vector store for every source,
+    so a restart only embeds chunks that are new and deletes the stale ones.
+    Stored as json next to the collection.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.version = 0
+        self.sources:Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.version = data.get("version", 0)
+            self.sources = data.get("sources", {})
+
+    def exists(self)->bool:
+        return os.path.exists(self.path)
+
+    def is_current(self, source:str, fingerprint:str)->bool:
+        entry = self.sources.get(source)
+        return entry is not None and entry["fingerprint"] == fingerprint
+
+    def chunk_ids(self, source:str)->List[str]:
+        return list(self.sources.get(source, {}).get("chunks", []))
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "sources": self.sources}, f)
+        os.replace(tmp_path, self.path) # atomic, a crash never leaves half a manifest behind
+
+
+def _as_list(stores)->list:
+    return list(stores) if isinstance(stores, (list, tuple)) else [stores]
+
+
+def sync_source(stores, manifest:IngestManifest, source:str, fingerprint:str, chunks:Iterable[Document], batch_size:int=64)->dict:
+    """
+    Upserts only the chunks of `source` that are not in the store yet and deletes
+    the ones that disappeared since the last ingest. `stores` is one store or a list
+    of them (e.g. the vector store plus the BM25 index), all get the same updates.
+    `chunks` can be a generator, new chunks are upserted every `batch_size` chunks,
+    so they are searchable before the rest of the source is parsed.
+    Returns counts of what happened.
+    """
+    old_ids = set(manifest.chunk_ids(source))
+    new_ids = []
+    seen = {}
+    added = 0
+    for batch in batched(chunks, batch_size):
+        to_add = []
+        for doc in batch:
+            cid = chunk_id(source, doc.metadata.get("page"), doc.page_content, doc.metadata.get("start_index"))
+            # identical chunks on the same page would collide, number the repeats
+            seen[cid] = seen.get(cid, 0) + 1
+            if seen[cid] > 1:
+                cid = f"{cid}#{seen[cid]}"
+            new_ids.append(cid)
+            if cid not in old_ids:
+                to_add.append((cid, doc))
+        if to_add:
+            for store in _as_list(stores):
+                store.add_documents([doc for _, doc in to_add], ids=[cid for cid, _ in to_add])
+            added += len(to_add)
+
+    current = set(new_ids)
+    stale = [cid for cid in old_ids if cid not in current]
+    if stale:
+        for store in _as_list(stores):
+            store.delete(ids=stale)
+
+    manifest.sources[source] = {"fingerprint": fingerprint, "chunks": new_ids}
+    if stale or added:
+        manifest.version += 1
+    manifest.save()
+    return {"added": added, "deleted": len(stale), "unchanged": len(new_ids) - added}
+
+
+def prune_sources(stores, manifest:IngestManifest, keep:Iterable[str])->int:
+    """Drops every chunk of sources that are no longer part of the corpus."""
+    keep = set(keep)
+    removed = 0
+    for source in list(manifest.sources):
+        if source in keep:
+            continue
+        ids = manifest.chunk_ids(source)
+        if ids:
+            for store in _as_list(stores):
+                store.delete(ids=ids)
+        removed += len(ids)
+        del manifest.sources[source]
+        manifest.version += 1
+    manifest.save()
+    return removed
@@ -0,0 +1,265 @@
+"""
+One place that decides which chat / embedding models the agents talk to.
+
+AGENT_MODEL_MODE=live     the real gemini models (default)
+AGENT_MODEL_MODE=record   real models, every request/response pair is appended to a cassette
+AGENT_MODEL_MODE=replay   no network: responses come from the cassette, embeddings are fake
+AGENT_REPLAY_LATENCY=0.5  seconds of simulated latency per replayed model call
+AGENT_EMBEDDINGS=fake     deterministic fake embeddings in any mode
+AGENT_CASSETTE_DIR        where cassettes live (default: agents/cassettes)
+CHAT_RPM, CHAT_TPM, EMBED_RPM, EMBED_TPM   provider quotas for the rate limiter (rate_limit.py)
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, message_chunk_to_message, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+def model_mode()->str:
+    return os.getenv("AGENT_MODEL_MODE", "live").lower()
+
+
+def cassette_path(name:str)->str:
+    directory = os.getenv("AGENT_CASSETTE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes"))
+    return os.path.join(directory, f"{name}.jsonl")
+
+
+def request_key(model:str, params:dict, tool_names:List[str], messages:List[BaseMessage])->str:
+    """hash of everything that decides the response; message ids are random, so they are left out"""
+    payload = []
+    for m in messages:
+        data = message_to_dict(m)["data"]
+        payload.append({
+            "type": m.type,
+            "content": data.get("content"),
+            "tool_calls": [{"name": t["name"], "args": t["args"]} for t in data.get("tool_calls", [])],
+            "tool_call_id": data.get("tool_call_id"),
+        })
+    blob = json.dumps({"model": model, "params": params, "tools": sorted(tool_names), "messages": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    jsonl file of recorded model calls, one {"key", "response"} object per line.
+    The same request recorded several times is replayed in the recorded order.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.responses:Dict[str, List[dict]] = {}
+        self._cursor:Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.responses.setdefault(entry["key"], []).append(entry["response"])
+
+    def record(self, key:str, response:AIMessage):
+        entry = {"key": key, "response": message_to_dict(response)}
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+            self.responses.setdefault(key, []).append(entry["response"])
+
+    def replay(self, key:str)->AIMessage:
+        with self._lock:
+            recorded = self.responses.get(key)
+            if not recorded:
+                raise KeyError(f"no recorded response for this request in {self.path}, record it with AGENT_MODEL_MODE=record")
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+        return messages_from_dict([recorded[index % len(recorded)]])[0]
+
+
+def _chunks(message:AIMessage)->List[ChatGenerationChunk]:
+    """splits a recorded answer into word sized stream chunks, tool calls and usage ride on the last one"""
+    text = message.content if isinstance(message.content, str) else "".join(
+        part.get("text", "") if isinstance(part, dict) else str(part) for part in message.content)
+    pieces = re.findall(r"\s*\S+\s*", text) or [""]
+    chunks = [AIMessageChunk(content=piece, id=message.id) for piece in pieces]
+    chunks[-1] = AIMessageChunk(
+        content=pieces[-1], id=message.id, usage_metadata=message.usage_metadata,
+        tool_call_chunks=[{"name": t["name"], "args": json.dumps(t["args"]), "id": t["id"], "index": i} for i, t in enumerate(message.tool_calls)],
+    )
+    return [ChatGenerationChunk(message=chunk) for chunk in chunks]
+
+
+class _CassetteChatModel(BaseChatModel):
+    model:str
+    params:dict = {}
+    tool_names:List[str] = []
+    cassette:Any = None
+
+    def _key(self, messages:List[BaseMessage])->str:
+        return request_key(self.model, self.params, self.tool_names, messages)
+
+    def _result(self, message:AIMessage)->ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class RecordingChatModel(_CassetteChatModel):
+    """calls the real model and appends every request/response pair to the cassette"""
+
+    inner:Any = None # the live model, possibly with tools bound
+
+    @property
+    def _llm_type(self)->str:
+        return "recording"
+
+    def bind_tools(self, tools, **kwargs):
+        names = [getattr(t, "name", None) or t.__name__ for t in tools]
+        return self.model_copy(update={"inner": self.inner.bind_tools(tools, **kwargs), "tool_names": names})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs)->ChatResult:
+        response = self.inner.invoke(messages)
+        self.cassette.record(self._key(messages), response)
+        return self._result(response)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs)->ChatResult:
+        response = await self.inner.ainvoke(messages)
+        self.cassette.record(self._key(messages), response)
+        return self._result(response)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        response = None
+        for chunk in self.inner.stream(messages):
+            response = chunk if response is None else response + chunk
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+        if response is not None:
+            self.cassette.record(self._key(messages), message_chunk_to_message(response))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        response = None
+        async for chunk in self.inner.astream(messages):
+            response = chunk if response is None else response + chunk
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+        if response is not None:
+            self.cassette.record(self._key(messages), message_chunk_to_message(response))
+
+
+class ReplayChatModel(_CassetteChatModel):
+    """serves recorded responses, no network; `latency` seconds are slept to look like the real thing"""
+
+    latency:float = 0.0
+
+    @property
+    def _llm_type(self)->str:
+        return "replay"
+
+    def bind_tools(self, tools, **kwargs):
+        names = [getattr(t, "name", None) or t.__name__ for t in tools]
+        return self.model_copy(update={"tool_names": names})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs)->ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._result(self.cassette.replay(self._key(messages)))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs)->ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._result(self.cassette.replay(self._key(messages)))
+
+    # streamed replays wait `latency` before the first chunk, like a real time-to-first-token
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        for chunk in _chunks(self.cassette.replay(self._key(messages))):
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for chunk in _chunks(self.cassette.replay(self._key(messages))):
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic fake embeddings: words are hashed into `size` buckets and the vector is
+    l2-normalized. Texts sharing words end up close, so retrieval still behaves sensibly offline.
+    """
+
+    def __init__(self, size:int=256):
+        self.size = size
+        self.model = f"hash-{size}"
+
+    def _embed(self, text:str)->List[float]:
+        vector = [0.0] * self.size
+        for word in re.findall(r"\w+", text.lower()):
+            h = int.from_bytes(hashlib.md5(word.encode("utf-8")).digest()[:8], "little")
+            vector[h % self.size] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts:List[str])->List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text:str)->List[float]:
+        return self._embed(text)
+
+
+_cassettes:Dict[str, Cassette] = {}
+
+
+def _cassette(name:str)->Cassette:
+    path = cassette_path(name)
+    if path not in _cassettes:
+        _cassettes[path] = Cassette(path)
+    return _cassettes[path]
+
+
+def get_chat_model(model:str="gemini-2.5-flash", cassette:str="default", cache=None, priority:str="interactive", **params)->BaseChatModel:
+    """
+    chat model for the current AGENT_MODEL_MODE; `cassette` names the recording file,
+    `cache` is an optional langchain response cache (see response_cache.py) in front of it.
+    Live calls go through the process-wide rate limiter (rate_limit.py) with the given
+    priority, "interactive" or "bulk"; cache hits never wait on it.
+    """
+    mode = model_mode()
+    if mode == "replay":
+        latency = float(os.getenv("AGENT_REPLAY_LATENCY", "0"))
+        return ReplayChatModel(model=model, params=params, cassette=_cassette(cassette), latency=latency, cache=cache)
+    from langchain_google_genai import ChatGoogleGenerativeAI # heavy import, only when we really talk to gemini
+    from rate_limit import PRIORITIES, RateLimitedChatModel, get_scheduler
+    # the scheduler retries 429s with backoff for every client together, the client's own retries would just add to the storm
+    live = ChatGoogleGenerativeAI(model=model, **{"max_retries": 1, **params})
+    limited = RateLimitedChatModel(inner=live, scheduler=get_scheduler("chat"), priority=PRIORITIES[priority])
+    if mode == "record":
+        return RecordingChatModel(model=model, params=params, cassette=_cassette(cassette), inner=limited, cache=cache)
+    return limited.model_copy(update={"cache": cache})
+
+
+def fake_embeddings()->bool:
+    return os.getenv("AGENT_EMBEDDINGS", "").lower() == "fake" or model_mode() == "replay"
+
+
+def get_embeddings(model:str="models/gemini-embedding-001")->Embeddings:
+    """fake deterministic embeddings in replay mode (or with AGENT_EMBEDDINGS=fake), gemini otherwise"""
+    if fake_embeddings():
+        return HashEmbeddings()
+    from langchain_google_genai.embeddings import GoogleGenerativeAIEmbeddings
+    from rate_limit import RateLimitedEmbeddings, get_scheduler
+    return RateLimitedEmbeddings(GoogleGenerativeAIEmbeddings(model=model), get_scheduler("embeddings"))
@@ -0,0 +1,395 @@
+"""
+Vector store on a memory-mapped numpy matrix, an alternative to Chroma for a mostly static collection.
+
+<path>/
+    meta.json          dim, rows, quantization, ivf state (rewritten atomically)
+    vectors.f32        rows x dim unit vectors (or vectors.i8 + scales.f32 with quantize=True)
+    alive.u8           0 for deleted rows
+    docs.sqlite3       row -> id, text, metadata (only the top-k rows are ever read)
+    ivf_*.npy          optional coarse partition, see build_ivf() (replaced atomically)
+
+Opening the store only maps the files, so it is near instant whatever the size, and worker
+processes opening the same directory share the pages through the os page cache.
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+import uuid
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+CAST_ROWS = 1024 # int8 rows (or gathered float32 rows) are scored in pieces this big, the temporaries stay a few MB
+
+
+def _normalize(vectors:np.ndarray)->np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _quantize(vectors:np.ndarray)->Tuple[np.ndarray, np.ndarray]:
+    """int8 per row, scale = max |value| / 127, so every row keeps its full int8 range"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def _merge_top_k(best_scores, best_rows, scores, rows, k:int):
+    """keeps the k best (score, row) pairs per query row"""
+    if best_scores is not None:
+        scores = np.concatenate([best_scores, scores], axis=1)
+        rows = np.concatenate([best_rows, rows], axis=1)
+    if scores.shape[1] > k:
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, keep, axis=1)
+        rows = np.take_along_axis(rows, keep, axis=1)
+    return scores, rows
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Cosine similarity search over unit vectors kept in a memory-mapped float32 (or int8) matrix.
+    Queries are scored in blocks of `block_rows` with one matrix product per block for the
+    whole batch of queries. After build_ivf() only the `nprobe` closest partitions (plus rows
+    added since the build) are scanned. Searches scan a snapshot of the arrays outside the
+    lock, so concurrent searches run in parallel. Works with as_retriever() like any langchain store.
+    The quantization of an existing store is fixed, opening it with the other mode raises.
+    """
+
+    def __init__(self, path:str, embedding:Embeddings, quantize:bool=False, read_only:bool=False,
+                 block_rows:int=65536, nprobe:int=8):
+        self.path = path
+        self.embedding = embedding
+        self.read_only = read_only
+        self.block_rows = block_rows
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self.meta = {"dim": None, "rows": 0, "capacity": 0, "quantize": quantize, "ivf": None}
+        if os.path.exists(self._file("meta.json")):
+            with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+            if self.meta["quantize"] != quantize:
+                if self.meta["capacity"]:
+                    raise ValueError(
+                        f"{path} is stored {'int8' if self.meta['quantize'] else 'float32'}, it can't be opened with "
+                        f"quantize={quantize}; re-ingest into a new collection to switch"
+                    )
+                self.meta["quantize"] = quantize # nothing written yet, take the requested mode
+        self.quantize = self.meta["quantize"]
+        self._db = sqlite3.connect(self._file("docs.sqlite3"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS docs (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL)")
+        if not read_only:
+            # rows written by a crashed add but never counted in meta.json
+            self._db.execute("DELETE FROM docs WHERE row >= ?", (self.meta["rows"],))
+            self._db.commit()
+        self._map()
+
+    @property
+    def embeddings(self)->Embeddings:
+        return self.embedding
+
+    def _file(self, name:str)->str:
+        return os.path.join(self.path, name)
+
+    def _map(self):
+        """(re)maps the matrix files at the current capacity"""
+        self.vectors = self.scales = self.alive = None
+        self.ivf = None
+        capacity, dim = self.meta["capacity"], self.meta["dim"]
+        if not capacity:
+            return
+        mode = "r" if self.read_only else "r+"
+        if self.quantize:
+            self.vectors = np.memmap(self._file("vectors.i8"), dtype=np.int8, mode=mode, shape=(capacity, dim))
+            self.scales = np.memmap(self._file("scales.f32"), dtype=np.float32, mode=mode, shape=(capacity,))
+        else:
+            self.vectors = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode=mode, shape=(capacity, dim))
+        self.alive = np.memmap(self._file("alive.u8"), dtype=np.uint8, mode=mode, shape=(capacity,))
+        if self.meta["ivf"]:
+            self.ivf = {name: np.load(self._file(f"ivf_{name}.npy"), mmap_mode="r") for name in ("centroids", "order", "offsets")}
+
+    def _files(self)->List[Tuple[str, int]]:
+        dim = self.meta["dim"]
+        if self.quantize:
+            return [("vectors.i8", dim), ("scales.f32", 4), ("alive.u8", 1)]
+        return [("vectors.f32", dim * 4), ("alive.u8", 1)]
+
+    def _grow(self, rows:int):
+        if rows <= self.meta["capacity"]:
+            return
+        capacity = max(rows, self.meta["capacity"] * 2, 1024)
+        for array in (self.vectors, self.scales, self.alive):
+            if array is not None:
+                array.flush()
+        self.vectors = self.scales = self.alive = None
+        for name, row_bytes in self._files():
+            with open(self._file(name), "ab") as f:
+                f.truncate(capacity * row_bytes) # sparse on most filesystems, zero filled
+        self.meta["capacity"] = capacity
+        self._map()
+
+    def _save_meta(self):
+        for array in (self.vectors, self.scales, self.alive):
+            if array is not None:
+                array.flush()
+        tmp_path = self._file("meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self._file("meta.json"))
+
+    def refresh(self):
+        """picks up rows another process added since this store was opened"""
+        with self._lock:
+            with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+            self._map()
+
+    def __len__(self):
+        return 0 if self.alive is None else int(np.count_nonzero(self.alive[:self.meta["rows"]]))
+
+    # writes
+    def add_texts(self, texts:Iterable[str], metadatas:Optional[List[dict]]=None, *, ids:Optional[List[str]]=None, **kwargs:Any)->List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = [i or str(uuid.uuid4()) for i in ids] if ids else [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = _normalize(np.asarray(self.embedding.embed_documents(texts), dtype=np.float32))
+        with self._lock:
+            if self.read_only:
+                raise ValueError(f"{self.path} was opened read only")
+            if self.meta["dim"] is None:
+                self.meta["dim"] = int(vectors.shape[1])
+            elif vectors.shape[1] != self.meta["dim"]:
+                raise ValueError(f"embedding dimension {vectors.shape[1]} doesn't match the store's {self.meta['dim']}")
+            self._delete_rows(ids) # same id again = update
+            start = self.meta["rows"]
+            end = start + len(texts)
+            self._grow(end)
+            if self.quantize:
+                self.vectors[start:end], self.scales[start:end] = _quantize(vectors)
+            else:
+                self.vectors[start:end] = vectors
+            self.alive[start:end] = 1
+            self._db.executemany(
+                "INSERT INTO docs (row, id, text, metadata) VALUES (?, ?, ?, ?)",
+                [(start + n, cid, text, json.dumps(meta)) for n, (cid, text, meta) in enumerate(zip(ids, texts, metadatas))],
+            )
+            self._db.commit()
+            self.meta["rows"] = end
+            self._save_meta()
+        return ids
+
+    def _delete_rows(self, ids:Sequence[str])->int:
+        rows = []
+        for start in range(0, len(ids), 500):
+            batch = list(ids[start:start + 500])
+            rows += [r for (r,) in self._db.execute(f"SELECT row FROM docs WHERE id IN ({','.join('?' * len(batch))})", batch)]
+        if rows:
+            self.alive[np.asarray(rows)] = 0
+            self._db.executemany("DELETE FROM docs WHERE row = ?", [(r,) for r in rows])
+        return len(rows)
+
+    def delete(self, ids:Optional[List[str]]=None, **kwargs:Any)->Optional[bool]:
+        if not ids:
+            return False
+        with self._lock:
+            deleted = self._delete_rows(ids)
+            self._db.commit()
+            self._save_meta()
+        return deleted > 0
+
+    def reset_collection(self):
+        with self._lock:
+            self._db.execute("DELETE FROM docs")
+            self._db.commit()
+            if self.alive is not None:
+                self.alive[:] = 0
+            self.meta.update(rows=0, ivf=None)
+            self._save_meta()
+            self._map()
+
+    # reads
+    def _documents(self, rows:Sequence[int])->dict:
+        found = {}
+        for start in range(0, len(rows), 500):
+            batch = [int(r) for r in rows[start:start + 500]]
+            for row, cid, text, meta in self._db.execute(
+                f"SELECT row, id, text, metadata FROM docs WHERE row IN ({','.join('?' * len(batch))})", batch
+            ):
+                found[row] = Document(id=cid, page_content=text, metadata=json.loads(meta))
+        return found
+
+    def get_by_ids(self, ids:Sequence[str], /)->List[Document]:
+        docs = []
+        for start in range(0, len(ids), 500):
+            batch = list(ids[start:start + 500])
+            for cid, text, meta in self._db.execute(
+                f"SELECT id, text, metadata FROM docs WHERE id IN ({','.join('?' * len(batch))})", batch
+            ):
+                docs.append(Document(id=cid, page_content=text, metadata=json.loads(meta)))
+        return docs
+
+    def get(self, include:Optional[List[str]]=None)->dict:
+        """every stored chunk, same shape as Chroma's get (used to backfill the bm25 index)"""
+        rows = self._db.execute("SELECT id, text, metadata FROM docs ORDER BY row").fetchall()
+        return {"ids": [r[0] for r in rows], "documents": [r[1] for r in rows], "metadatas": [json.loads(r[2]) for r in rows]}
+
+    def _snapshot(self)->dict:
+        """the arrays a search needs, taken under the lock; a later _grow or build_ivf maps new ones
+        and leaves these valid (files only grow, ivf files are replaced, not rewritten)"""
+        with self._lock:
+            return {"rows": self.meta["rows"], "vectors": self.vectors, "scales": self.scales, "alive": self.alive,
+                    "ivf": self.ivf, "indexed": self.meta["ivf"]["rows"] if self.ivf is not None else 0}
+
+    def _score(self, view:dict, rows, queries:np.ndarray)->np.ndarray:
+        """queries x rows similarities, rows is a slice or an index array"""
+        vectors = view["vectors"]
+        if not self.quantize and isinstance(rows, slice):
+            scores = queries @ vectors[rows].T # a view of the mapped file, no copy
+        else:
+            # int8 has to be cast and an index array gathers a copy, done in small pieces instead of
+            # one block_rows x dim temporary (800MB at 65536 x 3072)
+            rows = np.arange(rows.start, rows.stop) if isinstance(rows, slice) else rows
+            scores = np.empty((len(queries), len(rows)), dtype=np.float32)
+            for start in range(0, len(rows), CAST_ROWS):
+                piece = rows[start:start + CAST_ROWS]
+                if len(piece) and piece[-1] - piece[0] == len(piece) - 1:
+                    piece = slice(int(piece[0]), int(piece[-1]) + 1) # contiguous, read the mapped rows directly
+                scores[:, start:start + CAST_ROWS] = queries @ vectors[piece].astype(np.float32).T
+            if self.quantize:
+                scores *= view["scales"][rows][None, :]
+        scores[:, view["alive"][rows] == 0] = -np.inf
+        return scores
+
+    def _scan(self, view:dict, queries:np.ndarray, start:int, end:int, k:int, best=(None, None)):
+        best_scores, best_rows = best
+        for block_start in range(start, end, self.block_rows):
+            block_end = min(block_start + self.block_rows, end)
+            scores = self._score(view, slice(block_start, block_end), queries)
+            rows = np.broadcast_to(np.arange(block_start, block_end), scores.shape)
+            best_scores, best_rows = _merge_top_k(best_scores, best_rows, scores, rows, k)
+        return best_scores, best_rows
+
+    def _search(self, queries:np.ndarray, k:int, nprobe:Optional[int]=None)->List[List[Tuple[int, float]]]:
+        queries = _normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        view = self._snapshot()
+        if view["rows"] == 0 or view["vectors"] is None:
+            return [[] for _ in queries]
+        if view["ivf"] is None:
+            best_scores, best_rows = self._scan(view, queries, 0, view["rows"], k)
+        else:
+            best_scores, best_rows = self._ivf_search(view, queries, k, nprobe or self.nprobe)
+        results = []
+        for scores, found in zip(best_scores, best_rows):
+            order = np.argsort(-scores)
+            results.append([(int(found[i]), float(scores[i])) for i in order if np.isfinite(scores[i])])
+        return results
+
+    def _ivf_search(self, view:dict, queries:np.ndarray, k:int, nprobe:int):
+        centroids, order, offsets = view["ivf"]["centroids"], view["ivf"]["order"], view["ivf"]["offsets"]
+        indexed = view["indexed"]
+        probes = np.argsort(-(queries @ np.asarray(centroids).T), axis=1)[:, :nprobe]
+        all_scores, all_rows = [], []
+        for q, lists in enumerate(probes):
+            rows = np.sort(np.concatenate([order[offsets[l]:offsets[l + 1]] for l in lists]))
+            scores, found = None, None
+            for start in range(0, len(rows), self.block_rows):
+                block = rows[start:start + self.block_rows]
+                scores, found = _merge_top_k(scores, found, self._score(view, block, queries[q:q + 1]), block[None, :], k)
+            # rows added after build_ivf are not in any partition yet, they are always scanned
+            scores, found = self._scan(view, queries[q:q + 1], indexed, view["rows"], k, (scores, found))
+            if scores is None:
+                scores, found = np.full((1, 0), -np.inf, dtype=np.float32), np.zeros((1, 0), dtype=np.int64)
+            all_scores.append(scores[0])
+            all_rows.append(found[0])
+        width = max(len(s) for s in all_scores)
+        pad = lambda a, value: np.concatenate([a, np.full(width - len(a), value, dtype=a.dtype)])
+        return np.stack([pad(s, -np.inf) for s in all_scores]), np.stack([pad(r, 0) for r in all_rows])
+
+    def similarity_search_by_vector_batch(self, embeddings:Sequence[Sequence[float]], k:int=4, nprobe:Optional[int]=None)->List[List[Tuple[Document, float]]]:
+        """top-k for many query vectors at once, one matrix product per block for all of them"""
+        hits = self._search(np.asarray(embeddings, dtype=np.float32), k, nprobe)
+        documents = self._documents(sorted({row for result in hits for row, _ in result}))
+        return [[(documents[row], score) for row, score in result if row in documents] for result in hits]
+
+    def similarity_search_batch(self, queries:Sequence[str], k:int=4)->List[List[Tuple[Document, float]]]:
+        embed = getattr(self.embedding, "embed_queries", None)
+        vectors = embed(list(queries)) if embed else [self.embedding.embed_query(q) for q in queries]
+        return self.similarity_search_by_vector_batch(vectors, k)
+
+    def similarity_search_with_score_by_vector(self, embedding:List[float], k:int=4, **kwargs:Any)->List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_batch([embedding], k, kwargs.get("nprobe"))[0]
+
+    def similarity_search_by_vector(self, embedding:List[float], k:int=4, **kwargs:Any)->List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query:str, k:int=4, **kwargs:Any)->List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query:str, k:int=4, **kwargs:Any)->List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1.0) / 2.0 # cosine [-1, 1] -> [0, 1]
+
+    # coarse partition
+    def build_ivf(self, n_lists:Optional[int]=None, iterations:int=10, sample_size:int=100_000, seed:int=0)->int:
+        """
+        Spherical k-means over (a sample of) the rows, then every row is assigned to its closest
+        centroid. Searches only score the rows of the `nprobe` closest partitions afterwards.
+        Rows added later are scanned in full until the next build. Returns the number of lists.
+        """
+        with self._lock:
+            rows = self.meta["rows"]
+            live = np.flatnonzero(self.alive[:rows]) if rows else np.zeros(0, dtype=np.int64)
+            if len(live) == 0:
+                return 0
+            n_lists = max(1, min(n_lists or int(math.sqrt(len(live))), len(live)))
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(live, size=min(sample_size, len(live)), replace=False))
+            data = self._rows_f32(sample)
+            centroids = data[rng.choice(len(data), size=n_lists, replace=False)]
+            for _ in range(iterations):
+                assign = np.argmax(data @ centroids.T, axis=1)
+                for c in range(n_lists):
+                    members = data[assign == c]
+                    centroids[c] = members.mean(axis=0) if len(members) else data[rng.integers(len(data))]
+                centroids = _normalize(centroids)
+            assign = np.full(rows, -1, dtype=np.int64)
+            for start in range(0, len(live), self.block_rows):
+                block = live[start:start + self.block_rows]
+                assign[block] = np.argmax(self._rows_f32(block) @ centroids.T, axis=1)
+            order = np.argsort(assign, kind="stable")
+            order = order[assign[order] >= 0] # deleted rows belong to no partition
+            offsets = np.searchsorted(assign[order], np.arange(n_lists + 1))
+            for name, value in (("centroids", centroids.astype(np.float32)), ("order", order), ("offsets", offsets)):
+                # replaced, not rewritten in place: searches still scanning the old mapping keep their file
+                tmp_path = self._file(f"ivf_{name}.npy.tmp")
+                with open(tmp_path, "wb") as f:
+                    np.save(f, value)
+                os.replace(tmp_path, self._file(f"ivf_{name}.npy"))
+            self.meta["ivf"] = {"rows": rows, "n_lists": n_lists}
+            self._save_meta()
+            self._map()
+            return n_lists
+
+    def _rows_f32(self, rows:np.ndarray)->np.ndarray:
+        if self.quantize:
+            return self.vectors[rows].astype(np.float32) * self.scales[rows][:, None]
+        return np.asarray(self.vectors[rows], dtype=np.float32)
+
+    @classmethod
+    def from_texts(cls, texts:List[str], embedding:Embeddings, metadatas:Optional[List[dict]]=None, *,
+                   ids:Optional[List[str]]=None, path:str="numpy_store", **kwargs:Any)->"NumpyVectorStore":
+        store = cls(path, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
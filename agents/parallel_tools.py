@@ -0,0 +1,200 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import CallbackManager, CallbackManagerForToolRun
+from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langchain_core.runnables.config import ensure_config, patch_config
+from langchain_core.tools import BaseTool
+
+UNKNOWN_TOOL = "Incorrect Tool Name, Please Retry and Select tool from List of Available tools."
+
+
+def _no_writer(event:dict):
+    pass
+
+
+def stream_writer()->Callable[[dict], None]:
+    """writer of the running graph's custom stream, tool start/end events go there; no-op outside a graph run"""
+    try:
+        from langgraph.config import get_stream_writer
+        return get_stream_writer()
+    except (RuntimeError, KeyError): # KeyError: inside a runnable, but not one langgraph is running
+        return _no_writer
+
+
+def tool_start_event(call:dict)->dict:
+    return {"event": "tool_start", "name": call["name"], "args": call["args"], "id": call["id"]}
+
+
+def tool_end_event(message:ToolMessage)->dict:
+    content = str(message.content)
+    return {"event": "tool_end", "name": message.name, "id": message.tool_call_id, "status": message.status,
+            "size": len(content), "preview": content[:200]}
+
+
+class ParallelToolNode:
+    """
+    Runs all the tool calls of the last AIMessage at the same time instead of one by one.
+    Sync tools go through a bounded thread pool, async tools are awaited together on the event loop.
+    ToolMessages come back in the same order as the tool calls, and one failing call
+    only turns its own ToolMessage into an error.
+    `batched` maps a tool name to a function taking the args of several calls (and one config per
+    call, children of the tool runs started for them) and returning one result per call; when the
+    model makes more than one call to such a tool in a turn, they go through that function together
+    (e.g. one embedding request for all retrieval queries).
+    """
+
+    def __init__(self, tools:Sequence[BaseTool], max_workers:int=8, verbose:bool=False,
+                 batched:Optional[Dict[str, Callable[[List[dict], List[RunnableConfig]], List[str]]]]=None):
+        self.tools_by_name = {t.name: t for t in tools}
+        self.max_workers = max_workers
+        self.verbose = verbose
+        self.batched = batched or {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+
+    def _groups(self, tool_calls:list)->Tuple[Dict[str, List[int]], List[int]]:
+        """(tool name -> indexes of the calls to run as one batch, indexes of the calls to run one by one)"""
+        by_name:Dict[str, List[int]] = {}
+        for i, call in enumerate(tool_calls):
+            if call["name"] in self.batched:
+                by_name.setdefault(call["name"], []).append(i)
+        groups = {name: indexes for name, indexes in by_name.items() if len(indexes) > 1}
+        grouped = {i for indexes in groups.values() for i in indexes}
+        return groups, [i for i in range(len(tool_calls)) if i not in grouped]
+
+    def _tool_runs(self, name:str, calls:List[dict], config:Optional[RunnableConfig])->List[CallbackManagerForToolRun]:
+        """one tool run per call of a batch, the same callbacks tool.invoke would fire (tracing sees batched calls too)"""
+        config = ensure_config(config)
+        manager = CallbackManager.configure(
+            config.get("callbacks"), None, self.verbose,
+            inheritable_tags=config.get("tags"), inheritable_metadata=config.get("metadata"),
+        )
+        tool = self.tools_by_name.get(name)
+        serialized = {"name": name, "description": getattr(tool, "description", "")}
+        return [
+            manager.on_tool_start(serialized, str(call["args"]), name=name, inputs=call["args"], tool_call_id=call["id"])
+            for call in calls
+        ]
+
+    def _run_batch(self, name:str, calls:List[dict], config:Optional[RunnableConfig]=None, write:Callable[[dict], None]=_no_writer)->List[ToolMessage]:
+        if self.verbose:
+            print(f"Calling Tool: {name} with a batch of {len(calls)} calls")
+        for call in calls:
+            write(tool_start_event(call))
+        runs = self._tool_runs(name, calls, config)
+        try:
+            results = self.batched[name]([call["args"] for call in calls], [patch_config(config, callbacks=run.get_child()) for run in runs])
+            if len(results) != len(calls):
+                raise ValueError(f"{name} batch returned {len(results)} results for {len(calls)} calls")
+        except Exception as e:
+            for run in runs:
+                run.on_tool_error(e)
+            messages = [self._error(call, e) for call in calls]
+        else:
+            messages = [ToolMessage(tool_call_id=call["id"], name=name, content=str(result)) for call, result in zip(calls, results)]
+            for run, message in zip(runs, messages):
+                run.on_tool_end(message.content)
+        for message in messages:
+            write(tool_end_event(message))
+        return messages
+
+    def _error(self, call:dict, error:Exception)->ToolMessage:
+        return ToolMessage(tool_call_id=call["id"], name=call["name"], content=f"Error: {error!r}", status="error")
+
+    def _run(self, call:dict, config:Optional[RunnableConfig]=None, write:Callable[[dict], None]=_no_writer)->ToolMessage:
+        write(tool_start_event(call))
+        message = self._call(call, config)
+        write(tool_end_event(message))
+        return message
+
+    def _call(self, call:dict, config:Optional[RunnableConfig]=None)->ToolMessage:
+        if self.verbose:
+            print(f"Calling Tool: {call['name']} with args: {call['args']}")
+        tool = self.tools_by_name.get(call["name"])
+        if tool is None:
+            return ToolMessage(tool_call_id=call["id"], name=call["name"], content=UNKNOWN_TOOL)
+        try:
+            if getattr(tool, "func", None) is None and getattr(tool, "coroutine", None) is not None:
+                result = asyncio.run(tool.ainvoke(call["args"], config)) # async-only tool called from the sync path
+            else:
+                result = tool.invoke(call["args"], config)
+        except Exception as e:
+            return self._error(call, e)
+        if self.verbose:
+            print(f"Result length: {len(str(result))}")
+        return ToolMessage(tool_call_id=call["id"], name=call["name"], content=str(result))
+
+    async def _arun(self, call:dict, semaphore:asyncio.Semaphore, config:Optional[RunnableConfig]=None, write:Callable[[dict], None]=_no_writer)->ToolMessage:
+        async with semaphore:
+            write(tool_start_event(call))
+            message = await self._acall(call, config)
+        write(tool_end_event(message))
+        return message
+
+    async def _acall(self, call:dict, config:Optional[RunnableConfig]=None)->ToolMessage:
+        tool = self.tools_by_name.get(call["name"])
+        if tool is None:
+            return ToolMessage(tool_call_id=call["id"], name=call["name"], content=UNKNOWN_TOOL)
+        try:
+            if getattr(tool, "coroutine", None) is not None:
+                result = await tool.ainvoke(call["args"], config)
+            else:
+                # sync tool, keep it off the event loop
+                result = await asyncio.get_running_loop().run_in_executor(self._pool, tool.invoke, call["args"], config)
+        except Exception as e:
+            return self._error(call, e)
+        return ToolMessage(tool_call_id=call["id"], name=call["name"], content=str(result))
+
+    def invoke(self, state:dict, config:Optional[RunnableConfig]=None)->dict:
+        # the node's config is handed to every tool, so callbacks (tracing) see the tool runs from the worker threads too
+        tool_calls = state["messages"][-1].tool_calls
+        write = stream_writer()
+        groups, single = self._groups(tool_calls)
+        jobs:List[Tuple[List[int], Callable[[], List[ToolMessage]]]] = [
+            (indexes, lambda name=name, indexes=indexes: self._run_batch(name, [tool_calls[i] for i in indexes], config, write))
+            for name, indexes in groups.items()
+        ]
+        jobs += [([i], lambda i=i: [self._run(tool_calls[i], config, write)]) for i in single]
+        if len(jobs) == 1:
+            results = [jobs[0][1]()] # no point in a thread hop for one job
+        else:
+            # every job runs in a copy of the node's context, langgraph's stream writer looks its run up there
+            contexts = [contextvars.copy_context() for _ in jobs]
+            results = list(self._pool.map(lambda context, job: context.run(job[1]), contexts, jobs))
+        messages:List[Optional[ToolMessage]] = [None] * len(tool_calls)
+        for (indexes, _), batch in zip(jobs, results):
+            for i, message in zip(indexes, batch):
+                messages[i] = message
+        return {"messages": messages}
+
+    async def _arun_batch(self, name:str, calls:List[dict], semaphore:asyncio.Semaphore, config:Optional[RunnableConfig]=None,
+                          write:Callable[[dict], None]=_no_writer)->List[ToolMessage]:
+        async with semaphore:
+            # batch functions are sync, keep them off the event loop (in a copy of the context, for the stream writer)
+            return await asyncio.get_running_loop().run_in_executor(
+                self._pool, contextvars.copy_context().run, self._run_batch, name, calls, config, write
+            )
+
+    async def ainvoke(self, state:dict, config:Optional[RunnableConfig]=None)->dict:
+        tool_calls = state["messages"][-1].tool_calls
+        semaphore = asyncio.Semaphore(self.max_workers)
+        write = stream_writer()
+        groups, single = self._groups(tool_calls)
+        batches, singles = await asyncio.gather(
+            asyncio.gather(*(self._arun_batch(name, [tool_calls[i] for i in indexes], semaphore, config, write) for name, indexes in groups.items())),
+            asyncio.gather(*(self._arun(tool_calls[i], semaphore, config, write) for i in single)),
+        )
+        messages:List[Optional[ToolMessage]] = [None] * len(tool_calls)
+        for indexes, batch in zip(groups.values(), batches):
+            for i, message in zip(indexes, batch):
+                messages[i] = message
+        for i, message in zip(single, singles):
+            messages[i] = message
+        return {"messages": messages}
+
+    def as_node(self)->RunnableLambda:
+        """graph.add_node accepts the returned runnable, it picks the sync or async path by itself"""
+        return RunnableLambda(self.invoke, afunc=self.ainvoke, name="tools")
@@ -0,0 +1,69 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List
+
+from langchain_core.documents import Document
+
+
+def batched(items:Iterable, size:int)->Iterator[list]:
+    """yields lists of `size` items, without ever holding more than one batch"""
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _page_count(path:str)->int:
+    from pypdf import PdfReader
+    return len(PdfReader(path).pages)
+
+
+def _extract_pages(path:str, start:int, stop:int)->List[Document]:
+    # runs in a worker process, every worker opens its own reader
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    total = len(reader.pages)
+    return [
+        Document(
+            page_content=reader.pages[i].extract_text(),
+            metadata={"source": path, "page": i, "total_pages": total},
+        )
+        for i in range(start, min(stop, total))
+    ]
+
+
+def iter_pdf_pages(path:str, workers:int=0, pages_per_task:int=8)->Iterator[Document]:
+    """
+    Lazily yields one Document per page, in page order.
+    With workers > 0 the text extraction is spread over a process pool, but only
+    a couple of tasks per worker are in flight, so memory stays flat for huge PDFs.
+    """
+    if workers <= 0:
+        from pypdf import PdfReader
+        reader = PdfReader(path)
+        total = len(reader.pages)
+        for i, page in enumerate(reader.pages):
+            yield Document(page_content=page.extract_text(), metadata={"source": path, "page": i, "total_pages": total})
+        return
+
+    total = _page_count(path)
+    ranges = iter(range(0, total, pages_per_task))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for start in islice(ranges, workers * 2):
+            pending.append(pool.submit(_extract_pages, path, start, start + pages_per_task))
+        while pending:
+            pages = pending.popleft().result()
+            start = next(ranges, None)
+            if start is not None:
+                pending.append(pool.submit(_extract_pages, path, start, start + pages_per_task))
+            yield from pages
+
+
+def iter_chunks(pages:Iterable[Document], text_splitter)->Iterator[Document]:
+    """splits page by page, so chunks are ready as soon as their page is parsed"""
+    for page in pages:
+        yield from text_splitter.split_documents([page])
@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Iterator, Optional, Set
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from history_window import message_text
+
+
+def read_questions(path:str, done:Set[str])->Iterator[dict]:
+    """
+    streams {"id", "question"} records from a jsonl file, skipping the ones already answered;
+    a line that is no valid record comes out with an "invalid" reason instead of stopping the run
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                record = {"invalid": f"line {line_no} is not json ({e})"}
+            if not isinstance(record, dict):
+                record = {"invalid": f"line {line_no} is not a json object"}
+            elif "invalid" not in record and not isinstance(record.get("question"), str):
+                record["invalid"] = f'line {line_no} has no "question" string'
+            record.setdefault("id", str(line_no))
+            record["id"] = str(record["id"])
+            if record["id"] not in done:
+                yield record
+
+
+def answered_ids(path:str)->Set[str]:
+    """
+    ids already answered in the output file, so a crashed run picks up where it stopped.
+    Failed rows (and a half written last line) are dropped from the file, their questions run
+    again and get appended, so every id ends up with a single row.
+    """
+    done:Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    tmp_path = path + ".tmp"
+    dropped = 0
+    with open(path, "r", encoding="utf-8") as f, open(tmp_path, "w", encoding="utf-8") as out:
+        for line in f:
+            try:
+                record = json.loads(line)
+                ok = isinstance(record, dict) and "id" in record and record.get("error") is None
+            except ValueError:
+                ok = False # half written last line of a crashed run
+            if ok:
+                done.add(str(record["id"]))
+                out.write(line if line.endswith("\n") else line + "\n")
+            else:
+                dropped += 1
+    if dropped:
+        os.replace(tmp_path, path)
+    else:
+        os.remove(tmp_path)
+    return done
+
+
+def _ends_with_newline(path:str)->bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+async def answer(graph, record:dict)->dict:
+    started = time.perf_counter()
+    result = {"id": record["id"], "question": record.get("question")}
+    try:
+        if "invalid" in record:
+            raise ValueError(record["invalid"])
+        state = await graph.ainvoke({"messages": [HumanMessage(content=record["question"])]})
+        messages = state["messages"]
+        result["answer"] = message_text(messages[-1])
+        result["tool_calls"] = [
+            {"name": t["name"], "args": t["args"]}
+            for m in messages if isinstance(m, AIMessage) for t in m.tool_calls
+        ]
+        result["model_calls"] = sum(1 for m in messages if isinstance(m, AIMessage))
+        result["error"] = None
+    except Exception as e:
+        result["error"] = repr(e)
+    result["elapsed"] = round(time.perf_counter() - started, 4)
+    return result
+
+
+async def run_batch(graph, input_path:str, output_path:str, concurrency:int=16)->dict:
+    """
+    Runs every question of input_path through the graph with at most `concurrency` in flight.
+    Questions are read lazily and results are appended to output_path as soon as each one
+    finishes, so memory stays flat and a crash loses at most the in-flight questions.
+    Questions that failed are retried on the next run, replacing their error rows.
+    """
+    done = answered_ids(output_path)
+    queue:asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    stats = {"answered": 0, "errors": 0, "skipped": len(done)}
+    started = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        if out.tell() > 0 and not _ends_with_newline(output_path):
+            out.write("\n") # don't glue the first new record onto a half written line
+
+        async def worker():
+            while True:
+                record = await queue.get()
+                if record is None:
+                    return
+                result = await answer(graph, record)
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+                stats["errors" if result["error"] else "answered"] += 1
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        for record in read_questions(input_path, done):
+            await queue.put(record)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    stats["wall_time"] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+def main(argv:Optional[list]=None):
+    parser = argparse.ArgumentParser(description="Answer a jsonl file of questions with the RAG agent")
+    parser.add_argument("input", help='jsonl, one {"id": ..., "question": ...} per line')
+    parser.add_argument("output", help="jsonl with answers, tool calls and timings (appended, resumable)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args(argv)
+
+    from rag_resources import RagResources
+
+    graph = RagResources(priority="bulk", corpus_dir=os.getenv("RAG_CORPUS_DIR")).build_agent(max_tool_workers=args.concurrency) # yields to interactive turns in the same process
+    stats = asyncio.run(run_batch(graph, args.input, args.output, args.concurrency))
+    print(f"Batch finished: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+from typing import Annotated, Callable, Dict, List, Optional, Sequence, TypedDict
+
+from langchain_core.callbacks import CallbackManager, dispatch_custom_event
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langchain_core.runnables.config import ensure_config
+from langchain_core.tools import tool
+from langgraph.graph import END, StateGraph
+from langgraph.graph.message import add_messages
+
+from context_compaction import compact_documents, format_spans
+from parallel_tools import ParallelToolNode
+from retrieval_cache import normalize_query
+
+SYSTEM_PROMPT = """
+You are an intelligent AI assistant who answers questions about Stock Market Performance in 2024 based on the PDF document loaded into your knowledge base.
+Use the retriever tool available to answer questions about the stock market performance data. You can make multiple calls if needed.
+If you need to look up some information before asking a follow up question, you are allowed to do that!
+Please always cite the specific parts of the documents you use in your answers.
+"""
+
+
+# graph state and router function
+class AgentState(TypedDict):
+    messages:Annotated[Sequence[BaseMessage],add_messages]
+
+
+def should_continue(state:AgentState)->bool:
+    result = state['messages'][-1]
+    return hasattr(result, "tool_calls") and len(result.tool_calls) > 0 #type:ignore
+
+
+CORPUS_PROMPT = """
+You are an intelligent AI assistant who answers questions about the financial reports loaded into your knowledge base.
+Use the retriever tool to search them; mention company tickers, report titles or years in your queries when you know them, it narrows the search to the right reports.
+You can make multiple calls if needed, and please always cite the report and page of the parts you use in your answers.
+"""
+
+CORPUS_TOOL_DESCRIPTION = "Searches the loaded financial reports and returns the most relevant passages with their report and page."
+
+
+def make_retriever_tool(retriever, retrieval_cache=None, context_tokens:Optional[int]=None, description:Optional[str]=None):
+    """
+    builds the retriever_tool around a retriever (and optionally the query result cache);
+    overlapping chunks are merged into spans and trimmed to `context_tokens` (None = no limit)
+    """
+
+    @tool
+    def retriever_tool(query:str)->str:
+        """
+        This tool searches and returns the information from the Stock Market Performance 2024 document.
+        """
+        lexical = hasattr(retriever, "route") and retriever.route(query) == "lexical"
+        if retrieval_cache is None or lexical:
+            docs = retriever.invoke(query) # bm25 only is cheaper than a cache lookup with a query embedding
+        else:
+            docs = retrieval_cache.get(query)
+            dispatch_custom_event("cache", {"name": "retrieval", "hit": docs is not None}) # picked up by the tracer
+            if docs is None:
+                docs = retriever.invoke(query)
+                retrieval_cache.put(query, docs)
+        return format_docs(docs, context_tokens)
+
+    if description:
+        retriever_tool.description = description
+    return retriever_tool
+
+
+def format_docs(docs, max_tokens:Optional[int]=None)->str:
+    if not docs:
+        return "I found no relevant information in the Stock Market Performance 2024 document."
+    # the splitter overlaps chunks by 200 chars, stitching them back saves prompt tokens without losing any text
+    return format_spans(compact_documents(docs, max_tokens))
+
+
+def _retriever_runs(retriever, queries:List[str], configs:List[Optional[RunnableConfig]])->list:
+    """the retriever runs retriever.invoke would start, for queries that are searched together"""
+    runs = []
+    for query, config in zip(queries, configs):
+        config = ensure_config(config)
+        manager = CallbackManager.configure(
+            config.get("callbacks"), None,
+            inheritable_tags=config.get("tags"), local_tags=getattr(retriever, "tags", None),
+            inheritable_metadata=config.get("metadata"), local_metadata=getattr(retriever, "metadata", None),
+        )
+        runs.append(manager.on_retriever_start(None, query, name=config.get("run_name") or retriever.get_name()))
+    return runs
+
+
+def make_retriever_batch(retriever, retrieval_cache=None, context_tokens:Optional[int]=None)->Callable[..., List[str]]:
+    """
+    Batched stand-in for the retriever_tool, used by the tools node when the model asks for several
+    searches in one turn: duplicate queries run once, every query still needing an embedding is
+    embedded in one request (the cache lookups then read those vectors from the embedding cache),
+    and the cache misses go through one HybridRetriever.retrieve_batch call.
+    `configs` (one per call, from the tools node) parent the cache events and retriever runs of each query.
+    """
+
+    def retrieve_many(calls:List[dict], configs:Optional[List[Optional[RunnableConfig]]]=None)->List[str]:
+        queries = [call["query"] for call in calls]
+        configs = list(configs) if configs else [None] * len(calls)
+        unique:Dict[str, str] = {}
+        config_of:Dict[str, Optional[RunnableConfig]] = {}
+        for query, config in zip(queries, configs):
+            first = unique.setdefault(normalize_query(query), query)
+            config_of.setdefault(first, config)
+        routes = {q: retriever.route(q) if hasattr(retriever, "route") else "vector" for q in unique.values()}
+        cached = retrieval_cache is not None
+        if cached and retrieval_cache.semantic and hasattr(retriever, "query_vectors"):
+            retriever.query_vectors([q for q, route in routes.items() if route != "lexical"])
+        docs_by_query:Dict[str, Optional[list]] = {}
+        for query, route in routes.items():
+            if cached and route != "lexical":
+                docs_by_query[query] = retrieval_cache.get(query)
+                dispatch_custom_event("cache", {"name": "retrieval", "hit": docs_by_query[query] is not None}, config=config_of[query])
+        misses = [q for q in routes if docs_by_query.get(q) is None]
+        if misses:
+            if hasattr(retriever, "retrieve_batch"):
+                runs = _retriever_runs(retriever, misses, [config_of[q] for q in misses])
+                try:
+                    found = retriever.retrieve_batch(misses)
+                except Exception as e:
+                    for run in runs:
+                        run.on_retriever_error(e)
+                    raise
+                for run, docs in zip(runs, found):
+                    run.on_retriever_end(docs)
+            else:
+                found = [retriever.invoke(q, config_of[q]) for q in misses]
+            for query, docs in zip(misses, found):
+                docs_by_query[query] = docs
+                if cached and routes[query] != "lexical":
+                    retrieval_cache.put(query, docs)
+        return [format_docs(docs_by_query[unique[normalize_query(q)]], context_tokens) for q in queries]
+
+    return retrieve_many
+
+
+def build_rag_agent(llm, tools, checkpointer=None, verbose:bool=False, max_tool_workers:int=8, batched:Optional[dict]=None,
+                    system_prompt:str=SYSTEM_PROMPT):
+    """
+    Compiles the RAG graph around any chat model and tool list, so the REPL, the http
+    service and tests with stand-in models all share the same graph.
+    Both nodes have an async path, so ainvoke/astream never block the event loop.
+    `batched` maps tool names to batch functions (see make_retriever_batch).
+    """
+    llm = llm.bind_tools(tools)
+
+    def call_llm(state:AgentState)->AgentState:
+        """Function to call the LLM with the current state."""
+        messages = [SystemMessage(content=system_prompt)] + list(state["messages"])
+        return {"messages":[llm.invoke(messages)]}
+
+    async def acall_llm(state:AgentState)->AgentState:
+        messages = [SystemMessage(content=system_prompt)] + list(state["messages"])
+        return {"messages":[await llm.ainvoke(messages)]}
+
+    # runs every tool call of a turn concurrently, so fanned out retrievals cost as much as the slowest one
+    tool_node = ParallelToolNode(tools, max_workers=max_tool_workers, verbose=verbose, batched=batched)
+
+    graph = StateGraph(AgentState)
+    graph.add_node("call_llm", RunnableLambda(call_llm, afunc=acall_llm, name="call_llm"))
+    graph.add_node("retriever_node", tool_node.as_node())
+    graph.set_entry_point("call_llm")
+    graph.add_conditional_edges(
+        "call_llm",
+        should_continue,
+        {
+            True:"retriever_node",
+            False:END
+        }
+    )
+    graph.add_edge("retriever_node","call_llm")
+    return graph.compile(checkpointer=checkpointer)
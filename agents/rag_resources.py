@@ -0,0 +1,280 @@
+"""
+Lazily built resources of the RAG agent.
+
+Nothing heavy happens at import time or in the constructor: model clients, the Chroma
+collection, the ingest check, the indexes and the graph are created (and their modules
+imported) the first time something asks for them. An existing collection whose PDF is
+unchanged is opened as is, without touching the PDF parser or the embedding api.
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class RagResources:
+    """
+    Container for everything 5-simple_rag_agent, the http service and the batch runner share.
+    Every attribute is built once on first access (thread safe), `timings` records how long
+    each one took, and `warm_up()` builds them all up front, e.g. before a worker takes traffic.
+    """
+
+    def __init__(self, pdf_path:str="./stock_data.pdf", persist_directory:Optional[str]=None,
+                 collection_name:str="stock_data", verbose:bool=False, priority:str="interactive",
+                 corpus_dir:Optional[str]=None):
+        self.pdf_path = pdf_path
+        self.corpus_dir = corpus_dir # a directory of reports, served from a sharded corpus instead of the one PDF
+        self.persist_directory = persist_directory or os.path.dirname(os.path.abspath(__file__))
+        self.base_collection_name = collection_name
+        self.verbose = verbose
+        self.priority = priority # rate limiter class of the model calls, "bulk" lets interactive traffic go first
+        self.timings:Dict[str, float] = {} # resource -> seconds it took to build
+        self._resources:Dict[str, Any] = {}
+        self._lock = threading.RLock()
+
+    def _get(self, name:str, build:Callable[[], Any])->Any:
+        if name in self._resources:
+            return self._resources[name]
+        with self._lock:
+            if name not in self._resources: # another thread may have built it while we waited
+                started = time.perf_counter()
+                self._resources[name] = build()
+                self.timings[name] = round(time.perf_counter() - started, 4)
+            return self._resources[name]
+
+    @property
+    def vector_backend(self)->str:
+        return os.getenv("VECTOR_BACKEND", "chroma")
+
+    def _path(self, suffix:str)->str:
+        # every backend gets its own manifest, bm25 index and caches, otherwise switching VECTOR_BACKEND
+        # finds the other backend's manifest current and serves an empty store
+        backend = "" if self.vector_backend == "chroma" else f"{self.vector_backend}_"
+        return os.path.join(self.persist_directory, f"{self.collection_name}_{backend}{suffix}")
+
+    # models
+    @property
+    def llm(self):
+        def build():
+            from models import get_chat_model
+            return get_chat_model("gemini-2.5-flash", cassette="rag_agent", priority=self.priority, temperature=0.1)
+        return self._get("llm", build)
+
+    @property
+    def embeddings(self):
+        def build():
+            from embedding_cache import CachedEmbeddings
+            from models import get_embeddings
+            os.makedirs(self.persist_directory, exist_ok=True)
+            # embeddings are cached on disk, so re-ingesting and repeated queries don't hit the api again
+            return CachedEmbeddings(
+                get_embeddings("models/gemini-embedding-001"), # AGENT_MODEL_MODE=replay swaps in deterministic fake embeddings
+                db_path=os.path.join(self.persist_directory, "embedding_cache.sqlite3"),
+                batch_size=64,
+                max_concurrency=4
+            )
+        return self._get("embeddings", build)
+
+    @property
+    def collection_name(self)->str:
+        # fake vectors have another dimension, never mix them into the real collection
+        from models import fake_embeddings
+        return self.base_collection_name + ("_fake" if fake_embeddings() else "")
+
+    # storage
+    @property
+    def manifest(self):
+        def build():
+            from ingest import IngestManifest
+            # the manifest tracks which chunks are already embedded, so restarts only pay for what changed
+            return IngestManifest(self._path("manifest.json"))
+        return self._get("manifest", build)
+
+    @property
+    def vector_store(self):
+        def build():
+            if self.vector_backend == "numpy":
+                from numpy_store import NumpyVectorStore
+                # memory-mapped matrix, opens instantly and worker processes share its pages
+                store = NumpyVectorStore(self._path("vectors"), self.embeddings, quantize=os.getenv("VECTOR_QUANTIZE") == "int8")
+                if not self.manifest.exists():
+                    store.reset_collection()
+                return store
+            from langchain_chroma import Chroma # pulls in chromadb, only paid when the store is really used
+            try:
+                store = Chroma(
+                    collection_name=self.collection_name,
+                    embedding_function=self.embeddings,
+                    persist_directory=self.persist_directory
+                )
+            except Exception as e:
+                print(f"Error setting up ChromaDB: {str(e)}")
+                raise
+            if not self.manifest.exists():
+                # collection was built before the manifest existed (random ids, duplicates), start clean
+                store.reset_collection()
+            return store
+        return self._get("vector_store", build)
+
+    @property
+    def bm25_index(self):
+        def build():
+            from langchain_core.documents import Document
+            from bm25 import BM25Index
+            # lexical index over the same chunks, kept in sync by the ingest and saved next to the collection
+            index = BM25Index.load(self._path("bm25.json"))
+            if self.manifest.exists() and len(index) == 0 and self.manifest.chunk_ids(self.pdf_path):
+                # collection was ingested before the bm25 index existed, backfill it from chroma (no embedding calls)
+                existing = self.vector_store.get(include=["documents", "metadatas"])
+                index.add_documents(
+                    [Document(page_content=text, metadata=meta or {}) for text, meta in zip(existing["documents"], existing["metadatas"])],
+                    ids=existing["ids"]
+                )
+                index.save(self._path("bm25.json"))
+            return index
+        return self._get("bm25_index", build)
+
+    @property
+    def corpus(self):
+        def build():
+            from corpus import CorpusManager
+            return CorpusManager(
+                os.path.join(self.persist_directory, f"{self.collection_name}_corpus"),
+                self.embeddings,
+                shard_by=os.getenv("CORPUS_SHARD_BY", "document")
+            )
+        return self._get("corpus", build)
+
+    def ensure_ingested(self)->Optional[dict]:
+        """syncs the collection with the PDF; an unchanged PDF costs one file hash and nothing else"""
+        if self.corpus_dir:
+            # new and changed reports only touch their own shard
+            return self._get("ingest", lambda: self.corpus.sync_directory(self.corpus_dir, verbose=self.verbose))
+        return self._get("ingest", self._ingest)
+
+    def _ingest(self)->Optional[dict]:
+        from ingest import file_fingerprint, sync_source
+        if not os.path.exists(self.pdf_path):
+            raise FileNotFoundError(f"PDF file not found: {self.pdf_path}")
+        fingerprint = file_fingerprint(self.pdf_path)
+        if self.manifest.is_current(self.pdf_path, fingerprint):
+            if self.verbose:
+                print(f"{self.pdf_path} is unchanged, using the existing ChromaDB collection")
+            return None
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        from pdf_stream import iter_chunks, iter_pdf_pages
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size = 1000,
+            chunk_overlap = 200,
+            add_start_index = True # lets the retriever tool stitch overlapping chunks back together
+        )
+        # pages are parsed lazily and chunks go to the store in batches, memory stays flat for big PDFs
+        pages = iter_pdf_pages(self.pdf_path, workers=int(os.getenv("PDF_WORKERS", "0")))
+        try:
+            stats = sync_source([self.vector_store, self.bm25_index], self.manifest, self.pdf_path, fingerprint, iter_chunks(pages, text_splitter), batch_size=64)
+            self.bm25_index.save(self._path("bm25.json"))
+        except Exception as e:
+            print(f"Error setting up ChromaDB: {str(e)}")
+            raise
+        if self.verbose:
+            print(f"Synced ChromaDB vector store: {stats}")
+        return stats
+
+    # retrieval
+    @property
+    def retriever(self):
+        def build():
+            from bm25 import HybridRetriever
+            self.ensure_ingested()
+            if self.corpus_dir:
+                from corpus import CorpusRetriever
+                return CorpusRetriever(corpus=self.corpus, k=5)
+            vector_retriever = self.vector_store.as_retriever(
+                search_type="similarity",
+                search_kwargs={"k":5}
+            )
+            # "lexical", "vector", "hybrid" or "auto" (keyword-like queries skip the embedding api entirely)
+            return HybridRetriever(
+                bm25=self.bm25_index,
+                vector_retriever=vector_retriever,
+                mode=os.getenv("RETRIEVAL_MODE", "auto"),
+                k=5
+            )
+        return self._get("retriever", build)
+
+    @property
+    def retrieval_cache(self):
+        def build():
+            from retrieval_cache import RetrievalCache
+            self.ensure_ingested() # the cache generation has to be the post-ingest manifest version
+            # repeated (or near identical) queries are answered from here, the manifest version ties it to the current ingest.
+            # the corpus keeps its own file next to its shards, both versions count up from 0 and would collide
+            if self.corpus_dir:
+                path, generation = os.path.join(self.corpus.persist_directory, "retrieval_cache.sqlite3"), self.corpus.version
+            else:
+                path, generation = self._path("retrieval_cache.sqlite3"), self.manifest.version
+            return RetrievalCache(
+                path=path,
+                ttl=24 * 3600,
+                max_entries=1024,
+                embeddings=self.embeddings,
+                similarity_threshold=0.95,
+                generation=generation
+            )
+        return self._get("retrieval_cache", build)
+
+    @property
+    def context_tokens(self)->Optional[int]:
+        # optional budget for the retrieved context of one search; unset / 0 only merges the overlapping chunks,
+        # which drops repeated text but nothing else, a budget also trims the weakest spans
+        tokens = int(os.getenv("RAG_CONTEXT_TOKENS", "0"))
+        return tokens or None
+
+    @property
+    def tools(self)->list:
+        def build():
+            from rag_graph import CORPUS_TOOL_DESCRIPTION, make_retriever_tool
+            description = CORPUS_TOOL_DESCRIPTION if self.corpus_dir else None
+            return [make_retriever_tool(self.retriever, self.retrieval_cache, self.context_tokens, description)]
+        return self._get("tools", build)
+
+    @property
+    def tool_batches(self)->dict:
+        def build():
+            from rag_graph import make_retriever_batch
+            # several searches in one turn share one embedding request and one vector search
+            return {"retriever_tool": make_retriever_batch(self.retriever, self.retrieval_cache, self.context_tokens)}
+        return self._get("tool_batches", build)
+
+    # graph
+    @property
+    def tracer(self):
+        def build():
+            from tracing import tracer_from_env
+            # AGENT_TRACE=jsonl:traces.jsonl (or prometheus:metrics.prom) records a span per node, llm call, tool call and retrieval
+            return tracer_from_env()
+        return self._get("tracer", build)
+
+    def build_agent(self, **kwargs):
+        """a new compiled graph over the shared resources (e.g. with a checkpointer for the http service)"""
+        from rag_graph import CORPUS_PROMPT, build_rag_agent
+        from tracing import instrument
+        kwargs.setdefault("batched", self.tool_batches)
+        if self.corpus_dir:
+            kwargs.setdefault("system_prompt", CORPUS_PROMPT)
+        return instrument(build_rag_agent(self.llm, self.tools, **kwargs), self.tracer)
+
+    @property
+    def agent(self):
+        return self._get("agent", lambda: self.build_agent()) # tool calls are shown by the token stream, no verbose prints
+
+    def warm_up(self)->Dict[str, float]:
+        """
+        Builds everything now instead of on the first question and runs one retrieval,
+        so the embedding client has its connection open. Returns the build timings.
+        """
+        self.agent
+        started = time.perf_counter()
+        self.retriever.invoke("stock market performance")
+        self.timings["warm_up_query"] = round(time.perf_counter() - started, 4)
+        return dict(self.timings)
@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Optional
+from urllib.parse import unquote
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from history_window import message_text
+from token_stream import astream_tokens
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error", 503: "Service Unavailable",
+           504: "Gateway Timeout"}
+
+
+def message_to_dict(message:BaseMessage)->dict:
+    data = {"type": message.type, "content": message_text(message)}
+    if isinstance(message, AIMessage) and message.tool_calls:
+        data["tool_calls"] = [{"name": t["name"], "args": t["args"]} for t in message.tool_calls]
+    return data
+
+
+class RagService:
+    """
+    Minimal asyncio http front end for a compiled graph (stdlib only, one request per connection).
+    Every session is a checkpointer thread, so the graph has to be compiled with a checkpointer.
+    The graph, and with it the vector store, retriever and model clients, is shared by all
+    requests; at most `max_concurrency` graph runs are in flight and requests beyond
+    `max_pending` waiting ones get a 503 instead of piling up. Turns of the same session
+    are serialized so they never race on the session's checkpoints.
+
+        POST   /sessions/<id>/messages   {"message": "..."}  -> final answer + tool calls
+        POST   /sessions/<id>/stream     {"message": "..."}  -> server-sent events: token, tool_start, tool_end, step, done (or error)
+        DELETE /sessions/<id>                                -> forget the session
+        GET    /health
+    """
+
+    def __init__(self, graph, max_concurrency:int=64, max_pending:int=1024, request_timeout:float=120):
+        self.graph = graph
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_pending = max_pending
+        self.request_timeout = request_timeout
+        self.active = 0
+        self.pending = 0
+        self._session_locks = {} # session id -> [lock, users], turns of one session run one after another
+
+    async def _read_request(self, reader:asyncio.StreamReader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            return None
+        method, path, _ = request_line.split(" ", 2)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), unquote(path.split("?", 1)[0]), headers, body
+
+    async def _respond(self, writer:asyncio.StreamWriter, status:int, payload:dict):
+        body = json.dumps(payload).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    def _config(self, session_id:str)->dict:
+        return {"configurable": {"thread_id": session_id}}
+
+    async def _invoke(self, writer, session_id:str, message:str):
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(
+                self.graph.ainvoke({"messages": [HumanMessage(content=message)]}, self._config(session_id)), self.request_timeout
+            )
+        except asyncio.TimeoutError:
+            return await self._respond(writer, 504, {"error": f"no answer within {self.request_timeout}s", "session_id": session_id})
+        # only the messages of this turn, the rest of the session stays in the checkpointer
+        turn = []
+        for m in reversed(result["messages"]):
+            turn.append(m)
+            if isinstance(m, HumanMessage):
+                break
+        turn.reverse()
+        await self._respond(writer, 200, {
+            "session_id": session_id,
+            "answer": message_text(result["messages"][-1]),
+            "tool_calls": [t for m in turn for t in message_to_dict(m).get("tool_calls", [])],
+            "elapsed": round(time.perf_counter() - started, 4),
+        })
+
+    async def _stream(self, writer, session_id:str, message:str):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+            b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n"
+        )
+
+        async def send(event:str, data:dict):
+            chunk = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+            writer.write(f"{len(chunk):x}\r\n".encode("latin-1") + chunk + b"\r\n")
+            await writer.drain() # a slow client slows the graph down instead of buffering everything
+
+        async def pump():
+            # model tokens as they are generated, tool start/end events and one step event per finished node
+            async for event in astream_tokens(self.graph, {"messages": [HumanMessage(content=message)]}, self._config(session_id), steps=True):
+                kind = event.pop("event")
+                if kind == "step":
+                    event["messages"] = [message_to_dict(m) for m in event["messages"]]
+                await send(kind, event)
+
+        # the 200 and the chunked headers are out already, failures end the stream with an error event instead of a second response
+        try:
+            await asyncio.wait_for(pump(), self.request_timeout)
+        except asyncio.TimeoutError:
+            await send("error", {"session_id": session_id, "error": f"no answer within {self.request_timeout}s", "status": 504})
+        except ConnectionError:
+            raise
+        except Exception as e:
+            await send("error", {"session_id": session_id, "error": repr(e), "status": 500})
+        else:
+            await send("done", {"session_id": session_id})
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _route(self, writer, method:str, path:str, body:bytes):
+        parts = [p for p in path.split("/") if p]
+        if parts == ["health"]:
+            return await self._respond(writer, 200, {"status": "ok", "active": self.active, "pending": self.pending})
+        if len(parts) < 2 or parts[0] != "sessions":
+            return await self._respond(writer, 404, {"error": f"no route for {path}"})
+        session_id = parts[1]
+        if len(parts) == 2 and method == "DELETE":
+            await self.graph.checkpointer.adelete_thread(session_id)
+            return await self._respond(writer, 200, {"session_id": session_id, "deleted": True})
+        if len(parts) != 3 or parts[2] not in ("messages", "stream"):
+            return await self._respond(writer, 404, {"error": f"no route for {path}"})
+        if method != "POST":
+            return await self._respond(writer, 405, {"error": "use POST"})
+        try:
+            message = json.loads(body or b"{}")["message"]
+        except (ValueError, KeyError, TypeError):
+            return await self._respond(writer, 400, {"error": 'body must be json like {"message": "..."}'})
+
+        if self.pending >= self.max_pending:
+            return await self._respond(writer, 503, {"error": "server is busy, retry later"})
+        entry = self._session_locks.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        self.pending += 1
+        waiting = True
+        try:
+            # the session lock first: queued turns of one session wait without holding a concurrency slot
+            async with entry[0]:
+                await self.semaphore.acquire()
+                self.pending -= 1
+                waiting = False
+                self.active += 1
+                try:
+                    handler = self._invoke if parts[2] == "messages" else self._stream
+                    await handler(writer, session_id, message) # both enforce request_timeout themselves
+                finally:
+                    self.active -= 1
+                    self.semaphore.release()
+        finally:
+            if waiting: # gave up (client gone) before getting a slot
+                self.pending -= 1
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._session_locks[session_id]
+
+    async def handle(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        try:
+            request = await self._read_request(reader)
+            if request is not None:
+                method, path, _, body = request
+                await self._route(writer, method, path, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            try:
+                await self._respond(writer, 500, {"error": repr(e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def serve(self, host:str="127.0.0.1", port:int=8000):
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        print(f"RAG service listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv:Optional[list]=None):
+    parser = argparse.ArgumentParser(description="Serve the RAG agent over http")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrency", type=int, default=64)
+    parser.add_argument("--sessions-db", default=os.path.join(os.path.dirname(__file__), "rag_sessions.sqlite3"))
+    parser.add_argument("--no-warm-up", action="store_true", help="build the resources on the first request instead of before listening")
+    args = parser.parse_args(argv)
+
+    from rag_resources import RagResources
+    from sqlite_checkpointer import SQLiteSaver
+
+    resources = RagResources(corpus_dir=os.getenv("RAG_CORPUS_DIR")) # vector store, retriever and model clients are created once and shared
+    if not args.no_warm_up:
+        print(f"warmed up: {resources.warm_up()}")
+    graph = resources.build_agent(checkpointer=SQLiteSaver(args.sessions_db))
+    service = RagService(graph, max_concurrency=args.max_concurrency)
+    asyncio.run(service.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
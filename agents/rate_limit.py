@@ -0,0 +1,560 @@
+"""
+Process-wide rate limiting and retries for the model and embedding clients.
+
+Every call to a provider goes through a Scheduler (one per quota, see get_scheduler):
+
+  - token buckets for requests and tokens per minute (CHAT_RPM / CHAT_TPM, EMBED_RPM / EMBED_TPM)
+  - priority classes: waiting INTERACTIVE calls (chat turns, query embeddings) are admitted
+    before BULK ones (ingestion, batch runs), whatever order they arrived in
+  - 429 / quota errors are retried with jittered exponential backoff, and the scheduler backs
+    off as a whole (AIMD): concurrency and request rate are cut on a 429 and grow back slowly
+    while calls succeed, so load settles just under the real quota instead of retry storms
+  - FakeQuota is a local stand-in for a provider that answers 429 past its quota
+
+    python rate_limit.py --quota 600 --workers 32   # simulated load against a fake 600 rpm quota
+"""
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITIES = {"interactive": INTERACTIVE, "bulk": BULK}
+
+# only for errors that carry no status at all; a bare "quota" also matches config errors ("quota project not set")
+RATE_LIMIT_RE = re.compile(
+    r"\b429\b|resource(?:.?|\s+has\s+been\s+)exhausted|rate.?limit(?:ed|\s+exceeded)|too many requests|quota\s+(?:exceeded|exhausted)|exceeded\s+(?:\w+\s+){0,3}quota",
+    re.IGNORECASE,
+)
+RETRY_AFTER_RE = re.compile(r"retry(?:[ _-]?after|[ _-]?delay|[ _-]in)\D{0,20}(\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+
+
+def _status(error:BaseException)->Optional[Any]:
+    """http / grpc status the client attached to the error (or to the error it wraps), None if there is none"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        for value in (getattr(error, "status_code", None), getattr(error, "code", None), getattr(error, "status", None),
+                      getattr(getattr(error, "response", None), "status_code", None)):
+            if value is not None and not callable(value):
+                return value
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def is_rate_limited(error:Exception)->bool:
+    """429 / RESOURCE_EXHAUSTED from any client, by its status; the message wording only when there is no status"""
+    status = _status(error)
+    if status is not None:
+        return str(getattr(status, "value", status)).upper() in ("429", "RESOURCE_EXHAUSTED")
+    return bool(RATE_LIMIT_RE.search(str(error)))
+
+
+def retry_after(error:Exception)->Optional[float]:
+    """seconds the provider asked us to wait, if it said"""
+    value = getattr(error, "retry_after", None)
+    if value is not None:
+        return float(value)
+    match = RETRY_AFTER_RE.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+class TokenBucket:
+    """
+    Refills `rate` units per second up to `burst`. A request bigger than the burst is let
+    through once the bucket is full and leaves it in debt, so nothing waits forever.
+    rate=None means unlimited. Not thread safe, the Scheduler holds its lock around it.
+    """
+
+    def __init__(self, rate:Optional[float], burst:Optional[float]=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else (max(1.0, rate * 10) if rate else 0.0) # ~10s worth
+        self.level = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now:float):
+        if self.rate:
+            self.level = min(self.burst, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount:float, now:float)->float:
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        needed = min(amount, self.burst)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def take(self, amount:float, now:float):
+        if self.rate:
+            self._refill(now)
+            self.level -= amount
+
+    def give_back(self, amount:float):
+        if self.rate:
+            self.level = min(self.burst, self.level + amount)
+
+
+class Ticket:
+    __slots__ = ("priority", "seq", "tokens", "admitted")
+
+    def __init__(self, priority:int, seq:int, tokens:float):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.admitted = 0.0
+
+    def __lt__(self, other:"Ticket")->bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Scheduler:
+    """
+    Admission control for one provider quota. Waiters are admitted strictly in (priority, arrival)
+    order once a concurrency slot is free and both buckets have room. call()/acall() wrap a
+    provider call with admission, release and retries.
+
+    AIMD: on a 429 the concurrency limit is halved and the request rate set to 90% of what
+    succeeded over the last 10s (once per burst of 429s: only calls admitted after the last cut
+    can cut again). Every `limit` successes add one slot, every second without a 429 adds 5% to
+    the rate, up to the configured ceilings.
+    """
+
+    def __init__(self, rpm:Optional[float]=None, tpm:Optional[float]=None, max_concurrency:int=8,
+                 min_concurrency:int=1, max_retries:int=6, base_delay:float=0.5, max_delay:float=30.0):
+        self.max_rate = rpm / 60 if rpm else None
+        self.requests = TokenBucket(self.max_rate)
+        self.tokens = TokenBucket(tpm / 60 if tpm else None)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.stats = {"calls": 0, "retries": 0, "rate_limited": 0, "failed": 0, "waited_s": 0.0}
+        self._waiting:List[Ticket] = []
+        self._seq = itertools.count()
+        self._successes = 0
+        self._last_cut = 0.0
+        self._last_increase = time.monotonic()
+        self._admitted:deque = deque() # admission times of the last 10s
+        self._succeeded:deque = deque() # completion times of the successful calls of the last 10s
+        self._first_admitted:Optional[float] = None
+        self._cond = threading.Condition()
+
+    # admission
+    def _try_admit(self, ticket:Ticket)->Optional[float]:
+        """None if the ticket got in, otherwise seconds worth waiting before trying again"""
+        now = time.monotonic()
+        if self._waiting[0] is not ticket or self.in_flight >= int(self.limit):
+            return 0.05 # woken up early by release() in the sync path
+        wait = max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(ticket.tokens, now))
+        if wait > 0:
+            return wait
+        heapq.heappop(self._waiting)
+        self.requests.take(1, now)
+        self.tokens.take(ticket.tokens, now)
+        self.in_flight += 1
+        ticket.admitted = now
+        if self._first_admitted is None:
+            self._first_admitted = now
+        self._admitted.append(now)
+        while self._admitted and now - self._admitted[0] > 10:
+            self._admitted.popleft()
+        return None
+
+    def _ticket(self, tokens:float, priority:int)->Ticket:
+        ticket = Ticket(priority, next(self._seq), tokens)
+        heapq.heappush(self._waiting, ticket)
+        return ticket
+
+    def acquire(self, tokens:float=0, priority:int=INTERACTIVE)->Ticket:
+        started = time.monotonic()
+        with self._cond:
+            ticket = self._ticket(tokens, priority)
+            while (wait := self._try_admit(ticket)) is not None:
+                self._cond.wait(wait)
+            self.stats["waited_s"] += time.monotonic() - started
+        return ticket
+
+    async def aacquire(self, tokens:float=0, priority:int=INTERACTIVE)->Ticket:
+        started = time.monotonic()
+        with self._cond:
+            ticket = self._ticket(tokens, priority)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_admit(ticket)
+                if wait is None:
+                    break
+                await asyncio.sleep(min(wait, 0.05)) # never block the event loop on the condition
+        except asyncio.CancelledError:
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self.stats["waited_s"] += time.monotonic() - started
+        return ticket
+
+    def release(self, ticket:Ticket, rate_limited:bool=False, used_tokens:Optional[float]=None, delay:Optional[float]=None):
+        now = time.monotonic()
+        with self._cond:
+            self.in_flight -= 1
+            if used_tokens is not None:
+                self.tokens.give_back(ticket.tokens - used_tokens) # correct the estimate with the real usage
+            if rate_limited:
+                self.stats["rate_limited"] += 1
+                if ticket.admitted >= self._last_cut:
+                    self._cut(now)
+                if delay:
+                    self.paused_until = max(self.paused_until, now + delay) # the provider told everyone to wait
+            else:
+                self._grow(now)
+            self._cond.notify_all()
+
+    def _cut(self, now:float):
+        self._last_cut = now
+        self._last_increase = now
+        self._successes = 0
+        self.limit = max(float(self.min_concurrency), self.limit / 2)
+        # what actually got through recently is the best guess of the quota
+        span = max(1.0, min(10.0, now - self._first_admitted))
+        if self._succeeded:
+            observed = len(self._succeeded) / span * 0.9
+        else:
+            observed = len(self._admitted) / span * 0.5
+        rate = min(self.requests.rate or float("inf"), observed)
+        self.requests.rate = max(0.1, rate)
+        self.requests.burst = max(1.0, self.requests.rate) # small bursts until we know the quota again
+        self.requests.level = min(self.requests.level, self.requests.burst)
+
+    def _grow(self, now:float):
+        self._successes += 1
+        self._succeeded.append(now)
+        while self._succeeded and now - self._succeeded[0] > 10:
+            self._succeeded.popleft()
+        if self._successes >= self.limit and self.limit < self.max_concurrency:
+            self.limit += 1
+            self._successes = 0
+        if self.requests.rate and now - self._last_increase >= 1.0:
+            self._last_increase = now
+            grown = self.requests.rate * 1.05
+            if self.max_rate is None and now - self._last_cut > 60:
+                self.requests.rate = None # a quiet minute since the last 429, drop the learned limit
+            else:
+                self.requests.rate = min(grown, self.max_rate or grown)
+
+    # retries
+    def _count(self, name:str):
+        with self._cond:
+            self.stats[name] += 1
+
+    def _backoff(self, attempt:int, error:Exception)->float:
+        hinted = retry_after(error)
+        if hinted is not None:
+            return hinted
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)) # full jitter
+
+    def call(self, fn:Callable[[], Any], tokens:float=0, priority:int=INTERACTIVE, usage:Optional[Callable[[Any], Optional[float]]]=None)->Any:
+        """runs fn() under the limits; rate limit errors are retried, anything else is raised right away"""
+        self._count("calls")
+        for attempt in range(self.max_retries + 1):
+            ticket = self.acquire(tokens, priority)
+            try:
+                result = fn()
+            except Exception as e:
+                limited = is_rate_limited(e)
+                self.release(ticket, rate_limited=limited, delay=retry_after(e) if limited else None)
+                if not limited or attempt == self.max_retries:
+                    self._count("failed")
+                    raise
+                self._count("retries")
+                time.sleep(self._backoff(attempt, e))
+                continue
+            self.release(ticket, used_tokens=usage(result) if usage else None)
+            return result
+
+    async def acall(self, fn:Callable[[], Any], tokens:float=0, priority:int=INTERACTIVE, usage:Optional[Callable[[Any], Optional[float]]]=None)->Any:
+        """async call(), fn returns an awaitable"""
+        self._count("calls")
+        for attempt in range(self.max_retries + 1):
+            ticket = await self.aacquire(tokens, priority)
+            try:
+                result = await fn()
+            except Exception as e:
+                limited = is_rate_limited(e)
+                self.release(ticket, rate_limited=limited, delay=retry_after(e) if limited else None)
+                if not limited or attempt == self.max_retries:
+                    self._count("failed")
+                    raise
+                self._count("retries")
+                await asyncio.sleep(self._backoff(attempt, e))
+                continue
+            except BaseException: # cancelled while waiting on the provider
+                self.release(ticket)
+                raise
+            self.release(ticket, used_tokens=usage(result) if usage else None)
+            return result
+
+    def snapshot(self)->dict:
+        with self._cond:
+            return {
+                **{k: round(v, 3) if isinstance(v, float) else v for k, v in self.stats.items()},
+                "concurrency_limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "waiting": len(self._waiting),
+                "rpm_limit": round(self.requests.rate * 60, 1) if self.requests.rate else None,
+            }
+
+
+_schedulers:Dict[str, Scheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def _env_float(name:str)->Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+def get_scheduler(name:str="chat")->Scheduler:
+    """
+    the process-wide scheduler of one quota, configured from <PREFIX>_RPM, <PREFIX>_TPM and
+    <PREFIX>_CONCURRENCY with PREFIX = CHAT or EMBED (unset = no fixed ceiling, only AIMD)
+    """
+    with _schedulers_lock:
+        if name not in _schedulers:
+            prefix = {"chat": "CHAT", "embeddings": "EMBED"}.get(name, name.upper())
+            _schedulers[name] = Scheduler(
+                rpm=_env_float(f"{prefix}_RPM"),
+                tpm=_env_float(f"{prefix}_TPM"),
+                max_concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", "8")),
+            )
+        return _schedulers[name]
+
+
+# client wrappers
+def _message_tokens(messages)->float:
+    from history_window import estimate_message_tokens
+    return estimate_message_tokens(messages)
+
+
+def _usage_tokens(message)->Optional[float]:
+    usage = getattr(message, "usage_metadata", None)
+    return usage.get("total_tokens") if usage else None
+
+
+def _as_chunk(message)->BaseMessageChunk:
+    """models without a real stream() yield their whole message once"""
+    if isinstance(message, BaseMessageChunk):
+        return message
+    return AIMessageChunk(
+        content=message.content, id=message.id, response_metadata=message.response_metadata,
+        usage_metadata=getattr(message, "usage_metadata", None),
+        tool_call_chunks=[{"name": t["name"], "args": json.dumps(t["args"]), "id": t["id"], "index": i} for i, t in enumerate(getattr(message, "tool_calls", []))],
+    )
+
+
+class RateLimitedChatModel(BaseChatModel):
+    """
+    Sends every call of `inner` through the scheduler. The token estimate is the prompt plus
+    `expected_output_tokens`, corrected with the real usage once the response is in.
+    A stream is only retried if the 429 came before its first chunk, and holds its slot until then.
+    """
+
+    inner:Any = None
+    scheduler:Any = None
+    priority:int = INTERACTIVE
+    expected_output_tokens:int = 512
+
+    @property
+    def _llm_type(self)->str:
+        return "rate-limited"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"inner": self.inner.bind_tools(tools, **kwargs)})
+
+    def _tokens(self, messages)->float:
+        return _message_tokens(messages) + self.expected_output_tokens
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs)->ChatResult:
+        response = self.scheduler.call(lambda: self.inner.invoke(messages, stop=stop, **kwargs), self._tokens(messages), self.priority, _usage_tokens)
+        return ChatResult(generations=[ChatGeneration(message=response)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs)->ChatResult:
+        response = await self.scheduler.acall(lambda: self.inner.ainvoke(messages, stop=stop, **kwargs), self._tokens(messages), self.priority, _usage_tokens)
+        return ChatResult(generations=[ChatGeneration(message=response)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        def first_chunk():
+            stream = iter(self.inner.stream(messages, stop=stop, **kwargs))
+            return stream, next(stream, None)
+
+        stream, chunk = self.scheduler.call(first_chunk, self._tokens(messages), self.priority)
+        while chunk is not None:
+            chunk = _as_chunk(chunk)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+            chunk = next(stream, None)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async def first_chunk():
+            stream = self.inner.astream(messages, stop=stop, **kwargs).__aiter__()
+            try:
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+
+        stream, chunk = await self.scheduler.acall(first_chunk, self._tokens(messages), self.priority)
+        while chunk is not None:
+            chunk = _as_chunk(chunk)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+            try:
+                chunk = await stream.__anext__()
+            except StopAsyncIteration:
+                chunk = None
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """embed_documents runs as BULK (ingestion), query embeddings as INTERACTIVE"""
+
+    def __init__(self, inner:Embeddings, scheduler:Scheduler):
+        self.inner = inner
+        self.scheduler = scheduler
+        self.model = getattr(inner, "model", type(inner).__name__) # keeps the embedding cache keys unchanged
+
+    @staticmethod
+    def _tokens(texts:List[str])->float:
+        from history_window import estimate_tokens
+        return sum(estimate_tokens(t) for t in texts)
+
+    def embed_documents(self, texts:List[str])->List[List[float]]:
+        return self.scheduler.call(lambda: self.inner.embed_documents(texts), self._tokens(texts), BULK)
+
+    def embed_query(self, text:str)->List[float]:
+        return self.scheduler.call(lambda: self.inner.embed_query(text), self._tokens([text]), INTERACTIVE)
+
+    def embed_queries(self, texts:List[str])->List[List[float]]:
+        from embedding_cache import embed_queries
+        return self.scheduler.call(lambda: embed_queries(self.inner, texts), self._tokens(texts), INTERACTIVE)
+
+    async def aembed_documents(self, texts:List[str])->List[List[float]]:
+        return await self.scheduler.acall(lambda: self.inner.aembed_documents(texts), self._tokens(texts), BULK)
+
+    async def aembed_query(self, text:str)->List[float]:
+        return await self.scheduler.acall(lambda: self.inner.aembed_query(text), self._tokens([text]), INTERACTIVE)
+
+
+# local stand-in for a provider quota
+class QuotaExceeded(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after:Optional[float]=None):
+        super().__init__("429 RESOURCE_EXHAUSTED: quota exceeded")
+        self.retry_after = retry_after
+
+
+class FakeQuota:
+    """
+    Answers like a provider with a sliding-window quota of `limit` requests per `window` seconds:
+    check() raises QuotaExceeded (status_code 429) past the quota, rejected requests count too.
+    """
+
+    def __init__(self, limit:int, window:float=60.0, latency:float=0.0, retry_after:Optional[float]=None):
+        self.limit = limit
+        self.window = window
+        self.latency = latency
+        self.retry_after = retry_after
+        self.accepted = 0
+        self.rejected = 0
+        self._calls:deque = deque()
+        self._lock = threading.Lock()
+
+    def _admit(self)->bool:
+        now = time.monotonic()
+        with self._lock:
+            while self._calls and now - self._calls[0] > self.window:
+                self._calls.popleft()
+            if len(self._calls) >= self.limit:
+                self.rejected += 1
+                return False
+            self._calls.append(now)
+            self.accepted += 1
+            return True
+
+    def check(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if not self._admit():
+            raise QuotaExceeded(self.retry_after)
+
+    async def acheck(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if not self._admit():
+            raise QuotaExceeded(self.retry_after)
+
+
+def simulate(quota_rpm:float, requests:int, workers:int, latency:float, limited:bool=True)->dict:
+    """`workers` threads send `requests` calls at a fake quota (1s window); with limited=False there is no scheduler"""
+    from concurrent.futures import ThreadPoolExecutor
+    quota = FakeQuota(limit=max(1, int(quota_rpm / 60)), window=1.0, latency=latency)
+    scheduler = Scheduler(max_concurrency=workers, max_retries=50, base_delay=0.05, max_delay=1.0)
+
+    def one(_):
+        if limited:
+            scheduler.call(quota.check)
+            return
+        while True: # what a naive client does: retry right away
+            try:
+                return quota.check()
+            except QuotaExceeded:
+                continue
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(one, range(requests)))
+    elapsed = time.monotonic() - started
+    return {
+        "throughput_rpm": round(requests / elapsed * 60, 1),
+        "quota_rpm": quota_rpm,
+        "utilization": round(requests / elapsed * 60 / quota_rpm, 3),
+        "rejected": quota.rejected,
+        "scheduler": scheduler.snapshot() if limited else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="simulated load against a fake 429-ing provider")
+    parser.add_argument("--quota", type=float, default=600, help="requests per minute the fake provider allows")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per fake provider call")
+    args = parser.parse_args()
+    for limited in (False, True):
+        result = simulate(args.quota, args.requests, args.workers, args.latency, limited)
+        print(("scheduler " if limited else "naive     ") + str(result))
+
+
+if __name__ == "__main__":
+    main()
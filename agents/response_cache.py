@@ -0,0 +1,222 @@
+"""
+Persistent response cache for chat models, plugged in through langchain's `cache=` hook.
+
+    llm = get_chat_model("gemini-2.5-flash", cache=ResponseCache("response_cache.sqlite3"))
+
+A hit returns the stored generations without calling the model, from sqlite on local disk.
+Several processes can share one cache file (WAL mode, every write is its own transaction).
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, List, Optional, Sequence
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+
+
+def prompt_text(prompt:str)->str:
+    """
+    The conversation in a langchain cache prompt (dumps of the message list) as plain
+    "role: content" lines, whitespace collapsed and case folded, so trivially different
+    spellings of the same prompt share a key. Unknown formats are only normalized.
+    """
+    try:
+        messages = json.loads(prompt)
+        lines = []
+        for message in messages:
+            kwargs = message["kwargs"]
+            content = kwargs.get("content", "")
+            if not isinstance(content, str):
+                content = json.dumps(content, sort_keys=True)
+            line = f"{kwargs.get('type', message['id'][-1])}: {content}"
+            if kwargs.get("tool_calls"):
+                line += " " + json.dumps([[c["name"], c["args"]] for c in kwargs["tool_calls"]], sort_keys=True)
+            lines.append(line)
+        text = "\n".join(lines)
+    except (ValueError, KeyError, TypeError, IndexError):
+        text = prompt
+    text = "\n".join(" ".join(line.split()) for line in text.casefold().splitlines())
+    return re.sub(r"[\s?!.]+$", "", text) # "hello!" and "hello" are the same question
+
+
+def _dump(generations:Sequence[Generation])->str:
+    return json.dumps([
+        {"text": g.text, "message": message_to_dict(g.message)} if isinstance(g, ChatGeneration) else {"text": g.text}
+        for g in generations
+    ])
+
+
+def _load(value:str)->List[Generation]:
+    generations:List[Generation] = []
+    for g in json.loads(value):
+        if "message" in g:
+            generations.append(ChatGeneration(message=messages_from_dict([g["message"]])[0]))
+        else:
+            generations.append(Generation(text=g["text"]))
+    return generations
+
+
+class ResponseCache(BaseCache):
+    """
+    Exact matches are keyed by sha256(model + params, normalized prompt). With `embeddings` and
+    `similarity_threshold` set, a miss is also compared (cosine) against the cached prompts of the
+    same model + params, and the closest one is served if it scores at least the threshold.
+    Entries expire after `ttl` seconds; past `max_entries` the least recently used ones are evicted.
+    Hit counters are kept in the database, so stats() covers every process using the file.
+    """
+
+    def __init__(self, path:str, ttl:float=7 * 24 * 3600, max_entries:int=10_000,
+                 embeddings:Optional[Embeddings]=None, similarity_threshold:Optional[float]=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, llm TEXT NOT NULL, prompt TEXT NOT NULL, "
+                "response TEXT NOT NULL, vector BLOB, created REAL NOT NULL, last_used REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_llm ON responses(llm)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses(created)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._rows = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] # upper bound, recounted before evicting
+        # prompt vectors per llm, loaded incrementally by rowid (rows other processes added are picked up too)
+        self._vectors:dict = {}
+        # vectors of the prompts that just missed, so update() doesn't embed the same prompt again
+        self._missed:OrderedDict = OrderedDict()
+
+    @property
+    def semantic(self)->bool:
+        return self.embeddings is not None and self.similarity_threshold is not None
+
+    @staticmethod
+    def _llm_key(llm_string:str)->str:
+        return hashlib.sha256(llm_string.encode("utf-8")).hexdigest()
+
+    def _key(self, llm:str, text:str)->str:
+        return hashlib.sha256(f"{llm}\0{text}".encode("utf-8")).hexdigest()
+
+    def _count(self, name:str):
+        self._conn.execute("INSERT INTO stats (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def _fetch(self, key:str, now:float)->Optional[str]:
+        row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            return None
+        self._conn.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        return row[0]
+
+    def _similar(self, llm:str, vector:List[float])->List[str]:
+        """keys of the cached prompts of this llm, best match first, above the threshold"""
+        import numpy as np
+        keys, matrix, last_row = self._vectors.get(llm, ([], None, 0))
+        rows = self._conn.execute(
+            "SELECT rowid, key, vector FROM responses WHERE llm = ? AND rowid > ? AND vector IS NOT NULL ORDER BY rowid", (llm, last_row)
+        ).fetchall()
+        if rows:
+            fresh = np.asarray([array("f", blob) for _, _, blob in rows], dtype=np.float32)
+            keys = keys + [key for _, key, _ in rows]
+            matrix = fresh if matrix is None else np.vstack([matrix, fresh])
+            last_row = rows[-1][0]
+            self._vectors[llm] = (keys, matrix, last_row)
+        if matrix is None:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+        order = np.argsort(-scores)
+        return [keys[i] for i in order[:8] if scores[i] >= self.similarity_threshold]
+
+    def lookup(self, prompt:str, llm_string:str)->Optional[RETURN_VAL_TYPE]:
+        llm = self._llm_key(llm_string)
+        text = prompt_text(prompt)
+        now = time.time()
+        with self._lock, self._conn:
+            value = self._fetch(self._key(llm, text), now)
+            if value is not None:
+                self._count("hits")
+                return _load(value)
+        if self.semantic:
+            vector = self.embeddings.embed_query(text)
+            with self._lock, self._conn:
+                for key in self._similar(llm, vector):
+                    value = self._fetch(key, now) # might have expired or been evicted meanwhile
+                    if value is not None:
+                        self._count("semantic_hits")
+                        return _load(value)
+                self._missed[(llm, text)] = vector
+                while len(self._missed) > 64: # calls that failed never reach update()
+                    self._missed.popitem(last=False)
+        with self._lock, self._conn:
+            self._count("misses")
+        return None
+
+    def update(self, prompt:str, llm_string:str, return_val:RETURN_VAL_TYPE):
+        llm = self._llm_key(llm_string)
+        text = prompt_text(prompt)
+        vector = None
+        if self.semantic:
+            with self._lock:
+                vector = self._missed.pop((llm, text), None)
+            if vector is None:
+                vector = self.embeddings.embed_query(text)
+            vector = array("f", vector).tobytes()
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, llm, prompt, response, vector, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(llm, text), llm, text, _dump(return_val), vector, now, now),
+            )
+            self._rows += 1
+            if self._rows > self.max_entries:
+                self._evict(now)
+
+    def _evict(self, now:float):
+        expired = self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,)).rowcount
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        evicted = 0
+        if count > self.max_entries:
+            # a bit below the cap, so the next few updates don't evict again
+            keep = max(self.max_entries - max(self.max_entries // 16, 1), 0)
+            evicted = self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)", (count - keep,)
+            ).rowcount
+            count -= evicted
+        self._rows = count
+        if expired or evicted:
+            self._vectors.clear() # rebuilt from the table on the next semantic lookup
+
+    def clear(self, **kwargs:Any):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("DELETE FROM stats")
+            self._rows = 0
+            self._vectors.clear()
+            self._missed.clear()
+
+    def stats(self)->dict:
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        hits = counts.get("hits", 0) + counts.get("semantic_hits", 0)
+        total = hits + counts.get("misses", 0)
+        return {
+            "hits": counts.get("hits", 0),
+            "semantic_hits": counts.get("semantic_hits", 0),
+            "misses": counts.get("misses", 0),
+            "hit_rate": hits / total if total else 0.0,
+            "entries": entries,
+        }
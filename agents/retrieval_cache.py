@@ -0,0 +1,192 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+
+from langchain_core.documents import Document
+
+
+def normalize_query(query:str)->str:
+    """lowercase, drop punctuation and collapse whitespace, so trivial rewrites share a key"""
+    query = re.sub(r"[^\w\s&$%.-]", " ", query.lower())
+    return " ".join(query.split())
+
+
+class RetrievalCache:
+    """
+    Caches retriever results in front of retriever.invoke.
+    Lookups match on the normalized query string, and if an embeddings model and a
+    similarity_threshold are given, also on cosine similarity of the query embeddings.
+    Entries expire after `ttl` seconds and the least recently used ones are dropped past
+    max_entries. The cache is tied to a `generation` (the ingest manifest version),
+    so re-ingesting the collection invalidates everything. With a `path` the entries live
+    in sqlite (WAL, one small transaction per put), survive restarts and are shared by
+    every process using the file; without one the cache is in memory only.
+    """
+
+    def __init__(
+        self,
+        path:Optional[str]=None,
+        ttl:float=24 * 3600,
+        max_entries:int=1024,
+        embeddings=None,
+        similarity_threshold:Optional[float]=None,
+        generation:int=0,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.generation = generation
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or ":memory:", timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, generation INTEGER NOT NULL, docs TEXT NOT NULL, "
+                "vector BLOB, created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used)")
+            # entries of an older ingest are useless, drop them right away
+            self._conn.execute("DELETE FROM entries WHERE generation != ?", (generation,))
+        self._rows = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] # upper bound, recounted before evicting
+        self._reset_vectors()
+
+    @property
+    def semantic(self)->bool:
+        return self.embeddings is not None and self.similarity_threshold is not None
+
+    def _reset_vectors(self):
+        # query vectors of the entries as one matrix, grown in place and loaded incrementally by rowid
+        # (rows other processes added are picked up too); a key that is written again reuses its slot
+        self._matrix = None
+        self._keys:List[Optional[str]] = []
+        self._slots:Dict[str, int] = {}
+        self._last_row = 0
+
+    def _load_vectors(self):
+        import numpy as np
+        rows = self._conn.execute(
+            "SELECT rowid, key, vector FROM entries WHERE rowid > ? AND generation = ? AND vector IS NOT NULL ORDER BY rowid",
+            (self._last_row, self.generation),
+        ).fetchall()
+        if not rows:
+            return
+        self._last_row = rows[-1][0]
+        for _, key, blob in rows:
+            vector = np.frombuffer(blob, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) + 1e-12)
+            if self._matrix is None:
+                self._matrix = np.zeros((64, len(vector)), dtype=np.float32)
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = len(self._keys)
+                if slot == len(self._matrix):
+                    grown = np.zeros((2 * len(self._matrix), self._matrix.shape[1]), dtype=np.float32)
+                    grown[:slot] = self._matrix
+                    self._matrix = grown
+                self._keys.append(key)
+                self._slots[key] = slot
+            self._matrix[slot] = vector
+
+    def _drop_vector(self, key:str):
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self._matrix[slot] = 0 # scores 0, never above the threshold
+            self._keys[slot] = None
+
+    def _semantic_matches(self, vector:List[float])->List[str]:
+        """keys of the cached queries closest to `vector`, best first, above the threshold"""
+        import numpy as np
+        self._load_vectors()
+        if not self._slots:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        scores = self._matrix[:len(self._keys)] @ (query / (np.linalg.norm(query) + 1e-12))
+        order = np.argsort(-scores)[:8]
+        return [self._keys[i] for i in order if scores[i] >= self.similarity_threshold and self._keys[i] is not None]
+
+    def _fetch(self, key:str, now:float)->Optional[list]:
+        row = self._conn.execute("SELECT docs, created FROM entries WHERE key = ? AND generation = ?", (key, self.generation)).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > self.ttl:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._drop_vector(key)
+            return None
+        self._conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def invalidate(self, generation:Optional[int]=None):
+        """drops every entry, called when the collection is re-ingested"""
+        with self._lock, self._conn:
+            if generation is not None:
+                self.generation = generation
+            self._conn.execute("DELETE FROM entries")
+            self._rows = 0
+            self._reset_vectors()
+
+    def get(self, query:str)->Optional[List[Document]]:
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock, self._conn:
+            docs = self._fetch(key, now)
+        if docs is None and self.semantic:
+            # the query embedding is needed for the vector search on a miss anyway (and is cached there)
+            vector = self.embeddings.embed_query(query)
+            with self._lock, self._conn:
+                for match in self._semantic_matches(vector):
+                    docs = self._fetch(match, now) # might have expired or been evicted by another process
+                    if docs is not None:
+                        break
+        with self._lock:
+            if docs is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in docs]
+
+    def put(self, query:str, docs:List[Document]):
+        vector = array("f", self.embeddings.embed_query(query)).tobytes() if self.semantic else None
+        payload = json.dumps([{"page_content": d.page_content, "metadata": d.metadata} for d in docs])
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, generation, docs, vector, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (normalize_query(query), self.generation, payload, vector, now, now),
+            )
+            self._rows += 1
+            if self._rows > self.max_entries:
+                self._evict(now)
+
+    def _evict(self, now:float):
+        self._conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        if count > self.max_entries:
+            # a bit below the cap, so the next few puts don't evict again
+            keep = max(self.max_entries - max(self.max_entries // 16, 1), 0)
+            self._conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used LIMIT ?)", (count - keep,)
+            )
+            count = keep
+        self._rows = count
+        self._reset_vectors() # rebuilt from the table on the next semantic lookup
+
+    def stats(self)->dict:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": entries,
+        }
@@ -0,0 +1,406 @@
+import asyncio
+import hashlib
+import random
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    checkpoint_type TEXT NOT NULL,
+    checkpoint BLOB NOT NULL,
+    metadata_type TEXT NOT NULL,
+    metadata BLOB NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    kind TEXT NOT NULL,            -- 'full', 'delta' (list tail on top of base_version) or 'empty'
+    base_version TEXT,
+    length INTEGER,                -- for lists: length, ids of the first / last item, delta chain depth
+    first_id TEXT,
+    last_id TEXT,
+    depth INTEGER,
+    digest TEXT,                   -- and a content hash of the whole list
+    type TEXT,
+    data BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+def _item_id(item:Any):
+    return getattr(item, "id", None)
+
+
+def _fingerprint(item:Any)->str:
+    # the fields a message edit can touch; pydantic's repr of a whole message is ~100x slower
+    if hasattr(item, "content") and hasattr(item, "type"):
+        return repr((item.type, item.id, item.content, getattr(item, "tool_calls", None), getattr(item, "name", None),
+                     getattr(item, "tool_call_id", None), item.additional_kwargs))
+    return repr(item)
+
+
+def _digest(items:Sequence[Any], hasher=None):
+    """running sha256 over the items, pass the returned hasher back in to extend it with more items"""
+    hasher = hasher or hashlib.sha256()
+    for item in items:
+        hasher.update(_fingerprint(item).encode("utf-8", "backslashreplace"))
+        hasher.update(b"\0")
+    return hasher
+
+
+class MissingBlobError(LookupError):
+    pass
+
+
+class SQLiteSaver(BaseCheckpointSaver[str]):
+    """
+    LangGraph checkpointer backed by a local sqlite database in WAL mode, keyed by thread_id.
+
+    Only the channels that changed in a step are written. List channels (like `messages`
+    with the add_messages reducer) are stored as deltas: when the new list still starts with
+    the previously stored one (same ids and the same content hash over the stored prefix, so
+    a message replaced by id in the middle forces a full copy), only the new tail is serialized,
+    with a pointer to the base version. Every `snapshot_every` deltas a full copy is written so rebuilding a list never
+    walks a long chain. Nothing is kept in memory per session apart from a small LRU of
+    "what was the last stored list" markers, so thousands of threads can live in one process.
+    """
+
+    def __init__(self, path:str, *, snapshot_every:int=50, max_tracked_channels:int=10_000, serde=None):
+        super().__init__(serde=serde)
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.max_tracked_channels = max_tracked_channels
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if "digest" not in {row[1] for row in self.conn.execute("PRAGMA table_info(blobs)")}:
+            # databases from before the content hash, their rows have none and get a full copy next
+            self.conn.execute("ALTER TABLE blobs ADD COLUMN digest TEXT")
+        # (thread, ns, channel) -> (version, length, first item id, last item id, chain depth, digest)
+        self._last_list:"OrderedDict[tuple, tuple]" = OrderedDict()
+
+    # -- blobs -----------------------------------------------------------------------
+
+    def _remember(self, key:tuple, marker:tuple):
+        self._last_list[key] = marker
+        self._last_list.move_to_end(key)
+        while len(self._last_list) > self.max_tracked_channels:
+            self._last_list.popitem(last=False)
+
+    def _forget(self, thread_id:str):
+        for key in [k for k in self._last_list if k[0] == thread_id]:
+            del self._last_list[key]
+
+    def _previous_list(self, thread_id:str, ns:str, channel:str)->Optional[tuple]:
+        key = (thread_id, ns, channel)
+        if key in self._last_list:
+            return self._last_list[key]
+        # not tracked (restart or evicted): the newest stored row has everything the prefix check needs
+        row = self.conn.execute(
+            "SELECT version, length, first_id, last_id, depth, digest FROM blobs WHERE thread_id=? AND checkpoint_ns=? AND channel=? "
+            "AND kind != 'empty' ORDER BY version DESC LIMIT 1",
+            (thread_id, ns, channel),
+        ).fetchone()
+        if row is None or not row[1]:
+            return None
+        self._remember(key, tuple(row))
+        return tuple(row)
+
+    def _write_blob(self, thread_id:str, ns:str, channel:str, version:str, value:Any, present:bool):
+        if not present:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO blobs (thread_id, checkpoint_ns, channel, version, kind) VALUES (?, ?, ?, ?, 'empty')",
+                (thread_id, ns, channel, version),
+            )
+            return
+        kind, base, payload, depth = "full", None, value, 0
+        marker = (None, None, None, None, None)
+        if isinstance(value, list) and value:
+            prev = self._previous_list(thread_id, ns, channel)
+            hasher = None
+            if prev is not None:
+                prev_version, prev_len, first_id, last_id, prev_depth, prev_digest = prev
+                # the ids are a cheap reject, the hash catches messages replaced by id in the middle
+                is_prefix = (
+                    prev_version != version
+                    and prev_digest is not None
+                    and len(value) >= prev_len
+                    and _item_id(value[0]) == first_id
+                    and _item_id(value[prev_len - 1]) == last_id
+                )
+                if is_prefix:
+                    hasher = _digest(value[:prev_len])
+                    if hasher.hexdigest() == prev_digest and prev_depth < self.snapshot_every:
+                        kind, base, payload, depth = "delta", prev_version, value[prev_len:], prev_depth + 1
+                    _digest(value[prev_len:], hasher)
+            digest = (hasher or _digest(value)).hexdigest()
+            marker = (len(value), _item_id(value[0]), _item_id(value[-1]), depth, digest)
+            self._remember((thread_id, ns, channel), (version, *marker))
+        type_, data = self.serde.dumps_typed(payload)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO blobs (thread_id, checkpoint_ns, channel, version, kind, base_version, length, first_id, last_id, depth, digest, type, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (thread_id, ns, channel, version, kind, base, *marker, type_, data),
+        )
+
+    def _load_value(self, thread_id:str, ns:str, channel:str, version:str)->Any:
+        """rebuilds a channel value by following delta rows back to the last full copy"""
+        segments = []
+        current = version
+        while current is not None:
+            row = self.conn.execute(
+                "SELECT kind, base_version, type, data FROM blobs WHERE thread_id=? AND checkpoint_ns=? AND channel=? AND version=?",
+                (thread_id, ns, channel, current),
+            ).fetchone()
+            if row is None and current != version:
+                raise MissingBlobError(f"thread {thread_id!r}: {channel} version {current} is missing from the delta chain")
+            if row is None or row[0] == "empty":
+                return None
+            kind, base, type_, data = row
+            segments.append(self.serde.loads_typed((type_, data)))
+            current = base if kind == "delta" else None
+        if len(segments) == 1:
+            return segments[0]
+        value = []
+        for segment in reversed(segments):
+            value.extend(segment)
+        return value
+
+    def _load_blobs(self, thread_id:str, ns:str, versions:ChannelVersions)->dict:
+        values = {}
+        for channel, version in versions.items():
+            value = self._load_value(thread_id, ns, channel, str(version))
+            if value is not None:
+                values[channel] = value
+        return values
+
+    def get_messages(self, thread_id:str, limit:Optional[int]=None, channel:str="messages", checkpoint_ns:str="")->list:
+        """
+        Newest `limit` items of a list channel without materializing the whole history:
+        delta rows are read from the newest one backwards until there are enough items.
+        A row missing from the chain raises MissingBlobError rather than returning a partial history.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT version FROM blobs WHERE thread_id=? AND checkpoint_ns=? AND channel=? AND kind != 'empty' "
+                "ORDER BY version DESC LIMIT 1",
+                (thread_id, checkpoint_ns, channel),
+            ).fetchone()
+            if row is None:
+                return []
+            items:List[Any] = []
+            current = row[0]
+            while current is not None and (limit is None or len(items) < limit):
+                row = self.conn.execute(
+                    "SELECT kind, base_version, type, data FROM blobs WHERE thread_id=? AND checkpoint_ns=? AND channel=? AND version=?",
+                    (thread_id, checkpoint_ns, channel, current),
+                ).fetchone()
+                if row is None:
+                    raise MissingBlobError(f"thread {thread_id!r}: {channel} version {current} is missing from the delta chain")
+                kind, base, type_, data = row
+                if kind == "empty":
+                    break
+                items = list(self.serde.loads_typed((type_, data))) + items
+                current = base if kind == "delta" else None
+        return items if limit is None else items[-limit:]
+
+    # -- BaseCheckpointSaver ---------------------------------------------------------
+
+    def _tuple(self, thread_id:str, ns:str, row:tuple)->CheckpointTuple:
+        checkpoint_id, parent_id, c_type, c_data, m_type, m_data = row
+        checkpoint = self.serde.loads_typed((c_type, c_data))
+        writes = self.conn.execute(
+            "SELECT task_id, channel, type, value FROM writes WHERE thread_id=? AND checkpoint_ns=? AND checkpoint_id=? ORDER BY rowid",
+            (thread_id, ns, checkpoint_id),
+        ).fetchall()
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint_id}},
+            checkpoint={**checkpoint, "channel_values": self._load_blobs(thread_id, ns, checkpoint["channel_versions"])},
+            metadata=self.serde.loads_typed((m_type, m_data)),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": parent_id}}
+                if parent_id
+                else None
+            ),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((t, v))) for task_id, channel, t, v in writes],
+        )
+
+    def get_tuple(self, config:RunnableConfig)->Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata"
+        with self._lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self.conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id=? AND checkpoint_ns=? AND checkpoint_id=?",
+                    (thread_id, ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self.conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id=? AND checkpoint_ns=? ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, ns),
+                ).fetchone()
+            return self._tuple(thread_id, ns, row) if row else None
+
+    def list(
+        self,
+        config:Optional[RunnableConfig],
+        *,
+        filter:Optional[dict]=None,
+        before:Optional[RunnableConfig]=None,
+        limit:Optional[int]=None,
+    )->Iterator[CheckpointTuple]:
+        query = "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata FROM checkpoints"
+        clauses, params = [], []
+        if config:
+            clauses.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (ns := config["configurable"].get("checkpoint_ns")) is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                clauses.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            clauses.append("checkpoint_id < ?")
+            params.append(before_id)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY checkpoint_id DESC"
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+        for thread_id, ns, *row in rows:
+            if limit is not None and limit <= 0:
+                break
+            metadata = self.serde.loads_typed((row[4], row[5]))
+            if filter and not all(metadata.get(k) == v for k, v in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            with self._lock:
+                item = self._tuple(thread_id, ns, tuple(row))
+            yield item
+
+    def put(
+        self,
+        config:RunnableConfig,
+        checkpoint:Checkpoint,
+        metadata:CheckpointMetadata,
+        new_versions:ChannelVersions,
+    )->RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        c = checkpoint.copy()
+        values = c.pop("channel_values") # type: ignore[misc]
+        c_type, c_data = self.serde.dumps_typed(c)
+        m_type, m_data = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                # only channels that changed in this step are written
+                for channel, version in new_versions.items():
+                    self._write_blob(thread_id, ns, channel, str(version), values.get(channel), channel in values)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, ns, checkpoint["id"], config["configurable"].get("checkpoint_id"), c_type, c_data, m_type, m_data),
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                self._forget(thread_id)
+                raise
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config:RunnableConfig, writes:Sequence[Tuple[str, Any]], task_id:str, task_path:str="")->None:
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        special, regular = [], []
+        for idx, (channel, value) in enumerate(writes):
+            type_, data = self.serde.dumps_typed(value)
+            row = (thread_id, ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel, type_, data, task_path)
+            (special if channel in WRITES_IDX_MAP else regular).append(row)
+        with self._lock:
+            self.conn.execute("BEGIN")
+            # special writes (errors, interrupts) are replaced, regular ones are written once
+            self.conn.executemany("INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", special)
+            self.conn.executemany("INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", regular)
+            self.conn.execute("COMMIT")
+
+    def delete_thread(self, thread_id:str)->None:
+        with self._lock:
+            self.conn.execute("BEGIN")
+            for table in ("checkpoints", "blobs", "writes"):
+                self.conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            self.conn.execute("COMMIT")
+            self._forget(thread_id)
+
+    async def aget_tuple(self, config:RunnableConfig)->Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config:Optional[RunnableConfig],
+        *,
+        filter:Optional[dict]=None,
+        before:Optional[RunnableConfig]=None,
+        limit:Optional[int]=None,
+    )->AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config:RunnableConfig, checkpoint:Checkpoint, metadata:CheckpointMetadata, new_versions:ChannelVersions)->RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config:RunnableConfig, writes:Sequence[Tuple[str, Any]], task_id:str, task_path:str="")->None:
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id:str)->None:
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def get_next_version(self, current:Optional[str], channel:None)->str:
+        # same scheme as the in-memory saver: zero padded counter, sorts as a string
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
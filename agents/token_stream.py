@@ -0,0 +1,150 @@
+"""
+Token level streaming for the compiled agent graphs.
+
+Model tokens come from langgraph's "messages" stream mode as the model produces them,
+tool start/end events from the "custom" stream that ParallelToolNode writes to, so the
+caller sees the first words (and which tools are running) long before the turn is done.
+
+    for event in stream_tokens(app, {"messages": [HumanMessage("hi")]}):
+        if event["event"] == "token":
+            print(event["text"], end="", flush=True)
+
+Events: {"event": "token", "node", "text"}, {"event": "tool_start", "name", "args", "id"},
+{"event": "tool_end", "name", "id", "status", "size", "preview"} and, with steps=True,
+{"event": "step", "node", "messages"} for every finished node.
+"""
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Iterator, List, Optional, Set
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from history_window import message_text
+
+
+def _to_events(mode:str, chunk, steps:bool, streamed:Set[str])->List[dict]:
+    """`streamed` collects the ids of the messages of the run that arrived as chunks"""
+    if mode == "messages":
+        message, metadata = chunk
+        # ToolMessages and inputs also pass through this stream, only model output is a token
+        if isinstance(message, AIMessageChunk):
+            text = message_text(message)
+            if message.id:
+                streamed.add(message.id)
+        elif isinstance(message, AIMessage):
+            text = message_text(message)
+            # a node that returns a finished message (a model that doesn't stream) shows up whole, the
+            # streamed reply itself (same id) would print a second time
+            if message.id in streamed:
+                return []
+        else:
+            return []
+        if text:
+            return [{"event": "token", "node": metadata.get("langgraph_node"), "text": text}]
+        return []
+    if mode == "custom":
+        return [chunk] if isinstance(chunk, dict) and "event" in chunk else []
+    if mode == "updates" and steps:
+        return [{"event": "step", "node": node, "messages": (values or {}).get("messages", [])} for node, values in chunk.items()]
+    return []
+
+
+def _modes(steps:bool)->List[str]:
+    return ["messages", "custom", "updates"] if steps else ["messages", "custom"]
+
+
+def stream_tokens(graph, inputs:dict, config:Optional[dict]=None, steps:bool=False)->Iterator[dict]:
+    """sync version, the graph only runs ahead of the consumer by what langgraph buffers internally"""
+    streamed:Set[str] = set()
+    for mode, chunk in graph.stream(inputs, config, stream_mode=_modes(steps)):
+        yield from _to_events(mode, chunk, steps, streamed)
+
+
+class EventBuffer:
+    """
+    Bounded hand-off between a running graph and a (possibly slow) consumer.
+    Tokens that pile up while the consumer is busy are merged into one event instead of
+    queueing one event per token, and once `max_events` other events are waiting the
+    producer blocks, which stops pulling from the graph until the consumer catches up.
+    """
+
+    def __init__(self, max_events:int=64):
+        self.max_events = max_events
+        self._events:deque = deque()
+        self._closed = False
+        self._changed = asyncio.Condition()
+
+    async def put(self, event:dict):
+        async with self._changed:
+            last = self._events[-1] if self._events else None
+            if event["event"] == "token" and last is not None and last["event"] == "token" and last["node"] == event["node"]:
+                last["text"] += event["text"] # consumer is behind, coalesce instead of growing the queue
+            else:
+                await self._changed.wait_for(lambda: len(self._events) < self.max_events)
+                self._events.append(dict(event))
+            self._changed.notify_all()
+
+    async def close(self):
+        async with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    async def get(self)->Optional[dict]:
+        """next event, None once the producer is done and everything was consumed"""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._events or self._closed)
+            if not self._events:
+                return None
+            event = self._events.popleft()
+            self._changed.notify_all()
+            return event
+
+
+async def astream_tokens(graph, inputs:dict, config:Optional[dict]=None, steps:bool=False, max_events:int=64)->AsyncIterator[dict]:
+    """async version with backpressure through an EventBuffer; errors of the run are re-raised to the consumer"""
+    buffer = EventBuffer(max_events)
+
+    async def produce():
+        streamed:Set[str] = set()
+        try:
+            async for mode, chunk in graph.astream(inputs, config, stream_mode=_modes(steps)):
+                for event in _to_events(mode, chunk, steps, streamed):
+                    await buffer.put(event)
+        finally:
+            await buffer.close()
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            event = await buffer.get()
+            if event is None:
+                break
+            yield event
+        await producer # surfaces an exception of the graph run
+    finally:
+        if not producer.done():
+            producer.cancel() # consumer went away (e.g. client disconnected), stop the run
+
+
+def print_stream(events, prefix:str="AI: ")->str:
+    """REPL helper: prints tokens as they arrive and tool events on their own lines, returns the streamed text"""
+    text:List[str] = []
+    mid_line = False
+    for event in events:
+        if event["event"] == "token":
+            if not mid_line:
+                print(prefix, end="")
+            print(event["text"], end="", flush=True)
+            text.append(event["text"])
+            mid_line = True
+        elif event["event"] in ("tool_start", "tool_end"):
+            if mid_line:
+                print()
+            if event["event"] == "tool_start":
+                print(f"[tool] {event['name']} {event['args']}")
+            else:
+                print(f"[tool] {event['name']} {event['status']}, {event['size']} chars")
+            mid_line = False
+    if mid_line:
+        print()
+    return "".join(text)
@@ -0,0 +1,181 @@
+"""
+Plan-and-execute for the tool-calling agents.
+
+make_plan_tool() wraps a list of tools in one extra `run_plan` tool. Instead of calling the
+tools one turn at a time, the model can send a whole chain in one call:
+
+    run_plan(steps=[
+        {"id": "sum", "tool": "add", "args": '{"a": 3, "b": 4}'},
+        {"id": "product", "tool": "multiply", "args": '{"a": "$sum", "b": 6}'},
+        {"id": "result", "tool": "subtract", "args": '{"a": "$product", "b": 5}'},
+    ])
+
+"$sum" is replaced by the result of step "sum". Steps run as soon as what they reference is
+done, independent ones in parallel, so (3+4)*6-5 costs two model calls instead of four.
+"""
+import contextvars
+import json
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool, StructuredTool
+from pydantic import BaseModel, Field
+
+from parallel_tools import stream_writer, tool_end_event, tool_start_event
+
+REF_RE = re.compile(r"\$([A-Za-z_][\w-]*)")
+
+PLAN_PROMPT = (
+    "When a task needs several tool calls where later calls use earlier results, send them all in one "
+    "run_plan call instead of one tool call per turn; refer to the result of an earlier step as \"$<step id>\"."
+)
+
+
+class PlanStep(BaseModel):
+    id:str = Field(description="short unique name of this step, e.g. 'sum'")
+    tool:str = Field(description="name of the tool to call")
+    args:str = Field(description='JSON object with the tool arguments; a value "$<step id>" is replaced by that step\'s result')
+
+
+class PlanError(ValueError):
+    pass
+
+
+def _references(value:Any)->List[str]:
+    if isinstance(value, str):
+        return REF_RE.findall(value)
+    if isinstance(value, dict):
+        return [ref for v in value.values() for ref in _references(v)]
+    if isinstance(value, list):
+        return [ref for v in value for ref in _references(v)]
+    return []
+
+
+def _resolve(value:Any, results:Dict[str, Any])->Any:
+    if isinstance(value, str):
+        whole = REF_RE.fullmatch(value)
+        if whole:
+            return results[whole.group(1)] # keeps the type, "$sum" -> 7 rather than "7"
+        return REF_RE.sub(lambda m: str(results[m.group(1)]), value)
+    if isinstance(value, dict):
+        return {k: _resolve(v, results) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_resolve(v, results) for v in value]
+    return value
+
+
+def parse_plan(steps:Sequence[PlanStep], tools_by_name:Dict[str, BaseTool])->Dict[str, dict]:
+    """validated steps by id: {"tool", "args", "deps"}; unknown tools, bad json, unknown or circular references raise PlanError"""
+    plan:Dict[str, dict] = {}
+    for step in steps:
+        if step.id in plan:
+            raise PlanError(f"duplicate step id {step.id!r}")
+        if step.tool not in tools_by_name:
+            raise PlanError(f"step {step.id!r}: unknown tool {step.tool!r}, available: {', '.join(tools_by_name)}")
+        try:
+            args = json.loads(step.args) if step.args.strip() else {}
+        except ValueError as e:
+            raise PlanError(f"step {step.id!r}: args are not valid json ({e})")
+        if not isinstance(args, dict):
+            raise PlanError(f"step {step.id!r}: args must be a json object")
+        plan[step.id] = {"tool": step.tool, "args": args, "deps": set(_references(args))}
+    for step_id, step in plan.items():
+        unknown = step["deps"] - set(plan)
+        if unknown:
+            raise PlanError(f"step {step_id!r} refers to unknown step(s) {', '.join(sorted(unknown))}")
+    done:set = set()
+    while len(done) < len(plan):
+        ready = [s for s in plan if s not in done and plan[s]["deps"] <= done]
+        if not ready:
+            raise PlanError(f"circular references between steps {', '.join(s for s in plan if s not in done)}")
+        done.update(ready)
+    return plan
+
+
+class PlanExecutor:
+    """
+    Runs a parsed plan: every step is submitted to the pool as soon as its references are
+    resolved. A failed step fails the steps depending on it; independent branches still finish.
+    """
+
+    def __init__(self, tools:Sequence[BaseTool], max_workers:int=8):
+        self.tools_by_name = {t.name: t for t in tools}
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="plan")
+
+    def _call(self, step_id:str, tool:BaseTool, args:dict, config:Optional[RunnableConfig], write, call_id:str):
+        call = {"name": tool.name, "args": args, "id": f"{call_id}:{step_id}"}
+        write(tool_start_event(call))
+        try:
+            result = tool.invoke(args, config)
+            write(tool_end_event(ToolMessage(tool_call_id=call["id"], name=tool.name, content=str(result))))
+            return result
+        except Exception as e:
+            write(tool_end_event(ToolMessage(tool_call_id=call["id"], name=tool.name, content=f"Error: {e!r}", status="error")))
+            raise
+
+    def run(self, steps:Sequence[PlanStep], config:Optional[RunnableConfig]=None, call_id:str="plan")->Dict[str, dict]:
+        """step id -> {"tool", "args", "result"} or {"tool", "args", "error"}, in plan order"""
+        plan = parse_plan(steps, self.tools_by_name)
+        write = stream_writer()
+        results:Dict[str, Any] = {}
+        report:Dict[str, dict] = {step_id: {"tool": step["tool"]} for step_id, step in plan.items()}
+        pending = dict(plan)
+        running = {}
+        while pending or running:
+            for step_id in [s for s, step in pending.items() if step["deps"] <= set(results)]:
+                step = pending.pop(step_id)
+                args = _resolve(step["args"], results)
+                report[step_id]["args"] = args
+                # a copy of the context per step, langgraph's stream writer and the tracer look their run up there
+                future = self._pool.submit(contextvars.copy_context().run, self._call, step_id, self.tools_by_name[step["tool"]], args, config, write, call_id)
+                running[future] = step_id
+            failed = {s for s, r in report.items() if "error" in r}
+            for step_id in [s for s, step in pending.items() if step["deps"] & failed]:
+                step = pending.pop(step_id)
+                report[step_id].update(args=step["args"], error=f"skipped, depends on failed step(s) {', '.join(sorted(step['deps'] & failed))}")
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step_id = running.pop(future)
+                try:
+                    results[step_id] = future.result()
+                    report[step_id]["result"] = results[step_id]
+                except Exception as e:
+                    report[step_id]["error"] = " ".join(f"{type(e).__name__}: {e}".split())[:300] # one line for the model
+        return report
+
+
+def format_report(report:Dict[str, dict])->str:
+    lines = []
+    for step_id, step in report.items():
+        args = ", ".join(f"{k}={v!r}" for k, v in step.get("args", {}).items())
+        outcome = f"-> {step['result']}" if "result" in step else f"failed: {step['error']}"
+        lines.append(f"{step_id} = {step['tool']}({args}) {outcome}")
+    return "\n".join(lines)
+
+
+def make_plan_tool(tools:Sequence[BaseTool], max_workers:int=8)->BaseTool:
+    """the run_plan tool over `tools`, bind it next to them so the model can pick either"""
+    executor = PlanExecutor(tools, max_workers=max_workers)
+
+    def run_plan(steps:List[PlanStep], config:RunnableConfig)->str:
+        try:
+            return format_report(executor.run(steps, config))
+        except PlanError as e:
+            return f"Invalid plan: {e}"
+
+    return StructuredTool.from_function(
+        run_plan,
+        name="run_plan",
+        description=(
+            "Runs several tool calls in one go. Each step calls one of the tools ("
+            + ", ".join(executor.tools_by_name)
+            + "); a step's args can use \"$<step id>\" to pass the result of an earlier step. "
+            "Independent steps run in parallel. Returns one line per step with its result."
+        ),
+    )
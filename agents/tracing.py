@@ -0,0 +1,303 @@
+"""
+Spans and metrics for graph runs, collected through langchain callbacks.
+
+    tracer = tracer_from_env()       # AGENT_TRACE="jsonl:traces.jsonl,prometheus:metrics.prom"
+    app = instrument(app, tracer)    # tracer None -> the graph is returned untouched, zero cost
+
+Every graph run, node, llm call, tool call and retrieval becomes one span with wall time,
+queue time (nodes: wait since the previous node of the run finished, tools: wait for a
+worker after the tools node started), input/output tokens, payload sizes and cache hits.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+
+from history_window import message_text
+
+
+def payload_size(value:Any)->int:
+    """characters of text in a state update / tool result, a cheap stand-in for bytes on the wire"""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, BaseMessage):
+        return len(message_text(value))
+    if isinstance(value, dict):
+        return sum(payload_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(v) for v in value)
+    if hasattr(value, "page_content"):
+        return len(value.page_content)
+    return len(str(value))
+
+
+class JsonlSink:
+    """one span per line, buffered so a busy service doesn't do a write per span"""
+
+    def __init__(self, path:str, flush_every:int=200):
+        self.path = path
+        self.flush_every = flush_every
+        self._buffer:List[str] = []
+        self._lock = threading.Lock()
+
+    def emit(self, span:dict):
+        with self._lock:
+            self._buffer.append(json.dumps(span))
+            if len(self._buffer) < self.flush_every:
+                return
+            lines, self._buffer = self._buffer, []
+        self._write(lines)
+
+    def _write(self, lines:List[str]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def flush(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if lines:
+            self._write(lines)
+
+
+class PrometheusSink:
+    """
+    Aggregates spans into prometheus text format (histogram of span seconds per kind/name,
+    token and cache counters). The file is rewritten atomically at most every `interval`
+    seconds, so node_exporter's textfile collector (or a cat) always sees a whole file.
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, path:str, interval:float=5.0):
+        self.path = path
+        self.interval = interval
+        self._histograms:Dict[tuple, list] = {} # (kind, name) -> [bucket counts..., count, sum]
+        self._counters:Dict[tuple, float] = {}
+        self._errors:Dict[tuple, int] = {}
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+
+    def emit(self, span:dict):
+        key = (span["kind"], span["name"])
+        seconds = span["wall_ms"] / 1000
+        with self._lock:
+            histogram = self._histograms.setdefault(key, [0] * (len(self.BUCKETS) + 2))
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            for field in ("input_tokens", "output_tokens", "cache_hits", "cache_misses"):
+                if span.get(field):
+                    self._counters[(field,) + key] = self._counters.get((field,) + key, 0) + span[field]
+            if span.get("error"):
+                self._errors[key] = self._errors.get(key, 0) + 1
+            due = span["kind"] == "graph" and time.monotonic() - self._last_write >= self.interval
+        if due:
+            self.flush()
+
+    def render(self)->str:
+        lines = ["# TYPE agent_span_seconds histogram"]
+        with self._lock:
+            for (kind, name), histogram in sorted(self._histograms.items()):
+                labels = f'kind="{kind}",name="{name}"'
+                for bound, count in zip(self.BUCKETS, histogram):
+                    lines.append(f'agent_span_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'agent_span_seconds_bucket{{{labels},le="+Inf"}} {histogram[-2]}')
+                lines.append(f"agent_span_seconds_count{{{labels}}} {histogram[-2]}")
+                lines.append(f"agent_span_seconds_sum{{{labels}}} {histogram[-1]:.6f}")
+            for field in ("input_tokens", "output_tokens", "cache_hits", "cache_misses"):
+                rows = [(key[1:], value) for key, value in sorted(self._counters.items()) if key[0] == field]
+                if rows:
+                    lines.append(f"# TYPE agent_{field}_total counter")
+                    lines.extend(f'agent_{field}_total{{kind="{k}",name="{n}"}} {v}' for (k, n), v in rows)
+            if self._errors:
+                lines.append("# TYPE agent_span_errors_total counter")
+                lines.extend(f'agent_span_errors_total{{kind="{k}",name="{n}"}} {v}' for (k, n), v in sorted(self._errors.items()))
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        text = self.render()
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+            self._last_write = time.monotonic()
+
+
+class Tracer(BaseCallbackHandler):
+    """
+    Callback handler that turns graph runs into spans and hands them to the sinks.
+    Chains that are not the graph itself or one of its nodes (sequences, channel writes, ...)
+    are not recorded, their children are attached to the nearest recorded ancestor.
+    """
+
+    def __init__(self, sinks:Sequence[Any]):
+        self.sinks = list(sinks)
+        self._open:Dict[UUID, dict] = {} # run id -> open span
+        self._parents:Dict[UUID, Optional[UUID]] = {} # any run id -> nearest recorded ancestor
+        self._last_node_end:Dict[UUID, float] = {} # trace id -> when its last node finished
+        self._lock = threading.Lock()
+
+    def _ancestor(self, parent_run_id:Optional[UUID])->Optional[UUID]:
+        if parent_run_id is None or parent_run_id in self._open:
+            return parent_run_id
+        return self._parents.get(parent_run_id)
+
+    def _start(self, kind:str, name:str, run_id:UUID, parent_run_id:Optional[UUID], **fields):
+        now = time.perf_counter()
+        with self._lock:
+            parent = self._ancestor(parent_run_id)
+            parent_span = self._open.get(parent) if parent else None
+            trace = parent_span["trace"] if parent_span else str(run_id)
+            queue_ms = 0.0
+            if kind == "node":
+                previous = self._last_node_end.get(parent_span["_trace_id"]) if parent_span else None
+                queue_ms = (now - (previous or parent_span["_t0"])) * 1000 if parent_span else 0.0
+            elif kind == "tool" and parent_span is not None:
+                queue_ms = (now - parent_span["_t0"]) * 1000
+            self._parents[run_id] = parent
+            self._open[run_id] = {
+                "trace": trace, "span": str(run_id), "parent": str(parent) if parent else None,
+                "kind": kind, "name": name, "start": time.time(), "queue_ms": round(queue_ms, 3),
+                "_t0": now, "_trace_id": parent_span["_trace_id"] if parent_span else run_id, **fields,
+            }
+
+    def _skip(self, run_id:UUID, parent_run_id:Optional[UUID]):
+        with self._lock:
+            self._parents[run_id] = self._ancestor(parent_run_id)
+
+    def _end(self, run_id:UUID, error:Optional[BaseException]=None, **fields):
+        now = time.perf_counter()
+        with self._lock:
+            self._parents.pop(run_id, None)
+            span = self._open.pop(run_id, None)
+            if span is None:
+                return
+            trace_id = span.pop("_trace_id")
+            if span["kind"] == "node":
+                self._last_node_end[trace_id] = now
+            elif span["kind"] == "graph":
+                self._last_node_end.pop(trace_id, None)
+        span["wall_ms"] = round((now - span.pop("_t0")) * 1000, 3)
+        span.update(fields)
+        if error is not None:
+            span["error"] = repr(error)
+        for sink in self.sinks:
+            sink.emit(span)
+
+    # graph and nodes
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name", "chain")
+        node = (metadata or {}).get("langgraph_node")
+        with self._lock:
+            parent = self._open.get(self._ancestor(parent_run_id))
+        if parent_run_id is None or (parent is None and node is None):
+            self._start("graph", name, run_id, None, input_size=payload_size(inputs))
+        elif node == name and parent is not None and parent["kind"] == "graph":
+            self._start("node", name, run_id, parent_run_id, input_size=payload_size(inputs))
+        else:
+            self._skip(run_id, parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id, output_size=payload_size(outputs))
+
+    def on_chain_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id, error=error)
+
+    # llm calls
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        name = (metadata or {}).get("ls_model_name") or kwargs.get("name") or (serialized or {}).get("name", "llm")
+        self._start("llm", name, run_id, parent_run_id, input_size=payload_size(messages))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        self._start("llm", kwargs.get("name") or (serialized or {}).get("name", "llm"), run_id, parent_run_id, input_size=payload_size(prompts))
+
+    def on_llm_end(self, response, *, run_id, parent_run_id=None, **kwargs):
+        input_tokens = output_tokens = 0
+        output_size = 0
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+                output_size += payload_size(message if message is not None else generation.text)
+        self._end(run_id, input_tokens=input_tokens, output_tokens=output_tokens, output_size=output_size)
+
+    def on_llm_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id, error=error)
+
+    # tools
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, tags=None, metadata=None, inputs=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name", "tool")
+        self._start("tool", name, run_id, parent_run_id, input_size=len(input_str or ""))
+
+    def on_tool_end(self, output, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id, output_size=payload_size(getattr(output, "content", output)))
+
+    def on_tool_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id, error=error)
+
+    # retrievals
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name", "retriever")
+        self._start("retriever", name, run_id, parent_run_id, input_size=len(query))
+
+    def on_retriever_end(self, documents, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id, documents=len(documents), output_size=payload_size(documents))
+
+    def on_retriever_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        self._end(run_id, error=error)
+
+    # cache lookups report {"hit": bool} through dispatch_custom_event("cache", ...)
+    def on_custom_event(self, name, data, *, run_id, tags=None, metadata=None, **kwargs):
+        if name != "cache":
+            return
+        with self._lock:
+            span = self._open.get(run_id) or self._open.get(self._parents.get(run_id))
+            if span is not None:
+                field = "cache_hits" if data.get("hit") else "cache_misses"
+                span[field] = span.get(field, 0) + 1
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+
+def tracer_from_env(spec:Optional[str]=None)->Optional[Tracer]:
+    """
+    AGENT_TRACE="jsonl:<path>" and/or "prometheus:<path>", comma separated.
+    Unset means no tracer at all. Sinks are flushed when the process exits.
+    """
+    spec = spec if spec is not None else os.getenv("AGENT_TRACE", "")
+    sinks = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        kind, _, path = part.partition(":")
+        if kind == "jsonl":
+            sinks.append(JsonlSink(path or "traces.jsonl"))
+        elif kind == "prometheus":
+            sinks.append(PrometheusSink(path or "metrics.prom"))
+        else:
+            raise ValueError(f"unknown trace sink '{kind}', use jsonl:<path> or prometheus:<path>")
+    if not sinks:
+        return None
+    tracer = Tracer(sinks)
+    atexit.register(tracer.flush)
+    return tracer
+
+
+def instrument(graph, tracer:Optional[Tracer]):
+    """attaches the tracer to every run of a compiled graph; without a tracer the graph is returned as is"""
+    if tracer is None:
+        return graph
+    return graph.with_config(callbacks=[tracer])